@@ -1,7 +1,29 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse, PlainTextResponse
 from .routers import validate_router, audit_router, reference_router
+from .services import batch, metrics, snapshot, warmup
+from .services.xsd_validator import preload_enabled
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Workers forked by scripts/serve.py are already warm. Otherwise FE_XSD_PRELOAD=1 builds
+    # every cache before serving the first request, else they are built on first use.
+    if not warmup.is_ready():
+        if preload_enabled():
+            warmup.run()
+        else:
+            warmup.mark_ready()
+    # FE_RELOAD_INTERVAL=<seconds> reloads the reference snapshot when its source files change
+    snapshot.start_watcher()
+    yield
+    snapshot.stop_watcher()
+    batch.shutdown()
+
 
-app = FastAPI(title="MCP FE Compliance Service")
+app = FastAPI(title="MCP FE Compliance Service", lifespan=lifespan)
 app.include_router(validate_router)
 app.include_router(audit_router)
 app.include_router(reference_router)
@@ -10,3 +32,18 @@ app.include_router(reference_router)
 @app.get("/")
 def root():
     return {"status": "ok"}
+
+
+@app.get("/ready")
+def ready():
+    """Readiness probe: 503 until the warm-up is done."""
+    status = warmup.status()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics_endpoint():
+    """Prometheus text exposition; 404 when FE_METRICS=0."""
+    if not metrics.ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics disabled (FE_METRICS=0)")
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
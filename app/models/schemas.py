@@ -3,10 +3,11 @@ from typing import List, Optional
 
 
 class ValidateMessageRequest(BaseModel):
-    format: str = Field(..., description="ubl|cii|facturx|cdv|ereporting|annuaire")
+    format: str = Field("auto", description="auto|ubl|creditnote-ubl|cii|facturx|cdv|ereporting|annuaire (auto: detected from the document)")
     profile: Optional[str] = Field(None, description="base|full where applicable")
     flow: Optional[str] = Field(None, description="f1|f6|f10|f13|f14")
     payload: str = Field(..., description="XML content as string or base64; caller handles encoding")
+    schematron: Optional[List[str]] = Field(None, description="Schematron rule sets to run after XSD and rules (see GET /schematron)")
 
 
 class RuleIssue(BaseModel):
@@ -16,10 +17,22 @@ class RuleIssue(BaseModel):
     message: str
 
 
+class SyntaxIssue(BaseModel):
+    line: Optional[int] = None
+    column: Optional[int] = None
+    domain: Optional[str] = None
+    type: Optional[str] = None
+    path: Optional[str] = None
+    message: str
+    count: int = Field(1, description="Occurrences of this error (same message and element path, any position)")
+
+
 class ValidationReport(BaseModel):
     syntax: List[str]
     rules: List[RuleIssue]
     codelists: List[RuleIssue]
+    syntaxIssues: Optional[List[SyntaxIssue]] = Field(None, description="Structured, deduplicated syntax errors (structured reports only; syntax then holds one line per issue)")
+    snapshotVersion: Optional[str] = Field(None, description="Version of the reference snapshot (schemas, rules, codelists) that validated the document")
 
 
 class AuditCapabilitiesRequest(BaseModel):
@@ -46,3 +59,64 @@ class NextStatusRequest(BaseModel):
 
 class NextStatusResponse(BaseModel):
     allowed: List[str]
+
+
+class BatchDocument(ValidateMessageRequest):
+    name: Optional[str] = Field(None, description="Caller reference echoed in the batch results")
+
+
+class ValidateBatchRequest(BaseModel):
+    documents: List[BatchDocument]
+
+
+class BatchItemResult(BaseModel):
+    index: int
+    name: Optional[str] = None
+    valid: bool
+    report: Optional[ValidationReport] = None
+    error: Optional[str] = None
+
+
+class BatchSummary(BaseModel):
+    total: int
+    valid: int
+    invalid: int
+    failed: int
+    syntaxErrors: int
+    ruleIssues: int
+    codelistIssues: int
+    durationSeconds: float
+
+
+class ValidateBatchResponse(BaseModel):
+    summary: BatchSummary
+    results: List[BatchItemResult]
+
+
+class RecordedInvoice(BaseModel):
+    seller: str = Field(..., description="Seller identifier (SIREN BT-30, else VAT number BT-31)")
+    number: str = Field(..., description="Invoice number (BT-1)")
+    issueDate: str = Field(..., description="Issue date AAAA-MM-JJ or AAAAMMJJ, or the year alone")
+
+
+class RecordInvoicesRequest(BaseModel):
+    invoices: List[RecordedInvoice]
+
+
+class CdvMessage(BaseModel):
+    payload: str = Field(..., description="CPPStatut message, XML content as string or base64")
+    name: Optional[str] = Field(None, description="Caller reference echoed in the errors")
+
+
+class CdvIngestRequest(BaseModel):
+    messages: List[CdvMessage] = Field(..., description="Status messages in arrival order")
+
+
+class AnnuaireCheckRequest(BaseModel):
+    recipients: List[str] = Field(..., description="Addressing identifiers: SIREN, SIREN_SIRET, SIREN_SIRET_routing code or SIREN_suffix")
+    date: Optional[str] = Field(None, description="Date AAAA-MM-JJ or AAAAMMJJ (default: today)")
+
+
+class ValidateIdentifiersRequest(BaseModel):
+    identifiers: List[str] = Field(..., description="SIREN, SIRET or VAT numbers (spaces ignored)")
+    kind: str = Field("auto", description="siren, siret, vat or auto (FR prefix -> VAT, 14 characters -> SIRET, else SIREN)")
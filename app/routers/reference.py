@@ -1,57 +1,22 @@
-from fastapi import APIRouter, HTTPException
-from typing import Dict, List
-from pathlib import Path
-import json
+import hmac
+import os
 
-router = APIRouter()
-
-# Minimal fallback rules so /rules/* works even if annex cache is missing in deployment
-DEFAULT_RULES: Dict[str, Dict] = {
-    "G1.01": {
-        "title": "Types de facture autorisés",
-        "description": (
-            "Les types de factures autorisés (UNTDID 1001) incluent notamment : "
-            "380/381/384/389/393/501 pour les factures, 386/500 pour acomptes, "
-            "471/472/473 pour rectificatives, 261/396/502/503 pour avoirs."
-        ),
-        "flows": ["f1", "f6", "f10"],
-        "severity": "error",
-    },
-    "G1.02": {
-        "title": "Cadre de facturation",
-        "description": "Le cadre de facturation doit appartenir à la codelist CADRES (B1, S1, M1, ...).",
-        "flows": ["f1"],
-        "severity": "error",
-    },
-    "G1.05": {
-        "title": "Identifiant de facture",
-        "description": "ID obligatoire, 1 à 35 caractères autorisés (A–Z, a–z, 0–9, espace, - + _ /).",
-        "flows": ["f1"],
-        "severity": "error",
-    },
-    "G1.09": {
-        "title": "Date d'émission",
-        "description": "Date obligatoire ; format AAAA-MM-JJ (UBL) ou AAAAMMJJ (CII/e-reporting).",
-        "flows": ["f1", "f10"],
-        "severity": "error",
-    },
-    "G1.10": {
-        "title": "Devise",
-        "description": "La devise doit appartenir à la codelist ISO4217.",
-        "flows": ["f1"],
-        "severity": "error",
-    },
-}
-
-RULES: Dict[str, Dict] = DEFAULT_RULES.copy()
+from fastapi import APIRouter, Header, HTTPException, Query, Request, Response
+from starlette.concurrency import run_in_threadpool
+from typing import Dict, Optional
+from ..models.schemas import AnnuaireCheckRequest, CdvIngestRequest, RecordInvoicesRequest, ValidateIdentifiersRequest
+from ..services import annuaire, codelists, duplicates, identifiers, lifecycle, pipeline, snapshot
+from ..services.xml_parser import parse_xml
 
-CODELISTS: Dict[str, List[Dict]] = {}
+# Token expected in X-Admin-Token by POST /snapshot/reload, /duplicates, /cdv/ingest and /annuaire/load;
+# they are refused when unset, unless explicitly opened with FE_ADMIN_OPEN=1 (local development)
+ADMIN_TOKEN_ENV = "FE_ADMIN_TOKEN"
+ADMIN_OPEN_ENV = "FE_ADMIN_OPEN"
 
-REQUIRED_FIELDS = {
-    ("base", "f1"): ["BT-1", "BT-2", "BT-3", "BT-5", "BT-27", "BT-44"],
-    ("full", "f1"): ["BT-1", "BT-2", "BT-3", "BT-5", "BT-27", "BT-44"],
-}
+router = APIRouter()
 
+# Published "allowed" contract of /next_status and the get_next_status MCP tool; the lifecycle graph
+# enforced by /cdv/ingest (lifecycle.TRANSITIONS) is returned next to it as "transitions"
 NEXT_STATUS_MAP = {
     None: ["CDV-200"],
     "CDV-200": ["CDV-202"],
@@ -62,200 +27,53 @@ NEXT_STATUS_MAP = {
 }
 
 
-def _load_caches():
-    """Load codelists from annex cache if available; fall back to embedded defaults."""
-    base = Path(__file__).resolve().parents[2] / "data/annexes_cache"
-    embedded = Path(__file__).resolve().parents[2] / "data/annexes_cache_embedded"
-    defaults = {
-        "UNTDID1001": [
-            {"code": "380", "label": "Facture"},
-            {"code": "381", "label": "Avoir"},
-            {"code": "384", "label": "Facture rectificative"},
-            {"code": "389", "label": "Facture auto-facturée"},
-            {"code": "393", "label": "Facture affacturée"},
-            {"code": "501", "label": "Facture auto-facturée affacturée"},
-            {"code": "386", "label": "Facture d'acompte"},
-            {"code": "500", "label": "Facture d’acompte auto-facturée"},
-            {"code": "471", "label": "Facture rectificative auto-facturée"},
-            {"code": "472", "label": "Facture rectificative affacturée"},
-            {"code": "473", "label": "Facture rectificative auto-facturée affacturée"},
-            {"code": "261", "label": "Avoir auto-facturé"},
-            {"code": "396", "label": "Avoir affacturé"},
-            {"code": "502", "label": "Avoir auto-facturé affacturé"},
-            {"code": "503", "label": "Avoir de facture d'acompte"},
-        ],
-        "CDV_REFUS": [
-            {"code": "DEST_ERR", "label": "Erreur de destinataire"},
-            {"code": "DOUBLE_FACT", "label": "Données réglementaire F1 en doublon"},
-            {"code": "JUSTIF_ABS", "label": "Justificatif absent ou insuffisant"},
-            {"code": "ERR_VALIDEUR", "label": "Mauvais valideur"},
-            {"code": "CMD_EJ_ERR", "label": "Commande/Engagement incorrect ou manquant"},
-        ],
-        "CADRES": ["B1", "S1", "M1", "B2", "S2", "M2", "B4", "S4", "M4", "S5", "S6", "B7", "S7"],
-    }
-    if base.exists():
-        cache_base = base
-    elif embedded.exists():
-        cache_base = embedded
-    else:
-        CODELISTS.update(defaults)
-        return
-    # Motifs de refus depuis l'annexe 7 si présent
-    motifs_path = cache_base / "20251031_Annexe 7 - Règles de gestion - V1.8.json"
-    if motifs_path.exists():
-        try:
-            data = json.loads(motifs_path.read_text(encoding="utf-8"))
-            sheet = data.get("Tableau des motifs de refus", [])
-            if sheet and len(sheet) > 1:
-                header = sheet[0]
-                codes = []
-                for row in sheet[1:]:
-                    if not row or len(row) < 2:
-                        continue
-                    code = row[0]
-                    label = row[1]
-                    if code:
-                        codes.append({"code": str(code), "label": label or ""})
-                if codes:
-                    defaults["CDV_REFUS"] = codes
-        except Exception:
-            pass
-    CODELISTS.update(defaults)
-
-    # Rules from Annexe 7 - Règles de gestion
-    rules_path = base / "20251031_Annexe 7 - Règles de gestion - V1.8.json"
-    flows_map = {3: "f1", 4: "f6", 5: "f10", 6: "f13", 7: "f14"}
-    if rules_path.exists():
-        try:
-            data = json.loads(rules_path.read_text(encoding="utf-8"))
-            sheet = data.get("Règles de gestion", [])
-            for row in sheet[2:]:
-                if not row or len(row) < 2:
-                    continue
-                rid = row[1]
-                title = row[0]
-                label = row[2] if len(row) > 2 else ""
-                if not rid or not isinstance(rid, str):
-                    continue
-                flows = []
-                for idx, f in flows_map.items():
-                    if len(row) > idx and row[idx] == "X":
-                        flows.append(f)
-                RULES[rid] = {"title": title or "", "description": label or "", "flows": flows, "severity": "error"}
-        except Exception:
-            pass
-
-    # Required fields from Annexe 6 (e-reporting)
-    annex6 = cache_base / "20251031_Annexe 6 - Format sémantique FE e-reporting - V1.9.json"
-    if annex6.exists():
-        try:
-            data = json.loads(annex6.read_text(encoding="utf-8"))
-            sheet = data.get("E-REPORTING - Flux 10", [])
-            req = []
-            for row in sheet:
-                if not row or len(row) < 2:
-                    continue
-                bt = row[0]
-                card = str(row[1]).strip() if row[1] is not None else ""
-                if bt and isinstance(bt, str) and card.startswith("1.."):
-                    req.append(bt)
-            if req:
-                REQUIRED_FIELDS[("base", "f10")] = req
-                REQUIRED_FIELDS[("full", "f10")] = req
-        except Exception:
-            pass
-
-    # Required fields from Annexe 3 (annuaire)
-    annex3 = cache_base / "20251031_Annexe 3 - Format sémantique FE annuaire - V1.7.json"
-    if annex3.exists():
-        try:
-            data = json.loads(annex3.read_text(encoding="utf-8"))
-            for sheet_name, flow in [("FE - F13 (Actualisation)", "f13"), ("FE - F14 (Consultation)", "f14")]:
-                sheet = data.get(sheet_name, [])
-                req = []
-                for row in sheet:
-                    if not row or len(row) < 2:
-                        continue
-                    bt = row[0]
-                    card = str(row[1]).strip() if row[1] is not None else ""
-                    if bt and isinstance(bt, str) and card.startswith("1.."):
-                        req.append(bt)
-                if req:
-                    REQUIRED_FIELDS[("base", flow)] = req
-                    REQUIRED_FIELDS[("full", flow)] = req
-        except Exception:
-            pass
-
-    # Required fields from Annexe 1 (FE - Flux 1 - UBL)
-    annex1 = cache_base / "20251031_Annexe 1 - Format sémantique FE e-invoicing - Flux 1 v1.1.json"
-    if annex1.exists():
-        try:
-            data = json.loads(annex1.read_text(encoding="utf-8"))
-            sheet = data.get("FE - Flux 1 - UBL", [])
-            req_base = []
-            req_full = []
-            for row in sheet:
-                if not row or len(row) < 2:
-                    continue
-                bt = row[0]
-                card = str(row[1]).strip() if row[1] is not None else ""
-                base_flag = row[17] if len(row) > 17 else None
-                full_flag = row[18] if len(row) > 18 else None
-                if not bt or not isinstance(bt, str):
-                    continue
-                if card.startswith("1.."):  # obligatoire
-                    if base_flag == "X":
-                        req_base.append(bt)
-                    if full_flag == "X":
-                        req_full.append(bt)
-            if req_base:
-                REQUIRED_FIELDS[("base", "f1")] = req_base
-            if req_full:
-                REQUIRED_FIELDS[("full", "f1")] = req_full
-        except Exception:
-            pass
-
-    # Extract ISO codes from EN16931 Codelists (best-effort)
-    codelists_sheet = cache_base / "20251031_Annexe 7 - Règles de gestion - V1.8.json"
-    if codelists_sheet.exists():
-        try:
-            data = json.loads(codelists_sheet.read_text(encoding="utf-8"))
-            rows = data.get("EN16931 Codelists", [])
-            iso4217 = []
-            iso3166 = []
-            for row in rows:
-                if not row or len(row) < 24:
-                    continue
-                # Currency code sometimes in col 23, country alpha2 in col 16/17, country name in 19/20.
-                currency_code = row[23]
-                if currency_code and isinstance(currency_code, str) and len(currency_code.strip()) == 3:
-                    iso4217.append({"code": currency_code.strip(), "label": str(row[20] if len(row) > 20 else "")})
-                country_alpha2 = row[16] if len(row) > 16 else None
-                if country_alpha2 and isinstance(country_alpha2, str) and len(country_alpha2.strip()) == 2:
-                    iso3166.append({"code": country_alpha2.strip(), "label": str(row[19] if len(row) > 19 else "")})
-            if iso4217:
-                CODELISTS["ISO4217"] = iso4217
-            if iso3166:
-                CODELISTS["ISO3166"] = iso3166
-        except Exception:
-            pass
-
-
-_load_caches()
-
-
 @router.get("/rules/{rule_id}")
 def get_rule(rule_id: str):
-    if rule_id not in RULES:
+    rules = snapshot.current().rules
+    if rule_id not in rules:
         raise HTTPException(status_code=404, detail="Rule not found")
-    return {"id": rule_id, **RULES[rule_id]}
+    return {"id": rule_id, **rules[rule_id]}
 
 
-@router.get("/codelists/{name}")
-def get_codelist(name: str):
-    if name not in CODELISTS:
+def _cached_json(request: Request, body: bytes, etag: str) -> Response:
+    """Pre-serialised JSON body, or 304 when the client already holds this ETag."""
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if codelists.etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+def _codelist(name: str) -> codelists.Codelist:
+    codelist = snapshot.current().codelist_index.get(name)
+    if codelist is None:
         raise HTTPException(status_code=404, detail="Codelist not found")
-    return CODELISTS[name]
+    return codelist
+
+
+@router.get("/codelists")
+def list_codelists(request: Request):
+    index = snapshot.current().codelist_index
+    return _cached_json(request, index.names_body, index.names_etag)
+
+
+@router.get("/codelists/{name}")
+def get_codelist(
+    name: str,
+    request: Request,
+    prefix: Optional[str] = Query(None, description="Only entries whose code or label starts with this (case-insensitive)"),
+    limit: int = Query(50, ge=1, le=1000, description="Maximum entries returned with prefix"),
+):
+    codelist = _codelist(name)
+    if prefix:
+        return codelist.search(prefix, limit)
+    return _cached_json(request, codelist.body, codelist.etag)
+
+
+@router.get("/codelists/{name}/{code}")
+def check_code(name: str, code: str):
+    """Membership of one code (exact match, as in the codelist rules)."""
+    codelist = _codelist(name)
+    return {"codelist": name, "code": code, "valid": code in codelist, "label": codelist.label(code)}
 
 
 @router.get("/required_fields")
@@ -266,20 +84,191 @@ def get_required_fields(profile: str, flow: str):
     présents dans les caches XLSX→JSON.
     """
     key = (profile.lower(), flow.lower())
-    if key not in REQUIRED_FIELDS:
+    required_fields = snapshot.current().required_fields
+    if key not in required_fields:
         raise HTTPException(status_code=404, detail="No required fields for profile/flow")
-    fields = REQUIRED_FIELDS[key]
+    fields = required_fields[key]
     # Nettoyage léger : trim et suppression des entrées vides
     return [f.strip() for f in fields if isinstance(f, str) and f.strip()]
 
 
 @router.get("/refusal_codes")
-def refusal_codes():
-    return CODELISTS.get("CDV_REFUS", [])
+def refusal_codes(request: Request):
+    codelist = snapshot.current().codelist_index.get("CDV_REFUS")
+    if codelist is None:
+        return []
+    return _cached_json(request, codelist.body, codelist.etag)
 
 
 @router.post("/next_status")
 def next_status(payload: Dict):
+    """Statuses allowed after current, or after the stored status of invoice when given.
+
+    allowed is the published map; transitions the full lifecycle graph checked by /cdv/ingest.
+    """
     current = payload.get("current")
+    if payload.get("invoice"):
+        current = lifecycle.get_store().current(payload["invoice"])
     allowed = NEXT_STATUS_MAP.get(current, [])
-    return {"allowed": allowed}
+    return {"allowed": allowed, "transitions": lifecycle.TRANSITIONS.get(current, [])}
+
+
+@router.get("/snapshot")
+def snapshot_status():
+    """Reference snapshot in use (version, load time), reload count and last reload error."""
+    return snapshot.status()
+
+
+def _check_admin(x_admin_token: Optional[str]) -> None:
+    """Fail closed: 503 when no admin token is configured, 403 when the header does not match it."""
+    token = os.environ.get(ADMIN_TOKEN_ENV)
+    if not token:
+        if os.environ.get(ADMIN_OPEN_ENV, "").strip().lower() in {"1", "true", "yes"}:
+            return
+        raise HTTPException(status_code=503, detail=f"Admin endpoints disabled: set {ADMIN_TOKEN_ENV}")
+    if not hmac.compare_digest((x_admin_token or "").encode("utf-8"), token.encode("utf-8")):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+
+@router.post("/snapshot/reload")
+def reload_snapshot(
+    force: bool = Query(False, description="Publish a new snapshot even when the sources are unchanged"),
+    x_admin_token: Optional[str] = Header(None),
+):
+    """Load and compile a new reference snapshot, then publish it; running validations finish on the previous one."""
+    _check_admin(x_admin_token)
+    try:
+        return snapshot.reload(force)
+    except Exception as exc:
+        raise HTTPException(status_code=500, detail=f"Reload failed, snapshot {snapshot.current().version} kept: {exc}")
+
+
+@router.get("/duplicates")
+def duplicate_index_stats():
+    """Duplicate invoice index (DOUBLE_FACT): recorded keys, Bloom filter size, lookups and database queries."""
+    return duplicates.get_index().stats()
+
+
+@router.post("/duplicates")
+def record_invoices(req: RecordInvoicesRequest, x_admin_token: Optional[str] = Header(None)):
+    """Record accepted invoices in the duplicate index; already recorded keys are ignored."""
+    _check_admin(x_admin_token)
+    index = duplicates.get_index()
+    added = index.add_many(duplicates.DuplicateKey.of(i.seller, i.number, i.issueDate) for i in req.invoices)
+    return {"received": len(req.invoices), "added": added, "generation": index.generation}
+
+
+@router.get("/cdv")
+def cdv_store_stats():
+    """CDV lifecycle store: tracked invoices per status, messages received and transitions rejected."""
+    return lifecycle.get_store().stats()
+
+
+@router.get("/cdv/status/{invoice:path}")
+def cdv_invoice_status(invoice: str):
+    """Current status and accepted transitions of an invoice (supplier identifier/IdFacture)."""
+    store = lifecycle.get_store()
+    status = store.current(invoice)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Invoice not tracked")
+    return {"invoice": invoice, "status": status, "allowed": lifecycle.TRANSITIONS.get(status, []),
+            "history": store.history(invoice)}
+
+
+@router.post("/cdv/ingest")
+def ingest_cdv(req: CdvIngestRequest, x_admin_token: Optional[str] = Header(None)):
+    """Record CDV status messages in arrival order; transitions not allowed from the stored status are rejected."""
+    _check_admin(x_admin_token)
+    events, owners, errors = [], [], []
+    for index, message in enumerate(req.messages):
+        try:
+            found = lifecycle.events_from_tree(parse_xml(pipeline.decode_payload(message.payload)))
+        except Exception as exc:
+            errors.append({"message": index, "name": message.name, "error": str(exc)})
+            continue
+        if not found:
+            errors.append({"message": index, "name": message.name, "error": "No invoice status (CPPFactureStatutUnitaire) found"})
+        events.extend(found)
+        owners.extend([index] * len(found))
+    outcomes = lifecycle.get_store().ingest(events)
+    counts = {"accepted": 0, "duplicate": 0, "rejected": 0}
+    for outcome in outcomes:
+        counts[outcome.result] += 1
+    return {
+        "received": len(req.messages),
+        "events": len(outcomes),
+        **counts,
+        "results": [{"message": owner, **outcome._asdict()} for owner, outcome in zip(owners, outcomes)],
+        "errors": errors,
+    }
+
+
+@router.get("/annuaire")
+def annuaire_index_stats():
+    """Annuaire index: addressing lines, interned routing codes and suffixes, memory used by the line arrays."""
+    return annuaire.get_index().stats()
+
+
+@router.post("/annuaire/load")
+async def load_annuaire(request: Request, x_admin_token: Optional[str] = Header(None)):
+    """Merge an F13 (actualisation) or F14 (consultation) XML body into the annuaire index of every worker."""
+    _check_admin(x_admin_token)
+    body = await request.body()
+    try:
+        return await run_in_threadpool(annuaire.load, body)
+    except annuaire.AnnuaireError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+
+@router.post("/annuaire/check")
+def check_recipients(req: AnnuaireCheckRequest):
+    """Addressability of many recipients at one date, as parallel lists in request order."""
+    index = annuaire.get_index()
+    resolutions = [annuaire.resolve(recipient, req.date, index) for recipient in req.recipients]
+    return {
+        "date": str(annuaire.date_value(req.date)),
+        "addressable": [r.addressable for r in resolutions],
+        "platforms": [r.line.platform if r.addressable else None for r in resolutions],
+    }
+
+
+@router.get("/annuaire/{identifier}")
+def consult_annuaire(identifier: str, date: Optional[str] = Query(None, description="AAAA-MM-JJ or AAAAMMJJ (default: today)")):
+    """F14-style consultation: resolution of an addressing identifier and every line of its SIREN."""
+    recipient = annuaire.parse_recipient(identifier)
+    if recipient is None:
+        raise HTTPException(status_code=400, detail="Invalid addressing identifier")
+    index = annuaire.get_index()
+    resolution = index.resolve(recipient, annuaire.date_value(date))
+    return {
+        "identifiant": identifier,
+        "date": str(annuaire.date_value(date)),
+        "adressable": resolution.addressable,
+        "motif": resolution.reason,
+        "ligne": annuaire.line_json(resolution.line) if resolution.line else None,
+        "lignes": [annuaire.line_json(index.line(i)) for i in index.lines_of(recipient.siren)],
+    }
+
+
+def _identifier_report(values, kind: str) -> Dict:
+    try:
+        return identifiers.validate_report(values, kind)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+
+@router.post("/identifiers/validate")
+def validate_identifiers(req: ValidateIdentifiersRequest):
+    """Bulk SIREN/SIRET/VAT check: counts and one result code per identifier, in request order."""
+    return _identifier_report(req.identifiers, req.kind)
+
+
+@router.post("/identifiers/validate/raw")
+async def validate_identifiers_raw(request: Request, kind: str = Query("auto", description="siren, siret, vat or auto")):
+    """Same as /identifiers/validate for a text body with one identifier per line (no JSON decoding of millions of strings)."""
+    body = await request.body()
+    try:
+        values = body.decode("utf-8").splitlines()
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="Body is not UTF-8 text")
+    return await run_in_threadpool(_identifier_report, values, kind)
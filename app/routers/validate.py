@@ -1,64 +1,299 @@
-from fastapi import APIRouter, HTTPException
-from ..models.schemas import ValidateMessageRequest, ValidationReport
-from ..services.xsd_validator import XSDValidator
-from ..services import rules_engine
-from pathlib import Path
-import base64
+import contextlib
+import zipfile
+from typing import Annotated, AsyncIterator, Callable, Iterator, List, Optional
+import anyio.from_thread
+from fastapi import APIRouter, File, Form, HTTPException, Query, Request, UploadFile
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import FormData, UploadFile as FormFile
+from ..models.schemas import ValidateBatchRequest, ValidateBatchResponse, ValidateMessageRequest, ValidationReport
+from ..services import batch, detect, events, pipeline, result_cache, schematron, streaming
+from ..services.xsd_validator import get_registry
 
 router = APIRouter()
 
+RAW_CHUNK_SIZE = 64 * 1024
+# Issue batches buffered between the streaming parser thread and the response
+STREAM_BUFFER = 16
 
-def extract_facturx_xml(pdf_bytes: bytes) -> bytes:
-    """Very simple extraction: locate embedded XML inside a Factur-X PDF."""
-    if not pdf_bytes.startswith(b"%PDF"):
-        raise ValueError("Payload is not a PDF (missing %PDF header)")
-    start = pdf_bytes.find(b"<?xml")
-    if start == -1:
-        raise ValueError("No embedded XML found in Factur-X payload")
-    # Try to cut at the end of CrossIndustryInvoice or Invoice tag to avoid trailing PDF bytes
-    end = -1
-    for marker in [b"</rsm:CrossIndustryInvoice>", b"</Invoice>"]:
-        idx = pdf_bytes.find(marker, start)
-        if idx != -1:
-            end = idx + len(marker)
-            break
-    if end == -1:
-        end = len(pdf_bytes)
-    return pdf_bytes[start:end]
+
+def _rule_sets(value) -> tuple:
+    """Requested Schematron rule sets (list or comma-separated string), checked before any validation work."""
+    if isinstance(value, str):
+        value = value.split(",")
+    names = tuple(n.strip() for n in value or () if n and n.strip())
+    try:
+        schematron.check_rule_sets(names)
+    except schematron.UnknownRuleSet as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    return names
+
+
+def _output(output: Optional[str], request: Optional[Request] = None) -> str:
+    try:
+        return events.output_format(output, request.headers.get("accept", "") if request is not None else "")
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+
+def _event_response(issues: Iterator[events.Event], output: str) -> StreamingResponse:
+    """NDJSON / SSE response over an issue event iterator (run in the threadpool by Starlette)."""
+    encode = events.encoder(output)
+    return StreamingResponse((encode((event,)) for event in issues), media_type=events.MEDIA_TYPES[output])
+
+
+OutputParam = Annotated[Optional[str], Query(description="report|ndjson|sse: issues streamed as they are produced, then a summary")]
+StructuredParam = Annotated[bool, Query(description="Structured, deduplicated syntax errors in syntaxIssues (report output)")]
+MaxErrorsParam = Annotated[Optional[int], Query(ge=0, description="Stop after this many issues (streamed output; 0 = no limit)")]
 
 
 @router.post("/validate_message", response_model=ValidationReport)
-def validate_message(req: ValidateMessageRequest):
-    # payload may be raw XML string or base64-encoded
-    raw = req.payload
-    # Accept either raw XML (string) or base64; allow BOM/UTF-8 characters.
+def validate_message(req: ValidateMessageRequest, output: OutputParam = None, max_errors: MaxErrorsParam = None,
+                     structured: StructuredParam = False):
+    rule_sets = _rule_sets(req.schematron)
+    output = _output(output)
+    try:
+        if output != "report":
+            return _event_response(pipeline.stream_payload(req.payload, req.format, req.flow, req.profile, rule_sets, max_errors), output)
+        return pipeline.validate_payload(req.payload, req.format, req.flow, req.profile, rule_sets, structured)
+    except pipeline.PayloadError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+
+def _raw_param(name: str, value: Optional[str], request: Request, form: Optional[FormData]) -> Optional[str]:
+    """Query parameter, then multipart field, then X-FE-<Name> header."""
+    if value:
+        return value
+    if form is not None and isinstance(form.get(name), str):
+        return form[name]
+    return request.headers.get(f"X-FE-{name.capitalize()}")
+
+
+async def _body_chunks(request: Request, upload: Optional[FormFile]) -> AsyncIterator[bytes]:
+    if upload is not None:
+        while chunk := await upload.read(RAW_CHUNK_SIZE):
+            yield chunk
+    else:
+        async for chunk in request.stream():
+            yield chunk
+
+
+async def _next_chunk(chunks: AsyncIterator[bytes]) -> Optional[bytes]:
+    try:
+        return await chunks.__anext__()
+    except StopAsyncIteration:
+        return None
+
+
+def _feed_document(document: pipeline.IncrementalDocument, head: bytes, chunks: AsyncIterator[bytes]) -> None:
+    """Parse the body in one threadpool thread, pulling each chunk from the event loop.
+
+    The parse stays off the event loop, and on a single thread as libxml2 feed parsers require
+    (one run_in_threadpool call per chunk could land on a different thread each time).
+    """
+    document.feed(head)
+    while (chunk := anyio.from_thread.run(_next_chunk, chunks)) is not None:
+        document.feed(chunk)
+    document.finish()
+
+
+def _feed_stream(stream: streaming.EReportingStream, chunks: AsyncIterator[bytes],
+                 emit: Callable[[List[events.Event]], None]) -> None:
+    """Run an e-reporting stream over the body in one threadpool thread, like _feed_document.
+
+    emit() receives each non-empty batch of issues, then the closing batch with the summary.
+    """
+    while (chunk := anyio.from_thread.run(_next_chunk, chunks)) is not None:
+        found = stream.feed(chunk)
+        if found:
+            emit(found)
+    emit(stream.close())
+
+
+async def _reread(upload: FormFile) -> bytes:
+    await upload.seek(0)
+    return await upload.read()
+
+
+@router.post("/validate_message/raw", response_model=ValidationReport)
+async def validate_message_raw(
+    request: Request,
+    format: Optional[str] = Query(None, description="auto|ubl|creditnote-ubl|cii|facturx|cdv|ereporting|annuaire (or X-FE-Format header; default auto)"),
+    flow: Optional[str] = Query(None, description="f1|f6|f10|f13|f14 (or X-FE-Flow header)"),
+    profile: Optional[str] = Query(None, description="base|full (or X-FE-Profile header)"),
+    rule_set_names: Optional[str] = Query(None, alias="schematron", description="Comma-separated Schematron rule sets (or X-FE-Schematron header)"),
+    output: OutputParam = None,
+    max_errors: MaxErrorsParam = None,
+    structured: StructuredParam = False,
+):
+    """Validate an application/xml, application/pdf or multipart body without base64/JSON wrapping.
+
+    XML bodies are fed to the parser as they arrive; Factur-X PDFs are read once (multipart
+    uploads spooled to disk are memory-mapped). output=ndjson|sse (or a matching Accept
+    header) streams the issues instead of returning one report. Without a format (or with
+    format=auto) it is detected from the first bytes, the file name of an upload giving the
+    Base_/Full_ profile.
+    """
+    output = _output(output, request)
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    form = await request.form() if content_type == "multipart/form-data" else None
     try:
-        stripped = raw.strip()
-        if stripped.startswith("<") or stripped.startswith("\ufeff<"):
-            xml_bytes = stripped.encode("utf-8")
-        else:
-            xml_bytes = base64.b64decode(raw)
-    except Exception as exc:
-        raise HTTPException(status_code=400, detail=f"Invalid payload encoding: {exc}")
-
-    fmt_for_schema = req.format
-    fmt_for_rules = req.format
-    # Handle Factur-X (PDF + embedded XML) by extracting the embedded XML and validating as CII
-    if req.format.lower() == "facturx":
-        try:
-            xml_bytes = extract_facturx_xml(xml_bytes)
-            fmt_for_schema = "cii"
-            fmt_for_rules = "cii"
-        except Exception as exc:
-            raise HTTPException(status_code=400, detail=f"Failed to extract Factur-X XML: {exc}")
-
-    validator = XSDValidator(base_dir=Path(__file__).resolve().parents[2] / "data/xsd")
-    syntax_errors = validator.validate(xml_bytes, fmt_for_schema, req.flow, req.profile)
-
-    rule_issues, codelist_issues = rules_engine.evaluate(xml_bytes, fmt_for_rules, req.flow)
-
-    return ValidationReport(
-        syntax=syntax_errors,
-        rules=rule_issues,
-        codelists=codelist_issues,
-    )
+        fmt = _raw_param("format", format, request, form) or ("facturx" if content_type == "application/pdf" else detect.AUTO)
+        flow = _raw_param("flow", flow, request, form)
+        profile = _raw_param("profile", profile, request, form)
+        rule_sets = _rule_sets(_raw_param("schematron", rule_set_names, request, form))
+        upload = None
+        if form is not None:
+            upload = next((v for v in form.values() if isinstance(v, FormFile)), None)
+            if upload is None:
+                raise HTTPException(status_code=400, detail="Multipart body holds no file")
+        name = upload.filename if upload is not None else None
+        chunks = _body_chunks(request, upload)
+        # format=auto: a PDF is only recognised once its first bytes are read
+        head = b""
+        auto = detect.is_auto(fmt)
+        if auto:
+            async for chunk in chunks:
+                head += chunk
+                if head.strip():
+                    break
+        # With format=auto the pipeline detects the flow and profile of the PDF as well
+        if fmt.lower() == "facturx" or (auto and detect.is_pdf(head)):
+            body = None
+            if upload is None:
+                body = head + b"".join([chunk async for chunk in chunks]) if auto else await request.body()
+            if output != "report":
+                data = body if body is not None else await _reread(upload)
+                issues = await run_in_threadpool(pipeline.stream_bytes, data, fmt, flow, profile, rule_sets, max_errors, name)
+                return _event_response(issues, output)
+            if upload is not None:
+                # Spooled uploads are memory-mapped for extraction
+                await upload.seek(0)
+                return await run_in_threadpool(pipeline.validate_facturx_file, upload.file, flow, profile, rule_sets,
+                                               structured, name, auto)
+            return await run_in_threadpool(pipeline.validate_bytes, body, fmt, flow, profile, rule_sets, structured, name)
+        document = pipeline.IncrementalDocument()
+        await run_in_threadpool(_feed_document, document, head, chunks)
+        if output != "report":
+            return _event_response(pipeline.stream_document(document, fmt, flow, profile, rule_sets, max_errors, name),
+                                   output)
+        return await run_in_threadpool(pipeline.validate_document, document, fmt, flow, profile, rule_sets, structured, name)
+    except pipeline.PayloadError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    finally:
+        if form is not None:
+            await form.close()
+
+
+class _BodyStreamingResponse(StreamingResponse):
+    """StreamingResponse whose generator still reads the request body.
+
+    Starlette's disconnect listener would otherwise compete with request.stream() for
+    receive() and swallow body chunks; a gone client surfaces as a send error instead.
+    """
+
+    async def __call__(self, scope, receive, send) -> None:
+        await self.stream_response(send)
+
+
+@router.post("/validate_message/stream")
+async def validate_message_stream(
+    request: Request,
+    flow: Optional[str] = Query(None, description="f10 (or X-FE-Flow header)"),
+    profile: Optional[str] = Query(None, description="(or X-FE-Profile header)"),
+    output: OutputParam = None,
+    max_errors: MaxErrorsParam = None,
+):
+    """Validate a large e-reporting body as a stream, with flat memory.
+
+    ndjson/sse output sends each issue as soon as it is found, then a summary; report output
+    collects them into the usual ValidationReport.
+    """
+    fmt = request.headers.get("X-FE-Format") or "ereporting"
+    if fmt.lower() != streaming.FORMAT:
+        raise HTTPException(status_code=400, detail="Streaming validation only supports format=ereporting")
+    output = _output(output, request)
+    stream = streaming.EReportingStream(_raw_param("flow", flow, request, None), _raw_param("profile", profile, request, None),
+                                        max_errors=max_errors)
+
+    if output == "report":
+        collected = []
+        await run_in_threadpool(_feed_stream, stream, request.stream(), collected.extend)
+        return events.to_report(collected)
+
+    encode = events.encoder(output)
+
+    async def lines():
+        # The parser thread hands its issues back through a memory stream as they are found
+        send, receive = anyio.create_memory_object_stream(STREAM_BUFFER)
+
+        def emit(found: List[events.Event]) -> None:
+            anyio.from_thread.run(send.send, found)
+
+        async def produce():
+            # A closed receiver (client gone) stops the parse at its next batch
+            async with send:
+                with contextlib.suppress(anyio.BrokenResourceError):
+                    await run_in_threadpool(_feed_stream, stream, request.stream(), emit)
+
+        async with anyio.create_task_group() as tasks, receive:
+            tasks.start_soon(produce)
+            async for found in receive:
+                yield encode(found)
+
+    return _BodyStreamingResponse(lines(), media_type=events.MEDIA_TYPES[output])
+
+
+@router.post("/validate_batch", response_model=ValidateBatchResponse)
+def validate_batch(req: ValidateBatchRequest):
+    for doc in req.documents:
+        _rule_sets(doc.schematron)
+    try:
+        return batch.run_batch(batch.items_from_requests(req.documents))
+    except batch.BatchTooLarge as exc:
+        raise HTTPException(status_code=413, detail=str(exc))
+
+
+@router.post("/validate_batch/upload", response_model=ValidateBatchResponse)
+def validate_batch_upload(
+    files: List[UploadFile] = File(..., description="XML/PDF documents and/or .zip archives of documents"),
+    format: str = Form(detect.AUTO, description="auto|ubl|creditnote-ubl|cii|facturx|cdv|ereporting|annuaire (PDF entries are always facturx)"),
+    flow: Optional[str] = Form(None),
+    profile: Optional[str] = Form(None),
+    rule_set_names: Optional[str] = Form(None, alias="schematron", description="Comma-separated Schematron rule sets"),
+):
+    rule_sets = _rule_sets(rule_set_names)
+    items = []
+    try:
+        for upload in files:
+            data = upload.file.read()
+            name = upload.filename or ""
+            if name.lower().endswith(".zip"):
+                entries = batch.read_zip_documents(data)
+            else:
+                entries = [(name, data)]
+            for entry_name, entry_data in entries:
+                items.append((entry_name, entry_data, batch.format_for_entry(entry_name, format), flow, profile, rule_sets))
+        return batch.run_batch(items)
+    except batch.BatchTooLarge as exc:
+        raise HTTPException(status_code=413, detail=str(exc))
+    except zipfile.BadZipFile as exc:
+        raise HTTPException(status_code=400, detail=f"Invalid zip archive: {exc}")
+
+
+@router.get("/schema_cache")
+def schema_cache_stats():
+    """Compiled XSD registry statistics (hits, compile time per schema)."""
+    return get_registry().stats()
+
+
+@router.get("/result_cache")
+def result_cache_stats():
+    """Validation result cache statistics (hits per tier, misses, asset fingerprint)."""
+    return result_cache.stats()
+
+
+@router.get("/schematron")
+def schematron_rule_sets():
+    """Available Schematron rule sets and compiled XSLT cache statistics."""
+    return schematron.get_registry().stats()
@@ -0,0 +1,389 @@
+"""Compiled annex reference store.
+
+The annex JSON caches (XLSX dumps, several MB for Annexe 7) are reduced once, at build
+time, to the reference data the service actually uses: rules, codelists, required fields
+and CDV statuses. The result is written as one compact JSON file next to the caches
+(reference_store.json) and loaded with a single read at startup. Its header records a
+SHA-256 of every source file so a worker can tell whether the store is still current.
+
+The enumerations of the UN/ECE and ISO codelist XSDs bundled with the CII schemas
+(data/xsd/**/codelist/) are compiled into the store as well, as bare code lists named
+after the file (UNECE_PaymentMeansCode, ...), so codelist rules can check any coded field
+of UBL or CII in memory. Lists the annexes do not provide are also published under their
+EN16931 names (ISO4217, UNTDID4461, ...).
+
+    python scripts/build_annex_cache.py --store-only --out data/annexes_cache_embedded
+"""
+import hashlib
+import json
+import os
+import re
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from lxml import etree
+
+DATA_DIR = Path(__file__).resolve().parents[2] / "data"
+XSD_DIR = DATA_DIR / "xsd"
+STORE_NAME = "reference_store.json"
+STORE_FORMAT = 2
+# Set to 0 to trust the store without hashing its sources (read-only images built in CI).
+VERIFY_ENV = "FE_ANNEX_STORE_VERIFY"
+
+ANNEX1 = "20251031_Annexe 1 - Format sémantique FE e-invoicing - Flux 1 v1.1.json"
+ANNEX3 = "20251031_Annexe 3 - Format sémantique FE annuaire - V1.7.json"
+ANNEX6 = "20251031_Annexe 6 - Format sémantique FE e-reporting - V1.9.json"
+ANNEX7 = "20251031_Annexe 7 - Règles de gestion - V1.8.json"
+CDV_STATUTS = "20251031_Annexe_Chorus Pro - Corr_codes_interfaces_CDV_statuts_V1.0.json"
+SOURCES = [ANNEX1, ANNEX3, ANNEX6, ANNEX7, CDV_STATUTS]
+
+XS_ENUMERATION = "{http://www.w3.org/2001/XMLSchema}enumeration"
+# Version suffix of codelist XSD file names: _D16A, _2012-08-31, _1996Rev2Final, _SecondEdition2006, _4
+_XSD_VERSION = re.compile(r"_(?:D\d{2}[A-Z]|\d{4}-\d{2}-\d{2}|\d{4}Rev\d+Final|SecondEdition\d{4}|\d+)$")
+# EN16931 names of XSD codelists; the XSD enumeration is the code set, the annexes only add labels
+XSD_CODELIST_ALIASES = {
+    "ISO3166": "ISO_ISOTwo-letterCountryCode",
+    "ISO4217": "ISO_ISO3AlphaCurrencyCode",
+    "UNTDID1153": "UNECE_ReferenceTypeCode",
+    "UNTDID4461": "UNECE_PaymentMeansCode",
+    "UNTDID5189": "UNECE_AllowanceChargeReasonCode",
+    "UNTDID5305": "UNECE_DutyorTaxorFeeCategoryCode",
+}
+
+# Minimal fallback rules so /rules/* works even if annex cache is missing in deployment
+DEFAULT_RULES: Dict[str, Dict] = {
+    "G1.01": {
+        "title": "Types de facture autorisés",
+        "description": (
+            "Les types de factures autorisés (UNTDID 1001) incluent notamment : "
+            "380/381/384/389/393/501 pour les factures, 386/500 pour acomptes, "
+            "471/472/473 pour rectificatives, 261/396/502/503 pour avoirs."
+        ),
+        "flows": ["f1", "f6", "f10"],
+        "severity": "error",
+    },
+    "G1.02": {
+        "title": "Cadre de facturation",
+        "description": "Le cadre de facturation doit appartenir à la codelist CADRES (B1, S1, M1, ...).",
+        "flows": ["f1"],
+        "severity": "error",
+    },
+    "G1.05": {
+        "title": "Identifiant de facture",
+        "description": "ID obligatoire, 1 à 35 caractères autorisés (A–Z, a–z, 0–9, espace, - + _ /).",
+        "flows": ["f1"],
+        "severity": "error",
+    },
+    "G1.09": {
+        "title": "Date d'émission",
+        "description": "Date obligatoire ; format AAAA-MM-JJ (UBL) ou AAAAMMJJ (CII/e-reporting).",
+        "flows": ["f1", "f10"],
+        "severity": "error",
+    },
+    "G1.10": {
+        "title": "Devise",
+        "description": "La devise doit appartenir à la codelist ISO4217.",
+        "flows": ["f1"],
+        "severity": "error",
+    },
+}
+
+DEFAULT_REQUIRED_FIELDS: Dict[str, List[str]] = {
+    "base|f1": ["BT-1", "BT-2", "BT-3", "BT-5", "BT-27", "BT-44"],
+    "full|f1": ["BT-1", "BT-2", "BT-3", "BT-5", "BT-27", "BT-44"],
+}
+
+DEFAULT_CODELISTS: Dict[str, List] = {
+    "UNTDID1001": [
+        {"code": "380", "label": "Facture"},
+        {"code": "381", "label": "Avoir"},
+        {"code": "384", "label": "Facture rectificative"},
+        {"code": "389", "label": "Facture auto-facturée"},
+        {"code": "393", "label": "Facture affacturée"},
+        {"code": "501", "label": "Facture auto-facturée affacturée"},
+        {"code": "386", "label": "Facture d'acompte"},
+        {"code": "500", "label": "Facture d’acompte auto-facturée"},
+        {"code": "471", "label": "Facture rectificative auto-facturée"},
+        {"code": "472", "label": "Facture rectificative affacturée"},
+        {"code": "473", "label": "Facture rectificative auto-facturée affacturée"},
+        {"code": "261", "label": "Avoir auto-facturé"},
+        {"code": "396", "label": "Avoir affacturé"},
+        {"code": "502", "label": "Avoir auto-facturé affacturé"},
+        {"code": "503", "label": "Avoir de facture d'acompte"},
+    ],
+    "CDV_REFUS": [
+        {"code": "DEST_ERR", "label": "Erreur de destinataire"},
+        {"code": "DOUBLE_FACT", "label": "Données réglementaire F1 en doublon"},
+        {"code": "JUSTIF_ABS", "label": "Justificatif absent ou insuffisant"},
+        {"code": "ERR_VALIDEUR", "label": "Mauvais valideur"},
+        {"code": "CMD_EJ_ERR", "label": "Commande/Engagement incorrect ou manquant"},
+    ],
+    "CADRES": ["B1", "S1", "M1", "B2", "S2", "M2", "B4", "S4", "M4", "S5", "S6", "B7", "S7"],
+}
+
+
+def cache_dir() -> Optional[Path]:
+    """data/annexes_cache when generated locally, otherwise the embedded copy."""
+    for candidate in (DATA_DIR / "annexes_cache", DATA_DIR / "annexes_cache_embedded"):
+        if candidate.exists():
+            return candidate
+    return None
+
+
+def _read_json(path: Path) -> Optional[Dict]:
+    if not path.exists():
+        return None
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except Exception:
+        return None
+
+
+def _mandatory_bts(sheet: List) -> List[str]:
+    req = []
+    for row in sheet:
+        if not row or len(row) < 2:
+            continue
+        bt = row[0]
+        card = str(row[1]).strip() if row[1] is not None else ""
+        if bt and isinstance(bt, str) and card.startswith("1.."):
+            req.append(bt)
+    return req
+
+
+def _refusal_codes(annex7: Dict) -> List[Dict]:
+    sheet = annex7.get("Tableau des motifs de refus", [])
+    codes = []
+    if sheet and len(sheet) > 1:
+        for row in sheet[1:]:
+            if not row or len(row) < 2:
+                continue
+            code = row[0]
+            label = row[1]
+            if code:
+                codes.append({"code": str(code), "label": label or ""})
+    return codes
+
+
+def _rules(annex7: Dict) -> Dict[str, Dict]:
+    flows_map = {3: "f1", 4: "f6", 5: "f10", 6: "f13", 7: "f14"}
+    rules = {}
+    for row in annex7.get("Règles de gestion", [])[2:]:
+        if not row or len(row) < 2:
+            continue
+        rid = row[1]
+        title = row[0]
+        label = row[2] if len(row) > 2 else ""
+        if not rid or not isinstance(rid, str):
+            continue
+        flows = []
+        for idx, f in flows_map.items():
+            if len(row) > idx and row[idx] == "X":
+                flows.append(f)
+        rules[rid] = {"title": title or "", "description": label or "", "flows": flows, "severity": "error"}
+    return rules
+
+
+def _iso_codelists(annex7: Dict) -> Dict[str, List[Dict]]:
+    """ISO codes from the EN16931 Codelists sheet (best-effort)."""
+    iso4217 = []
+    iso3166 = []
+    seen = set()
+    for row in annex7.get("EN16931 Codelists", []):
+        if not row or len(row) < 30:
+            continue
+        # Country: French name in col 23, alpha-2 code in col 24; currency: name in col 28, code in col 29.
+        country_alpha2 = row[24]
+        if country_alpha2 and isinstance(country_alpha2, str) and len(country_alpha2.strip()) == 2:
+            iso3166.append({"code": country_alpha2.strip(), "label": str(row[23] or "").strip()})
+        currency_code = row[29]
+        if currency_code and isinstance(currency_code, str) and len(currency_code.strip()) == 3 and currency_code not in seen:
+            seen.add(currency_code)
+            iso4217.append({"code": currency_code.strip(), "label": str(row[28] or "").strip()})
+    lists = {}
+    if iso4217:
+        lists["ISO4217"] = iso4217
+    if iso3166:
+        lists["ISO3166"] = iso3166
+    return lists
+
+
+def _codelist_xsds(xsd_dir: Path) -> List[Path]:
+    """Code list and identifier list XSDs (ISO country codes are an UN/CEFACT identifier list)."""
+    if not xsd_dir.exists():
+        return []
+    return sorted({*xsd_dir.glob("**/codelist/**/*.xsd"), *xsd_dir.glob("**/identifierlist/**/*.xsd")})
+
+
+def xsd_codelists(xsd_dir: Path = XSD_DIR) -> Dict[str, List[str]]:
+    """Enumeration values of every codelist XSD, by file name without version (copies shared by schemas merged)."""
+    lists: Dict[str, List[str]] = {}
+    for path in _codelist_xsds(xsd_dir):
+        codes = lists.setdefault(_XSD_VERSION.sub("", path.stem), [])
+        known = set(codes)
+        for enum in etree.parse(str(path)).iter(XS_ENUMERATION):
+            value = enum.get("value")
+            if value is not None and value not in known:
+                known.add(value)
+                codes.append(value)
+    return lists
+
+
+def _add_xsd_codelists(codelists: Dict[str, List], xsd_dir: Path) -> None:
+    """Replace annex scrapes by the XSD enumerations as {code, label} entries, keeping the annex labels."""
+    extracted = xsd_codelists(xsd_dir)
+    targets = {name: name for name in extracted}
+    targets.update((alias, name) for alias, name in XSD_CODELIST_ALIASES.items() if name in extracted)
+    for target, name in targets.items():
+        labels = {str(e.get("code")): e.get("label") or "" for e in codelists.get(target, ()) if isinstance(e, dict)}
+        codelists[target] = [{"code": code, "label": labels.get(code, "")} for code in extracted[name]]
+
+
+def _annex1_required(annex1: Dict) -> Dict[str, List[str]]:
+    req_base = []
+    req_full = []
+    for row in annex1.get("FE - Flux 1 - UBL", []):
+        if not row or len(row) < 2:
+            continue
+        bt = row[0]
+        card = str(row[1]).strip() if row[1] is not None else ""
+        base_flag = row[17] if len(row) > 17 else None
+        full_flag = row[18] if len(row) > 18 else None
+        if not bt or not isinstance(bt, str):
+            continue
+        if card.startswith("1.."):  # obligatoire
+            if base_flag == "X":
+                req_base.append(bt)
+            if full_flag == "X":
+                req_full.append(bt)
+    required = {}
+    if req_base:
+        required["base|f1"] = req_base
+    if req_full:
+        required["full|f1"] = req_full
+    return required
+
+
+def _cdv_statuses(table: Dict) -> List[Dict]:
+    """CDV lifecycle statuses (code, label, object, mandatory) from the Chorus Pro correspondence table."""
+    statuses: Dict[str, Dict] = {}
+    for sheet in ("G2B", "B2G"):
+        for row in table.get(sheet, [])[1:]:
+            if not row or len(row) < 6 or not isinstance(row[0], int):
+                continue
+            code = f"CDV-{row[0]}"
+            if code not in statuses:
+                statuses[code] = {
+                    "code": code,
+                    "label": str(row[4] or "").strip(),
+                    "object": str(row[2] or "").strip(),
+                    "mandatory": str(row[5] or "").strip() == "Obligatoire",
+                }
+    return sorted(statuses.values(), key=lambda s: s["code"])
+
+
+def extract_reference(base: Path, xsd_dir: Path = XSD_DIR) -> Dict[str, Any]:
+    """Reference data from the annex JSON caches of base and the codelist XSDs; each file is parsed once."""
+    codelists: Dict[str, List] = json.loads(json.dumps(DEFAULT_CODELISTS))
+    rules: Dict[str, Dict] = {}
+    required: Dict[str, List[str]] = {}
+    statuses: List[Dict] = []
+
+    annex7 = _read_json(base / ANNEX7)
+    if annex7:
+        codes = _refusal_codes(annex7)
+        if codes:
+            codelists["CDV_REFUS"] = codes
+        rules = _rules(annex7)
+        codelists.update(_iso_codelists(annex7))
+
+    # Required fields from Annexe 6 (e-reporting)
+    annex6 = _read_json(base / ANNEX6)
+    if annex6:
+        req = _mandatory_bts(annex6.get("E-REPORTING - Flux 10", []))
+        if req:
+            required["base|f10"] = req
+            required["full|f10"] = req
+
+    # Required fields from Annexe 3 (annuaire)
+    annex3 = _read_json(base / ANNEX3)
+    if annex3:
+        for sheet_name, flow in [("FE - F13 (Actualisation)", "f13"), ("FE - F14 (Consultation)", "f14")]:
+            req = _mandatory_bts(annex3.get(sheet_name, []))
+            if req:
+                required[f"base|{flow}"] = req
+                required[f"full|{flow}"] = req
+
+    # Required fields from Annexe 1 (FE - Flux 1 - UBL)
+    annex1 = _read_json(base / ANNEX1)
+    if annex1:
+        required.update(_annex1_required(annex1))
+
+    table = _read_json(base / CDV_STATUTS)
+    if table:
+        statuses = _cdv_statuses(table)
+
+    _add_xsd_codelists(codelists, xsd_dir)
+
+    return {"rules": rules, "codelists": codelists, "requiredFields": required, "cdvStatuses": statuses}
+
+
+def source_hashes(base: Path, xsd_dir: Path = XSD_DIR) -> Dict[str, str]:
+    hashes = {}
+    for name in SOURCES:
+        path = base / name
+        if path.exists():
+            hashes[name] = hashlib.sha256(path.read_bytes()).hexdigest()
+    for path in _codelist_xsds(xsd_dir):
+        hashes["xsd/" + path.relative_to(xsd_dir).as_posix()] = hashlib.sha256(path.read_bytes()).hexdigest()
+    return hashes
+
+
+def build_store(base: Path) -> Dict[str, Any]:
+    data = extract_reference(base)
+    body = json.dumps(data, ensure_ascii=False, separators=(",", ":"), sort_keys=True)
+    return {
+        "format": STORE_FORMAT,
+        "sources": source_hashes(base),
+        "contentHash": hashlib.sha256(body.encode("utf-8")).hexdigest(),
+        "data": data,
+    }
+
+
+def write_store(store: Dict[str, Any], path: Path) -> None:
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(store, ensure_ascii=False, separators=(",", ":"), sort_keys=True), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def read_store(path: Path) -> Optional[Dict[str, Any]]:
+    """Store content in one read, or None when missing, unreadable or of another format."""
+    try:
+        store = json.loads(path.read_bytes())
+    except (OSError, ValueError):
+        return None
+    if store.get("format") != STORE_FORMAT:
+        return None
+    return store
+
+
+def is_current(store: Dict[str, Any], base: Path) -> bool:
+    return store.get("sources") == source_hashes(base)
+
+
+def verify_enabled() -> bool:
+    return os.environ.get(VERIFY_ENV, "1").strip().lower() not in {"0", "false", "no"}
+
+
+def load_reference(base: Optional[Path] = None) -> Dict[str, Any]:
+    """Reference data of the active cache dir: compiled store when current, else extracted from the annexes."""
+    base = base if base is not None else cache_dir()
+    if base is None:
+        codelists = json.loads(json.dumps(DEFAULT_CODELISTS))
+        _add_xsd_codelists(codelists, XSD_DIR)
+        return {"rules": {}, "codelists": codelists, "requiredFields": {}, "cdvStatuses": [], "contentHash": None}
+    store = read_store(base / STORE_NAME)
+    if store is not None and (not verify_enabled() or is_current(store, base)):
+        return {**store["data"], "contentHash": store["contentHash"]}
+    built = build_store(base)
+    return {**built["data"], "contentHash": built["contentHash"]}
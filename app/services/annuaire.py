@@ -0,0 +1,474 @@
+"""In-memory annuaire (directory) routing index: addressing lines loaded from F13/F14 files.
+
+An addressing line (LigneAnnuaire) binds an addressing mesh (SIREN, SIREN_SIRET,
+SIREN_SIRET_routing code or SIREN_suffix) to a receiving platform over an effect period;
+nature M (masquage) makes the mesh unaddressable from its start date. Lines are held in
+parallel typed arrays sorted by (SIREN, NIC, routing code, suffix, start date): integers for
+identifiers and AAAAMMJJ dates, interned strings for routing codes and suffixes, about 30
+bytes per line instead of a dict per line. A lookup bisects the SIREN column and scans the
+few lines of that SIREN.
+
+Files are validated against their XSD (Annuaire_Actualisation_F12-F13.xsd,
+Annuaire_Consultation_F14.xsd) then merged: a new index is built next to the current one
+and swapped in one assignment, so lookups never lock. Within a file lines apply in order;
+a line with the same mesh and start date replaces the stored one (end date, platform,
+nature). CodeRoutage blocks set the routing code status: lines on an inactive code are
+unaddressable.
+
+Resolution of a recipient at a date uses the most specific mesh with a line in force:
+routing code, then SIRET, then suffix, then SIREN. FE_ANNUAIRE_FILES (files or directories,
+separated by os.pathsep, loaded in name order) is read on first use or at warm-up; with
+FE_ANNUAIRE_CHECK=1, rules_engine reports F1 UBL/CII invoices whose buyer (BT-49
+electronic address, else BT-47 SIREN) is not addressable at the issue date.
+
+Files loaded at run time (POST /annuaire/load) go to the process index. With several
+workers, or with FE_ANNUAIRE_SPOOL set, they are also written to a spool directory under a
+sequence number; every worker merges the spooled files in sequence order, looking for new
+ones at most once every FE_ANNUAIRE_REFRESH seconds.
+"""
+import bisect
+import datetime
+import heapq
+import os
+import tempfile
+import threading
+import time
+from array import array
+from itertools import groupby
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from lxml import etree
+
+from ..models.schemas import RuleIssue
+from . import snapshot, workers
+from .xml_parser import parse_xml
+
+CHECK_ENV = "FE_ANNUAIRE_CHECK"
+FILES_ENV = "FE_ANNUAIRE_FILES"
+SPOOL_ENV = "FE_ANNUAIRE_SPOOL"
+REFRESH_ENV = "FE_ANNUAIRE_REFRESH"
+RULE_ID = "ANN-ADRESSAGE"
+FORMATS = frozenset({"ubl", "creditnote-ubl", "cii"})
+
+# Root element -> flow of the schema it is validated against
+_FLOWS = {"AnnuaireActualisation": "f13", "AnnuaireConsultationF14": "f14"}
+_NONE = -1
+
+_NS = {
+    "cac": "urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2",
+    "cbc": "urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2",
+    "rsm": "urn:un:unece:uncefact:data:standard:CrossIndustryInvoice:100",
+    "ram": "urn:un:unece:uncefact:data:standard:ReusableAggregateBusinessInformationEntity:100",
+    "udt": "urn:un:unece:uncefact:data:standard:UnqualifiedDataType:100",
+}
+_UBL_BUYER = "/*/cac:AccountingCustomerParty/cac:Party"
+_CII_BUYER = "/rsm:CrossIndustryInvoice/rsm:SupplyChainTradeTransaction/ram:ApplicableHeaderTradeAgreement/ram:BuyerTradeParty"
+# Per syntax: buyer electronic address BT-49, buyer legal registration identifier BT-47, issue date BT-2
+_PATHS = {
+    "ubl": {"address": f"{_UBL_BUYER}/cbc:EndpointID", "siren": f"{_UBL_BUYER}/cac:PartyLegalEntity/cbc:CompanyID",
+            "date": "/*/cbc:IssueDate"},
+    "cii": {"address": f"{_CII_BUYER}/ram:URIUniversalCommunication/ram:URIID",
+            "siren": f"{_CII_BUYER}/ram:SpecifiedLegalOrganization/ram:ID",
+            "date": "/rsm:CrossIndustryInvoice/rsm:ExchangedDocument/ram:IssueDateTime/udt:DateTimeString"},
+}
+_PATHS["creditnote-ubl"] = _PATHS["ubl"]
+_XPATHS = {fmt: {name: etree.XPath(f"string({path})", namespaces=_NS) for name, path in paths.items()}
+           for fmt, paths in _PATHS.items()}
+
+
+class AnnuaireError(ValueError):
+    """Annuaire file that is not an F13/F14 document or does not match its schema."""
+
+
+class Recipient(NamedTuple):
+    """Addressing identifier split into its parts; SIRET is stored as its NIC (last 5 digits)."""
+    siren: int
+    nic: int = _NONE
+    routing: Optional[str] = None
+    suffix: Optional[str] = None
+
+
+class Line(NamedTuple):
+    siren: int
+    nic: int
+    routing: Optional[str]
+    suffix: Optional[str]
+    start: int
+    end: int
+    platform: str
+    masked: bool
+
+
+class Resolution(NamedTuple):
+    addressable: bool
+    line: Optional[Line]
+    reason: Optional[str]
+
+
+def _digits(value: str, size: int) -> Optional[int]:
+    value = "".join((value or "").split())
+    return int(value) if len(value) == size and value.isdigit() else None
+
+
+def parse_recipient(identifier: str) -> Optional[Recipient]:
+    """SIREN, SIREN_SIRET, SIREN_SIRET_routing code or SIREN_suffix; None when the SIREN part is invalid."""
+    parts = (identifier or "").strip().split("_", 2)
+    siren = _digits(parts[0], 9)
+    if siren is None:
+        return None
+    if len(parts) == 1:
+        return Recipient(siren)
+    siret = _digits(parts[1], 14)
+    if siret is None or siret // 100_000 != siren:
+        return Recipient(siren, suffix="_".join(parts[1:]))
+    return Recipient(siren, siret % 100_000, parts[2] if len(parts) == 3 and parts[2] else None)
+
+
+def date_value(value: Optional[str]) -> int:
+    """AAAAMMJJ integer from AAAA-MM-JJ or AAAAMMJJ; today when empty."""
+    digits = "".join(c for c in (value or "") if c.isdigit())[:8]
+    return int(digits) if len(digits) == 8 else int(datetime.date.today().strftime("%Y%m%d"))
+
+
+def identifier(line: Line) -> str:
+    parts = [f"{line.siren:09d}"]
+    if line.nic != _NONE:
+        parts.append(f"{line.siren:09d}{line.nic:05d}")
+        if line.routing:
+            parts.append(line.routing)
+    elif line.suffix:
+        parts.append(line.suffix)
+    return "_".join(parts)
+
+
+def line_json(line: Line) -> Dict:
+    """F14-style LigneAnnuaire."""
+    return {
+        "identifiant": identifier(line),
+        "nature": "M" if line.masked else "D",
+        "dateDebut": str(line.start),
+        "dateFin": str(line.end) if line.end else None,
+        "siren": f"{line.siren:09d}",
+        "siret": f"{line.siren:09d}{line.nic:05d}" if line.nic != _NONE else None,
+        "routage": line.routing,
+        "suffixe": line.suffix,
+        "idPlateforme": line.platform,
+    }
+
+
+class AnnuaireIndex:
+    """Immutable once built; merged() returns a new index with the lines applied."""
+
+    def __init__(self, strings: Optional[List[str]] = None, inactive: Optional[bytearray] = None, generation: int = 0):
+        self.siren = array("i")
+        self.nic = array("i")
+        self.routing = array("i")
+        self.suffix = array("i")
+        self.start = array("i")
+        self.end = array("i")
+        self.platform = array("H")
+        self.masked = bytearray()
+        # Routing codes and suffixes, interned: the line columns hold their position
+        self.strings: List[str] = list(strings or [])
+        self._string_ids: Dict[str, int] = {s: i for i, s in enumerate(self.strings)}
+        # Per string id: 1 when the routing code was declared inactive (CodeRoutage Statut I)
+        self.inactive = bytearray(inactive or b"")
+        self.generation = generation
+
+    def __len__(self) -> int:
+        return len(self.siren)
+
+    def _intern(self, value: Optional[str]) -> int:
+        if not value:
+            return _NONE
+        found = self._string_ids.get(value)
+        if found is None:
+            found = self._string_ids[value] = len(self.strings)
+            self.strings.append(value)
+            self.inactive.append(0)
+        return found
+
+    def _string(self, position: int) -> Optional[str]:
+        return None if position == _NONE else self.strings[position]
+
+    def _row(self, i: int) -> Tuple[int, ...]:
+        return (self.siren[i], self.nic[i], self.routing[i], self.suffix[i], self.start[i], self.end[i],
+                self.platform[i], self.masked[i])
+
+    def _append(self, row: Tuple[int, ...]) -> None:
+        siren, nic, routing, suffix, start, end, platform, masked = row
+        self.siren.append(siren)
+        self.nic.append(nic)
+        self.routing.append(routing)
+        self.suffix.append(suffix)
+        self.start.append(start)
+        self.end.append(end)
+        self.platform.append(platform)
+        self.masked.append(masked)
+
+    def line(self, i: int) -> Line:
+        return Line(self.siren[i], self.nic[i], self._string(self.routing[i]), self._string(self.suffix[i]),
+                    self.start[i], self.end[i], f"{self.platform[i]:04d}", bool(self.masked[i]))
+
+    def _columns(self) -> Tuple:
+        return self.siren, self.nic, self.routing, self.suffix, self.start, self.end, self.platform, self.masked
+
+    def merged(self, lines: Iterable[Line], routing_status: Iterable[Tuple[str, bool]] = ()) -> "AnnuaireIndex":
+        """New index with these lines (and routing code statuses) applied in order over this one's.
+
+        The SIREN ranges without new lines are copied as array slices; only the ranges of the
+        SIRENs in the update are merged row by row.
+        """
+        index = AnnuaireIndex(self.strings, self.inactive, self.generation + 1)
+        for code, active in routing_status:
+            index.inactive[index._intern(code)] = 0 if active else 1
+        rows = sorted(((line.siren, line.nic, index._intern(line.routing), index._intern(line.suffix), line.start,
+                        line.end, int(line.platform), int(line.masked)) for line in lines), key=lambda row: row[:5])
+        copied = 0
+        for siren, group in groupby(rows, key=lambda row: row[0]):
+            low = bisect.bisect_left(self.siren, siren, copied)
+            high = bisect.bisect_right(self.siren, siren, low)
+            if low > copied:
+                for target, column in zip(index._columns(), self._columns()):
+                    target.extend(column[copied:low])
+            previous = None
+            # Stable merge: for one mesh and start date the new rows come last, the last one wins
+            merged = heapq.merge((self._row(i) for i in range(low, high)), group, key=lambda row: row[:5]) \
+                if high > low else group
+            for row in merged:
+                if previous is not None and previous[:5] != row[:5]:
+                    index._append(previous)
+                previous = row
+            index._append(previous)
+            copied = high
+        for target, column in zip(index._columns(), self._columns()):
+            target.extend(column[copied:])
+        return index
+
+    def lines_of(self, siren: int) -> range:
+        return range(bisect.bisect_left(self.siren, siren), bisect.bisect_right(self.siren, siren))
+
+    def _in_force(self, rows: range, nic: int, routing: int, suffix: int, date: int) -> Optional[int]:
+        """Row of the mesh in force at date (latest start), or None."""
+        found = None
+        for i in rows:
+            if (self.nic[i] == nic and self.routing[i] == routing and self.suffix[i] == suffix
+                    and self.start[i] <= date and (not self.end[i] or date < self.end[i])):
+                found = i  # rows are sorted by start date within a mesh
+        return found
+
+    def resolve(self, recipient: Recipient, date: int) -> Resolution:
+        rows = self.lines_of(recipient.siren)
+        if not rows:
+            return Resolution(False, None, "SIREN absent de l'annuaire")
+        # Meshes from the most specific; a routing code or suffix never loaded has no line
+        meshes = []
+        if recipient.routing and recipient.routing in self._string_ids:
+            meshes.append((recipient.nic, self._string_ids[recipient.routing], _NONE))
+        if recipient.nic != _NONE:
+            meshes.append((recipient.nic, _NONE, _NONE))
+        if recipient.suffix and recipient.suffix in self._string_ids:
+            meshes.append((_NONE, _NONE, self._string_ids[recipient.suffix]))
+        meshes.append((_NONE, _NONE, _NONE))
+        for nic, routing_id, suffix_id in meshes:
+            i = self._in_force(rows, nic, routing_id, suffix_id, date)
+            if i is None:
+                continue
+            line = self.line(i)
+            if line.masked:
+                return Resolution(False, line, "maille d'adressage masquée")
+            if self.routing[i] != _NONE and self.inactive[self.routing[i]]:
+                return Resolution(False, line, "code routage inactif")
+            return Resolution(True, line, None)
+        return Resolution(False, None, "aucune ligne d'annuaire en vigueur à cette date")
+
+    def stats(self) -> Dict:
+        return {
+            "lines": len(self),
+            "strings": len(self.strings),
+            "generation": self.generation,
+            "bytes": sum(column.itemsize * len(column) for column in
+                         (self.siren, self.nic, self.routing, self.suffix, self.start, self.end, self.platform))
+            + len(self.masked),
+        }
+
+
+def _text(elem: etree._Element, path: str) -> str:
+    return (elem.findtext(path) or "").strip()
+
+
+def _lines(root: etree._Element) -> Iterator[Line]:
+    for entry in root.iterfind("BlocLignesAnnuaire/LigneAnnuaire"):
+        info = entry.find("InfoAdressage")
+        # F13 nests the identifiers under Identifiant; F14 has them next to the identifier string
+        ids = info.find("Identifiant") if info is not None and info.find("Identifiant/IdLinSIREN") is not None else info
+        if ids is None:
+            continue
+        siren = _digits(_text(ids, "IdLinSIREN"), 9)
+        if siren is None:
+            continue
+        siret = _digits(_text(ids, "IdLinSIRET"), 14)
+        yield Line(siren, siret % 100_000 if siret is not None else _NONE, _text(ids, "IdLinRoutage") or None,
+                   _text(ids, "Suffixe") or None, date_value(_text(entry, "DateEffet/DateDebut")),
+                   int(_text(entry, "DateEffet/DateFin") or 0), _text(entry, "IdPlateforme"),
+                   _text(entry, "Nature").upper() == "M")
+
+
+def _routing_status(root: etree._Element) -> Iterator[Tuple[str, bool]]:
+    for entry in root.iterfind("BlocCodesRoutage/CodeRoutage"):
+        code = _text(entry, "IdRoutage")
+        if code:
+            yield code, _text(entry, "Statut").upper() != "I"
+
+
+def parse_file(data: bytes) -> Tuple[List[Line], List[Tuple[str, bool]]]:
+    """Addressing lines and routing code statuses of an F13/F14 document; raises AnnuaireError."""
+    try:
+        root = parse_xml(data)
+    except etree.XMLSyntaxError as exc:
+        raise AnnuaireError(f"Invalid XML: {exc}") from exc
+    flow = _FLOWS.get(etree.QName(root).localname)
+    if flow is None:
+        raise AnnuaireError(f"Not an annuaire F13/F14 document: root element {root.tag}")
+    errors = snapshot.current().validator.validate_tree(root, "annuaire", flow, limit=10)
+    if errors:
+        raise AnnuaireError(f"Schema errors ({flow}): " + "; ".join(errors))
+    return list(_lines(root)), list(_routing_status(root))
+
+
+def _source_files() -> List[Path]:
+    files: List[Path] = []
+    for entry in filter(None, os.environ.get(FILES_ENV, "").split(os.pathsep)):
+        path = Path(entry)
+        files.extend(sorted(path.glob("*.xml")) if path.is_dir() else [path])
+    return files
+
+
+def spool_dir() -> Optional[Path]:
+    """Directory shared by the workers for loaded files; None keeps loads in this process."""
+    value = os.environ.get(SPOOL_ENV)
+    if value:
+        return Path(value)
+    return workers.state_path("annuaire") if workers.shared() else None
+
+
+def _spooled(spool: Path, after: int) -> List[Tuple[int, Path]]:
+    """Spooled files numbered above after, in sequence order."""
+    if not spool.is_dir():
+        return []
+    found = []
+    for entry in os.scandir(spool):
+        stem, _, suffix = entry.name.partition(".")
+        if suffix == "xml" and stem.isdigit() and int(stem) > after:
+            found.append((int(stem), Path(entry.path)))
+    return sorted(found)
+
+
+def _spool(spool: Path, data: bytes) -> int:
+    """Write a loaded file under the next free sequence number (os.link fails on a taken one); returns it."""
+    spool.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=spool, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            out.write(data)
+        sequence = max((number for number, _ in _spooled(spool, 0)), default=0) + 1
+        while True:
+            try:
+                os.link(tmp, spool / f"{sequence:012d}.xml")
+                return sequence
+            except FileExistsError:
+                sequence += 1
+    finally:
+        os.unlink(tmp)
+
+
+_index: Optional[AnnuaireIndex] = None
+_index_lock = threading.Lock()
+# Last spooled file merged into _index, and when the spool was last read
+_applied = 0
+_synced = 0.0
+
+
+def _sync_due() -> bool:
+    refresh = float(os.environ.get(REFRESH_ENV, "1"))
+    return time.monotonic() - _synced >= refresh and spool_dir() is not None
+
+
+def _sync(index: AnnuaireIndex, before: Optional[int] = None) -> AnnuaireIndex:
+    """index with the spooled files not merged yet (those numbered below before); call under _index_lock."""
+    global _applied, _synced
+    spool = spool_dir()
+    if spool is not None:
+        for sequence, path in _spooled(spool, _applied):
+            if before is not None and sequence >= before:
+                break
+            _applied = sequence
+            try:
+                index = index.merged(*parse_file(path.read_bytes()))
+            except (OSError, AnnuaireError):
+                continue  # validated when loaded; a file that no longer parses is not retried
+    _synced = time.monotonic()
+    return index
+
+
+def get_index() -> AnnuaireIndex:
+    """Process-wide index, filled from FE_ANNUAIRE_FILES on first use, then from the spool."""
+    global _index
+    if _index is None or _sync_due():
+        with _index_lock:
+            if _index is None:
+                index = AnnuaireIndex()
+                for path in _source_files():
+                    index = index.merged(*parse_file(path.read_bytes()))
+                _index = _sync(index)
+            elif _sync_due():
+                _index = _sync(_index)
+    return _index
+
+
+def load(data: bytes) -> Dict:
+    """Merge an F13/F14 file into the index (spooled for the other workers); returns the lines read and the index stats."""
+    global _index, _applied
+    lines, routing_status = parse_file(data)
+    get_index()
+    spool = spool_dir()
+    with _index_lock:
+        if spool is None:
+            _index = _index.merged(lines, routing_status)
+        else:
+            sequence = _spool(spool, data)
+            _index = _sync(_index, before=sequence).merged(lines, routing_status)
+            _applied = sequence
+        return {"lines": len(lines), "routingCodes": len(routing_status), **_index.stats()}
+
+
+def enabled() -> bool:
+    return os.environ.get(CHECK_ENV, "").strip().lower() in {"1", "true", "yes"}
+
+
+def cache_token() -> str:
+    """Part of the result cache keys: '' when the check is off, else the index generation."""
+    return f"ann:{get_index().generation}" if enabled() else ""
+
+
+def resolve(identifier_value: str, date: Optional[str] = None, index: Optional[AnnuaireIndex] = None) -> Resolution:
+    recipient = parse_recipient(identifier_value)
+    if recipient is None:
+        return Resolution(False, None, "identifiant d'adressage invalide (SIREN attendu en tête)")
+    return (index or get_index()).resolve(recipient, date_value(date))
+
+
+def check_tree(root: etree._Element, fmt: str) -> List[RuleIssue]:
+    """ANN-ADRESSAGE issue when the buyer of an F1 invoice is not addressable at the issue date."""
+    paths = _XPATHS.get(fmt)
+    if paths is None:
+        return []
+    address = paths["address"](root).strip() or paths["siren"](root).strip()
+    if not address:
+        return []
+    resolution = resolve(address, paths["date"](root).strip())
+    if resolution.addressable:
+        return []
+    return [RuleIssue(ruleId=RULE_ID, severity="error", xpath=_PATHS[fmt]["address"],
+                      message=f"Destinataire {address} non adressable dans l'annuaire : {resolution.reason}")]
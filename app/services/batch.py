@@ -0,0 +1,160 @@
+"""Batch validation fanned out over a process pool.
+
+lxml schema validation is CPU-bound, so large batches are spread across worker
+processes. Each worker compiles every mapped schema once in its initializer and
+keeps it for the lifetime of the pool. Publishing a new reference snapshot retires the
+pool (recycle()), so the next batch runs on workers that load the new snapshot.
+"""
+import io
+import multiprocessing
+import os
+import threading
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, List, Optional, Tuple, Union
+
+from ..models.schemas import BatchItemResult, BatchSummary, ValidateBatchResponse
+from . import metrics, pipeline, schematron, snapshot
+from .xsd_validator import warm_up
+
+WORKERS_ENV = "FE_BATCH_WORKERS"
+MAX_DOCUMENTS_ENV = "FE_BATCH_MAX_DOCUMENTS"
+MAX_UNCOMPRESSED_ENV = "FE_BATCH_MAX_UNCOMPRESSED_MB"
+
+# Below this size the pool round-trip costs more than it saves.
+MIN_PARALLEL_DOCUMENTS = 4
+
+# (name, raw document bytes or JSON payload string, format, flow, profile, Schematron rule sets)
+BatchItem = Tuple[Optional[str], Union[bytes, str], str, Optional[str], Optional[str], Tuple[str, ...]]
+
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+class BatchTooLarge(ValueError):
+    pass
+
+
+def worker_count() -> int:
+    value = os.environ.get(WORKERS_ENV)
+    if value:
+        return max(0, int(value))
+    return os.cpu_count() or 1
+
+
+def max_documents() -> int:
+    return int(os.environ.get(MAX_DOCUMENTS_ENV, "50000"))
+
+
+def max_uncompressed_bytes() -> int:
+    return int(os.environ.get(MAX_UNCOMPRESSED_ENV, "2048")) * 1024 * 1024
+
+
+def get_executor() -> Optional[ProcessPoolExecutor]:
+    """Shared process pool, created on first use; None when FE_BATCH_WORKERS <= 1."""
+    global _executor
+    workers = worker_count()
+    if workers <= 1:
+        return None
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                # spawn: workers never inherit the server's threads or locks
+                _executor = ProcessPoolExecutor(
+                    max_workers=workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=warm_up,
+                )
+    return _executor
+
+
+def shutdown() -> None:
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(cancel_futures=True)
+            _executor = None
+
+
+@snapshot.on_publish
+def recycle() -> None:
+    """Retire the pool after a snapshot reload: running batches finish on it, the next one starts new workers."""
+    global _executor
+    with _executor_lock:
+        old, _executor = _executor, None
+    if old is not None:
+        old.shutdown(wait=False)
+
+
+def validate_document(item: BatchItem) -> BatchItemResult:
+    """Validate one raw document; runs inside pool workers, so it only takes picklable arguments."""
+    name, data, fmt, flow, profile, rule_sets = item
+    try:
+        if isinstance(data, str):
+            data = pipeline.decode_payload(data)
+        report = pipeline.validate_bytes(data, fmt, flow, profile, rule_sets, name=name)
+    except (pipeline.PayloadError, schematron.UnknownRuleSet) as exc:
+        return BatchItemResult(index=-1, name=name, valid=False, error=str(exc))
+    valid = not (report.syntax or report.rules or report.codelists)
+    return BatchItemResult(index=-1, name=name, valid=valid, report=report)
+
+
+def run_batch(items: List[BatchItem]) -> ValidateBatchResponse:
+    if len(items) > max_documents():
+        raise BatchTooLarge(f"Batch holds {len(items)} documents (max {max_documents()})")
+    start = time.perf_counter()
+    executor = get_executor() if len(items) >= MIN_PARALLEL_DOCUMENTS else None
+    if executor is None:
+        results = [validate_document(item) for item in items]
+    else:
+        workers = worker_count()
+        chunksize = max(1, min(64, len(items) // (workers * 4)))
+        results = list(executor.map(validate_document, items, chunksize=chunksize))
+        # Metrics recorded inside the pool workers are lost; count the documents here instead.
+        for (_, data, fmt, flow, profile, _), result in zip(items, results):
+            outcome = "error" if result.error is not None else pipeline.report_result(result.report)
+            metrics.observe_request(fmt, flow, profile, outcome, size=len(data))
+    for index, result in enumerate(results):
+        result.index = index
+    return ValidateBatchResponse(summary=summarize(results, time.perf_counter() - start), results=results)
+
+
+def summarize(results: List[BatchItemResult], duration: float) -> BatchSummary:
+    reports = [r.report for r in results if r.report is not None]
+    return BatchSummary(
+        total=len(results),
+        valid=sum(1 for r in results if r.valid),
+        invalid=sum(1 for r in results if r.report is not None and not r.valid),
+        failed=sum(1 for r in results if r.error is not None),
+        syntaxErrors=sum(len(r.syntax) for r in reports),
+        ruleIssues=sum(len(r.rules) for r in reports),
+        codelistIssues=sum(len(r.codelists) for r in reports),
+        durationSeconds=round(duration, 6),
+    )
+
+
+def items_from_requests(documents: Iterable) -> List[BatchItem]:
+    """Batch items from BatchDocument requests; payloads are decoded in the workers."""
+    return [(doc.name, doc.payload, doc.format, doc.flow, doc.profile, tuple(doc.schematron or ())) for doc in documents]
+
+
+def read_zip_documents(data: bytes) -> List[Tuple[str, bytes]]:
+    """Regular files of a zip archive, bounded in count and uncompressed size."""
+    entries: List[Tuple[str, bytes]] = []
+    total = 0
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        infos = [i for i in archive.infolist() if not i.is_dir() and not i.filename.startswith("__MACOSX/")]
+        if len(infos) > max_documents():
+            raise BatchTooLarge(f"Archive holds {len(infos)} documents (max {max_documents()})")
+        for info in infos:
+            total += info.file_size
+            if total > max_uncompressed_bytes():
+                raise BatchTooLarge("Archive exceeds the uncompressed size limit")
+            entries.append((info.filename, archive.read(info)))
+    return entries
+
+
+def format_for_entry(name: str, fmt: str) -> str:
+    """PDF entries of a mixed archive are Factur-X regardless of the declared XML format."""
+    return "facturx" if name.lower().endswith(".pdf") else fmt
@@ -0,0 +1,103 @@
+"""Indexed codelists for the reference endpoints and codelist rules.
+
+Reference codelists are lists of {"code", "label"} entries (or bare codes). They are
+indexed once per load of the reference data: a code -> label map for membership checks,
+code and label keys kept sorted for prefix search (bisect), and the JSON body
+pre-serialised with its ETag, so the UI dropdowns and pre-checks of ERP integrations
+are answered without walking or re-encoding the lists.
+"""
+import bisect
+import hashlib
+import json
+from typing import Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+
+def _etag(body: bytes) -> str:
+    return '"' + hashlib.sha256(body).hexdigest()[:20] + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match check (weak comparison, lists and * accepted)."""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == "*" or candidate == etag:
+            return True
+    return False
+
+
+class Codelist:
+    __slots__ = ("name", "entries", "labels", "codes", "_by_code", "_by_label", "body", "etag")
+
+    def __init__(self, name: str, entries: List):
+        self.name = name
+        self.entries = entries
+        self.labels: Dict[str, Optional[str]] = {}
+        for entry in entries:
+            if isinstance(entry, dict):
+                self.labels.setdefault(str(entry.get("code")), entry.get("label"))
+            else:
+                self.labels.setdefault(str(entry), None)
+        self.codes: FrozenSet[str] = frozenset(self.labels)
+        # (casefolded key, entry index), sorted for prefix search
+        self._by_code: List[Tuple[str, int]] = sorted(
+            (str(e.get("code") if isinstance(e, dict) else e).casefold(), i) for i, e in enumerate(entries))
+        self._by_label: List[Tuple[str, int]] = sorted(
+            (str(e["label"]).casefold(), i) for i, e in enumerate(entries) if isinstance(e, dict) and e.get("label"))
+        self.body = json.dumps(entries, ensure_ascii=False).encode("utf-8")
+        self.etag = _etag(self.body)
+
+    def __contains__(self, code: str) -> bool:
+        return code in self.labels
+
+    def label(self, code: str) -> Optional[str]:
+        return self.labels.get(code)
+
+    @staticmethod
+    def _prefixed(keys: List[Tuple[str, int]], prefix: str) -> Iterable[int]:
+        for position in range(bisect.bisect_left(keys, (prefix, -1)), len(keys)):
+            key, index = keys[position]
+            if not key.startswith(prefix):
+                break
+            yield index
+
+    def search(self, prefix: str, limit: int = 50) -> List:
+        """Entries whose code starts with prefix, then those whose label does (case-insensitive, sorted)."""
+        prefix = prefix.casefold()
+        seen = set()
+        found = []
+        for keys in (self._by_code, self._by_label):
+            for index in self._prefixed(keys, prefix):
+                if index not in seen:
+                    seen.add(index)
+                    found.append(self.entries[index])
+                    if len(found) >= limit:
+                        return found
+        return found
+
+
+class CodelistIndex:
+    """All codelists of one reference data load; version is its content hash."""
+
+    def __init__(self, codelists: Dict[str, List], version: Optional[str] = None):
+        self.version = version
+        self._lists = {name: Codelist(name, entries) for name, entries in codelists.items()}
+        self.names_body = json.dumps(sorted(self._lists), ensure_ascii=False).encode("utf-8")
+        self.names_etag = _etag(self.names_body)
+
+    def get(self, name: str) -> Optional[Codelist]:
+        return self._lists.get(name)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._lists
+
+    def names(self) -> List[str]:
+        return sorted(self._lists)
+
+    def codes(self, name: str) -> FrozenSet[str]:
+        """Codes of a list (empty when unknown), for membership checks."""
+        codelist = self._lists.get(name)
+        return codelist.codes if codelist is not None else frozenset()
@@ -0,0 +1,123 @@
+"""Format, flow and profile detection from the head of a document (format=auto).
+
+Only the first FE_DETECT_BYTES bytes are read, by a pull parser that stops as soon as it
+knows enough: the root element gives the format and flow (an UBL CreditNote is routed to
+its own schema rather than the Invoice one), the specification identifier (UBL
+CustomizationID, CII GuidelineSpecifiedDocumentContextParameter) hints at the profile. A
+%PDF- prologue is a Factur-X file. The document is then parsed once, by the pipeline.
+
+The F1 profile is identified by the file name prefix Base_/Full_ (rule S1.06), which wins
+when the name is known; otherwise an EXTENDED/FULL specification identifier selects full,
+anything else base. Values given by the caller always win over detected ones.
+"""
+import os
+from typing import NamedTuple, Optional
+
+from lxml import etree
+
+from .xml_parser import huge_tree_enabled
+
+AUTO = "auto"
+BYTES_ENV = "FE_DETECT_BYTES"
+PDF_MAGIC = b"%PDF-"
+
+_UBL_INVOICE = "urn:oasis:names:specification:ubl:schema:xsd:Invoice-2"
+_UBL_CREDIT_NOTE = "urn:oasis:names:specification:ubl:schema:xsd:CreditNote-2"
+_CII = "urn:un:unece:uncefact:data:standard:CrossIndustryInvoice:100"
+_CBC = "urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2"
+_RAM = "urn:un:unece:uncefact:data:standard:ReusableAggregateBusinessInformationEntity:100"
+
+# Root element (Clark notation, or local name for the schemas without a target namespace) -> (format, flow)
+ROOTS = {
+    f"{{{_UBL_INVOICE}}}Invoice": ("ubl", "f1"),
+    f"{{{_UBL_CREDIT_NOTE}}}CreditNote": ("creditnote-ubl", "f1"),
+    f"{{{_CII}}}CrossIndustryInvoice": ("cii", "f1"),
+    "CPPStatut": ("cdv", "f6"),
+    "Report": ("ereporting", "f10"),
+    "AnnuaireActualisation": ("annuaire", "f13"),
+    "AnnuaireConsultationF14": ("annuaire", "f14"),
+}
+
+_SPEC_ID = f"{{{_CBC}}}CustomizationID"
+_GUIDELINE = f"{{{_RAM}}}GuidelineSpecifiedDocumentContextParameter"
+_GUIDELINE_ID = f"{{{_RAM}}}ID"
+_FULL_HINTS = ("extended", "full")
+_NAME_PROFILES = (("Base_", "base"), ("Full_", "full"))
+
+
+class UnknownFormat(ValueError):
+    """format=auto on a document whose head matches no known root element."""
+
+
+class Detection(NamedTuple):
+    format: str
+    flow: Optional[str]
+    profile: Optional[str]
+    # Specification identifier read from the document, if any
+    specification: Optional[str] = None
+
+
+def is_auto(fmt: Optional[str]) -> bool:
+    return not fmt or fmt.strip().lower() == AUTO
+
+
+def is_pdf(head: bytes) -> bool:
+    return head.lstrip()[:len(PDF_MAGIC)] == PDF_MAGIC
+
+
+def head_size() -> int:
+    return int(os.environ.get(BYTES_ENV, "16384"))
+
+
+def profile_from_name(name: Optional[str]) -> Optional[str]:
+    """F1 profile from the file name prefix (S1.06, case-sensitive), directories ignored."""
+    base = os.path.basename((name or "").replace("\\", "/"))
+    for prefix, profile in _NAME_PROFILES:
+        if base.startswith(prefix):
+            return profile
+    return None
+
+
+def profile_from_specification(specification: Optional[str]) -> str:
+    value = (specification or "").lower()
+    return "full" if any(hint in value for hint in _FULL_HINTS) else "base"
+
+
+def _sniff(head: bytes):
+    """(root tag, specification identifier) from the first bytes; (None, None) when no root element was read."""
+    parser = etree.XMLPullParser(events=("start", "end"), resolve_entities=False, no_network=True, load_dtd=False,
+                                 huge_tree=huge_tree_enabled())
+    root_tag = None
+    try:
+        parser.feed(head)
+        for event, elem in parser.read_events():
+            if root_tag is None:
+                root_tag = elem.tag
+                continue
+            if event != "end":
+                continue
+            if elem.tag == _SPEC_ID or (elem.tag == _GUIDELINE_ID and elem.getparent() is not None
+                                        and elem.getparent().tag == _GUIDELINE):
+                return root_tag, (elem.text or "").strip() or None
+    except etree.XMLSyntaxError:
+        pass
+    return root_tag, None
+
+
+def detect(data: bytes, name: Optional[str] = None) -> Detection:
+    """Format, flow and profile of a document from its first head_size() bytes; raises UnknownFormat."""
+    head = data[:head_size()].lstrip()
+    if is_pdf(head):
+        # The profile comes from the name or, once extracted, from the embedded CII
+        return Detection("facturx", "f1", profile_from_name(name))
+    root_tag, specification = _sniff(head)
+    if root_tag is None:
+        raise UnknownFormat("Format auto: no XML root element or PDF header found at the start of the document")
+    found = ROOTS.get(root_tag) or ROOTS.get(etree.QName(root_tag).localname)
+    if found is None:
+        raise UnknownFormat(f"Format auto: unknown root element {root_tag}")
+    fmt, flow = found
+    profile = None
+    if flow == "f1":
+        profile = profile_from_name(name) or profile_from_specification(specification)
+    return Detection(fmt, flow, profile, specification)
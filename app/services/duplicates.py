@@ -0,0 +1,288 @@
+"""Duplicate invoice index behind the DOUBLE_FACT refusal code.
+
+Invoices are keyed on (seller identifier, invoice number BT-1, issue year). The keys are
+stored in SQLite (FE_DUPLICATE_DB; when unset, in memory, or in FE_STATE_DIR with several
+workers) and an in-memory Bloom filter sized for FE_DUPLICATE_CAPACITY keys sits in front
+of it: a key that was never recorded, the common case, is answered without a query. Only
+filter hits (recorded keys and about 0.1 % false positives) are confirmed in SQLite.
+
+Keys are recorded in bulk from the invoices accepted by the platform (historical preload
+with scripts/preload_duplicates.py, POST /duplicates), not by validation: ERP pre-checks
+and retries validate the same invoice several times. Rows added by other processes reach
+the filter through a scan of the rows added since the last one, at most once every
+FE_DUPLICATE_REFRESH seconds.
+
+With FE_DUPLICATE_CHECK=1, rules_engine looks up every F1 UBL/CII invoice and reports a
+DOUBLE_FACT issue for recorded keys. The index generation (last row seen) is part of the
+result cache keys, so a report cached before a key was recorded is not served after.
+"""
+import hashlib
+import math
+import os
+import sqlite3
+import threading
+import time
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional
+
+from lxml import etree
+
+from ..models.schemas import RuleIssue
+from . import workers
+
+CHECK_ENV = "FE_DUPLICATE_CHECK"
+DB_ENV = "FE_DUPLICATE_DB"
+CAPACITY_ENV = "FE_DUPLICATE_CAPACITY"
+REFRESH_ENV = "FE_DUPLICATE_REFRESH"
+RULE_ID = "DOUBLE_FACT"
+FALSE_POSITIVE_RATE = 0.001
+# Keys inserted per transaction by add_many
+BATCH_SIZE = 10_000
+
+_NS = {
+    "cac": "urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2",
+    "cbc": "urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2",
+    "rsm": "urn:un:unece:uncefact:data:standard:CrossIndustryInvoice:100",
+    "ram": "urn:un:unece:uncefact:data:standard:ReusableAggregateBusinessInformationEntity:100",
+    "udt": "urn:un:unece:uncefact:data:standard:UnqualifiedDataType:100",
+}
+_UBL_SELLER = "/*/cac:AccountingSupplierParty/cac:Party"
+_CII_SELLER = "/rsm:CrossIndustryInvoice/rsm:SupplyChainTradeTransaction/ram:ApplicableHeaderTradeAgreement/ram:SellerTradeParty"
+# Per syntax: seller identifiers in order of preference (SIREN BT-30, VAT BT-31, endpoint BT-34), BT-1, BT-2
+_PATHS = {
+    "ubl": {
+        "seller": [f"{_UBL_SELLER}/cac:PartyLegalEntity/cbc:CompanyID", f"{_UBL_SELLER}/cac:PartyTaxScheme/cbc:CompanyID",
+                   f"{_UBL_SELLER}/cbc:EndpointID"],
+        "number": "/*/cbc:ID",
+        "date": "/*/cbc:IssueDate",
+    },
+    "cii": {
+        "seller": [f"{_CII_SELLER}/ram:SpecifiedLegalOrganization/ram:ID", f"{_CII_SELLER}/ram:SpecifiedTaxRegistration/ram:ID",
+                   f"{_CII_SELLER}/ram:URIUniversalCommunication/ram:URIID"],
+        "number": "/rsm:CrossIndustryInvoice/rsm:ExchangedDocument/ram:ID",
+        "date": "/rsm:CrossIndustryInvoice/rsm:ExchangedDocument/ram:IssueDateTime/udt:DateTimeString",
+    },
+}
+# UBL credit notes carry the same seller, number and date elements
+_PATHS["creditnote-ubl"] = _PATHS["ubl"]
+FORMATS = frozenset(_PATHS)
+
+
+def _compile(path: str) -> etree.XPath:
+    return etree.XPath(f"string({path})", namespaces=_NS)
+
+
+_XPATHS = {fmt: {"seller": [_compile(p) for p in paths["seller"]], "number": _compile(paths["number"]),
+                 "date": _compile(paths["date"])} for fmt, paths in _PATHS.items()}
+
+
+class DuplicateKey(NamedTuple):
+    seller: str
+    number: str
+    year: str
+
+    @classmethod
+    def of(cls, seller: str, number: str, year_or_date: str) -> "DuplicateKey":
+        """Normalised key: seller without spaces and upper-cased, number stripped, year of an ISO or compact date."""
+        return cls("".join(str(seller).split()).upper(), str(number).strip(), str(year_or_date).strip()[:4])
+
+    @property
+    def token(self) -> str:
+        return "\x1f".join(self)
+
+
+def key_from_tree(root: etree._Element, fmt: str) -> Optional[DuplicateKey]:
+    """Key of a parsed F1 invoice, or None when the seller, number or issue year is missing."""
+    paths = _XPATHS.get(fmt)
+    if paths is None:
+        return None
+    seller = next((value for value in (xpath(root).strip() for xpath in paths["seller"]) if value), "")
+    key = DuplicateKey.of(seller, paths["number"](root), paths["date"](root))
+    return key if key.seller and key.number and key.year.isdigit() and len(key.year) == 4 else None
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings (double hashing of one BLAKE2b digest)."""
+
+    def __init__(self, capacity: int, error_rate: float = FALSE_POSITIVE_RATE):
+        capacity = max(1, capacity)
+        self.size = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item: str) -> Iterator[int]:
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        step = int.from_bytes(digest[8:], "little") | 1
+        return ((first + i * step) % self.size for i in range(self.hashes))
+
+    def add(self, item: str) -> None:
+        """Not thread-safe: callers serialise additions (lookups need no lock)."""
+        bits = self.bits
+        for position in self._positions(item):
+            bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        bits = self.bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class DuplicateIndex:
+    """capacity=0 opens the database without a filter (bulk writers such as the preload script)."""
+
+    def __init__(self, db_path: str = ":memory:", capacity: int = 10_000_000, refresh: float = 5.0):
+        self.db_path = db_path
+        self.refresh = refresh
+        self.bloom: Optional[BloomFilter] = BloomFilter(capacity) if capacity else None
+        # One connection per process; the lock serialises it and the filter additions.
+        self._lock = threading.Lock()
+        self._conn = self._connect()
+        self._conn.execute("CREATE TABLE IF NOT EXISTS invoices (id INTEGER PRIMARY KEY, key TEXT NOT NULL UNIQUE, "
+                           "seller TEXT NOT NULL, number TEXT NOT NULL, year TEXT NOT NULL)")
+        self._last_id = 0
+        self._refreshed = 0.0
+        self.lookups = 0
+        self.queries = 0
+        self.duplicates = 0
+        self.pull()
+
+    @classmethod
+    def from_env(cls) -> "DuplicateIndex":
+        return cls(
+            db_path=os.environ.get(DB_ENV) or default_db(),
+            capacity=int(os.environ.get(CAPACITY_ENV, "10000000")),
+            refresh=float(os.environ.get(REFRESH_ENV, "5")),
+        )
+
+    def _connect(self) -> sqlite3.Connection:
+        self._pid = os.getpid()
+        conn = sqlite3.connect(self.db_path, timeout=5.0, isolation_level=None, check_same_thread=False)
+        if self.db_path != ":memory:":
+            conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def _db(self) -> sqlite3.Connection:
+        """The connection, reopened in a forked worker (SQLite file connections must not cross a fork)."""
+        if self._pid != os.getpid() and self.db_path != ":memory:":
+            self._conn = self._connect()
+        return self._conn
+
+    @property
+    def generation(self) -> int:
+        """Id of the last recorded row in the filter; grows with every key recorded."""
+        return self._last_id
+
+    def pull(self) -> int:
+        """Add the rows recorded since the last pull (by any process) to the filter; returns how many."""
+        with self._lock:
+            pulled = 0
+            if self.bloom is None:
+                self._last_id = self._db().execute("SELECT COALESCE(MAX(id), 0) FROM invoices").fetchone()[0]
+                return pulled
+            for row_id, token in self._db().execute("SELECT id, key FROM invoices WHERE id > ? ORDER BY id",
+                                                    (self._last_id,)):
+                self.bloom.add(token)
+                self._last_id = row_id
+                pulled += 1
+            self._refreshed = time.monotonic()
+        return pulled
+
+    def refresh_if_due(self) -> None:
+        if self.refresh and time.monotonic() - self._refreshed >= self.refresh:
+            self.pull()
+
+    def __contains__(self, key: DuplicateKey) -> bool:
+        self.refresh_if_due()
+        self.lookups += 1
+        token = key.token
+        if self.bloom is not None and token not in self.bloom:
+            return False
+        self.queries += 1
+        with self._lock:
+            found = self._db().execute("SELECT 1 FROM invoices WHERE key = ?", (token,)).fetchone() is not None
+        if found:
+            self.duplicates += 1
+        return found
+
+    def add_many(self, keys: Iterable[DuplicateKey]) -> int:
+        """Record keys, BATCH_SIZE per transaction; returns the number of keys not recorded before."""
+        added = 0
+        keys = iter(keys)
+        while True:
+            rows = [(key.token, *key) for key in islice(keys, BATCH_SIZE)]
+            if not rows:
+                break
+            with self._lock:
+                db = self._db()
+                before = db.total_changes
+                db.execute("BEGIN")
+                try:
+                    db.executemany("INSERT OR IGNORE INTO invoices (key, seller, number, year) VALUES (?, ?, ?, ?)", rows)
+                except BaseException:
+                    db.execute("ROLLBACK")
+                    raise
+                db.execute("COMMIT")
+                added += db.total_changes - before
+        self.pull()
+        return added
+
+    def count(self) -> int:
+        with self._lock:
+            return self._db().execute("SELECT COUNT(*) FROM invoices").fetchone()[0]
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": enabled(),
+            "db": self.db_path,
+            "keys": self.count(),
+            "generation": self.generation,
+            "bloom": {"bits": self.bloom.size, "hashes": self.bloom.hashes, "keys": self.bloom.count,
+                      "bytes": len(self.bloom.bits)} if self.bloom is not None else None,
+            "lookups": self.lookups,
+            "queries": self.queries,
+            "duplicates": self.duplicates,
+        }
+
+
+def default_db() -> str:
+    """In memory for a single worker; a WAL file shared by the workers otherwise."""
+    return str(workers.state_path("duplicates.sqlite3")) if workers.shared() else ":memory:"
+
+
+def enabled() -> bool:
+    return os.environ.get(CHECK_ENV, "").strip().lower() in {"1", "true", "yes"}
+
+
+_index: Optional[DuplicateIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_index() -> DuplicateIndex:
+    """Process-wide index, opened (and its filter filled from the database) on first use."""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = DuplicateIndex.from_env()
+    return _index
+
+
+def cache_token() -> str:
+    """Part of the result cache keys: '' when the check is off, else the index generation."""
+    if not enabled():
+        return ""
+    index = get_index()
+    index.refresh_if_due()
+    return f"dup:{index.generation}"
+
+
+def check_tree(root: etree._Element, fmt: str) -> List[RuleIssue]:
+    """DOUBLE_FACT issue when the invoice key is already recorded."""
+    key = key_from_tree(root, fmt)
+    if key is None or key not in get_index():
+        return []
+    return [RuleIssue(ruleId=RULE_ID, severity="error", xpath=_PATHS[fmt]["number"],
+                      message=f"Facture en doublon : le numéro {key.number} a déjà été émis en {key.year} "
+                              f"par le vendeur {key.seller}")]
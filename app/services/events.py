@@ -0,0 +1,113 @@
+"""Validation issues as a stream of events, for NDJSON and Server-Sent Events responses.
+
+A run is reported as (kind, value) pairs instead of one ValidationReport: kind is syntax
+(value: syntax.SyntaxEntry, or its text when replayed from a cached report), rules or
+codelists (value: RuleIssue), and the last event is always ("summary", dict) with the
+issue counts. IssueLimit implements the max-errors cutoff: once it is reached, further
+issues are dropped and the producer stops before its next stage.
+"""
+import json
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from ..models.schemas import ValidationReport
+
+Event = Tuple[str, Any]
+
+ISSUE_KINDS = ("syntax", "rules", "codelists")
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "sse": "text/event-stream"}
+
+
+class IssueLimit:
+    """Issue counts of one run and the optional max-errors cutoff."""
+
+    def __init__(self, max_errors: Optional[int] = None):
+        self.max_errors = max_errors if max_errors and max_errors > 0 else None
+        self.counts = dict.fromkeys(ISSUE_KINDS, 0)
+        self.truncated = False
+
+    @property
+    def total(self) -> int:
+        return sum(self.counts.values())
+
+    def remaining(self) -> Optional[int]:
+        """Issues still allowed, None when unlimited."""
+        return None if self.max_errors is None else max(0, self.max_errors - self.total)
+
+    def take(self, kind: str, issues: Iterable[Any]) -> List[Event]:
+        """Events for the issues that fit under the cutoff; sets truncated when some are dropped."""
+        taken = []
+        for issue in issues:
+            if self.max_errors is not None and self.total >= self.max_errors:
+                self.truncated = True
+                break
+            self.counts[kind] += 1
+            taken.append((kind, issue))
+        return taken
+
+    @property
+    def reached(self) -> bool:
+        return self.truncated or (self.max_errors is not None and self.total >= self.max_errors)
+
+    def summary(self, **extra) -> Event:
+        return "summary", {"valid": self.total == 0, **self.counts, "truncated": self.reached, **extra}
+
+
+def report_events(report: ValidationReport, limit: IssueLimit) -> Iterator[Event]:
+    """Replay a finished report (e.g. from the result cache) through the cutoff."""
+    for kind in ISSUE_KINDS:
+        yield from limit.take(kind, getattr(report, kind))
+        if limit.truncated:
+            return
+
+
+def to_report(events: Iterable[Event]) -> ValidationReport:
+    """Collect issue events into the usual report (only the snapshot version is kept from the summary)."""
+    report = ValidationReport(syntax=[], rules=[], codelists=[])
+    for kind, value in events:
+        if kind == "syntax":
+            report.syntax.append(str(value))
+        elif kind == "summary":
+            report.snapshotVersion = value.get("snapshotVersion")
+        else:
+            getattr(report, kind).append(value)
+    return report
+
+
+def event_json(event: Event) -> Dict[str, Any]:
+    kind, value = event
+    if kind == "summary":
+        return {"kind": kind, **value}
+    if kind == "syntax":
+        if isinstance(value, str):
+            return {"kind": kind, "message": value}
+        return {"kind": kind, **value.to_model().model_dump(exclude={"count"})}
+    return {"kind": kind, **value.model_dump()}
+
+
+def ndjson_lines(events: Iterable[Event]) -> bytes:
+    """One JSON object per line for a batch of events."""
+    return b"".join(json.dumps(event_json(e), ensure_ascii=False).encode("utf-8") + b"\n" for e in events)
+
+
+def sse_lines(events: Iterable[Event]) -> bytes:
+    """Server-Sent Events, the event name being the kind."""
+    return b"".join(
+        f"event: {e[0]}\ndata: {json.dumps(event_json(e), ensure_ascii=False)}\n\n".encode("utf-8") for e in events
+    )
+
+
+def encoder(output: str):
+    return ndjson_lines if output == "ndjson" else sse_lines
+
+
+def output_format(output: Optional[str], accept: str = "") -> str:
+    """report, ndjson or sse: the output parameter, else the Accept header; raises ValueError when unknown."""
+    if output is None:
+        for name, media_type in MEDIA_TYPES.items():
+            if media_type in accept:
+                return name
+        return "report"
+    output = output.strip().lower()
+    if output != "report" and output not in MEDIA_TYPES:
+        raise ValueError(f"Unknown output: {output} (report, ndjson or sse)")
+    return output
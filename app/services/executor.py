@@ -0,0 +1,126 @@
+"""Bounded executor for CPU-bound tool calls made from an asyncio event loop.
+
+Keeps the MCP SSE server responsive: decoding, Factur-X extraction, XSD validation and
+rule evaluation run in a thread or process pool of fixed size, each tool has its own
+concurrency limit, and every call is bounded by a timeout.
+"""
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+KIND_ENV = "FE_MCP_EXECUTOR"  # thread | process
+WORKERS_ENV = "FE_MCP_WORKERS"
+CONCURRENCY_ENV = "FE_MCP_TOOL_CONCURRENCY"
+TIMEOUT_ENV = "FE_MCP_TIMEOUT"
+
+
+class ToolTimeout(Exception):
+    pass
+
+
+class ToolExecutor:
+    def __init__(self, kind: str = "thread", workers: Optional[int] = None, concurrency: Optional[int] = None,
+                 timeout: Optional[float] = 60.0, initializer: Optional[Callable[[], None]] = None):
+        self.kind = kind
+        self.workers = workers or os.cpu_count() or 1
+        # Per-tool limit defaults to the pool size: queueing happens before the pool, where it is measurable.
+        self.concurrency = concurrency or self.workers
+        self.timeout = timeout
+        self._initializer = initializer
+        self._pool: Optional[Executor] = None
+        self._pool_lock = threading.Lock()
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._waiting: Dict[str, int] = {}
+        self._running: Dict[str, int] = {}
+        self._timeouts = 0
+
+    @classmethod
+    def from_env(cls, initializer: Optional[Callable[[], None]] = None) -> "ToolExecutor":
+        kind = os.environ.get(KIND_ENV, "thread").strip().lower()
+        workers = int(os.environ[WORKERS_ENV]) if os.environ.get(WORKERS_ENV) else None
+        concurrency = int(os.environ[CONCURRENCY_ENV]) if os.environ.get(CONCURRENCY_ENV) else None
+        timeout = float(os.environ.get(TIMEOUT_ENV, "60")) or None
+        return cls(kind=kind, workers=workers, concurrency=concurrency, timeout=timeout, initializer=initializer)
+
+    def _get_pool(self) -> Executor:
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    if self.kind == "process":
+                        self._pool = ProcessPoolExecutor(
+                            max_workers=self.workers,
+                            mp_context=multiprocessing.get_context("spawn"),
+                            initializer=self._initializer,
+                        )
+                    else:
+                        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="fe-tool")
+        return self._pool
+
+    def _semaphore(self, tool: str) -> asyncio.Semaphore:
+        sem = self._semaphores.get(tool)
+        if sem is None:
+            sem = self._semaphores[tool] = asyncio.Semaphore(self.concurrency)
+        return sem
+
+    async def run(self, tool: str, fn: Callable[..., Any], *args: Any, cpu: bool = True) -> Any:
+        """Run fn(*args) off the event loop under the tool's concurrency limit and the call timeout.
+
+        cpu=False runs in a plain thread even when the pool is process based (for callables that
+        manage their own worker processes). On timeout the caller gets ToolTimeout; the worker
+        finishes in the background since Python threads and pool tasks cannot be interrupted.
+        """
+        loop = asyncio.get_running_loop()
+        self._waiting[tool] = self._waiting.get(tool, 0) + 1
+        admitted = False
+        try:
+            async with self._semaphore(tool):
+                self._waiting[tool] -= 1
+                admitted = True
+                self._running[tool] = self._running.get(tool, 0) + 1
+                try:
+                    future = loop.run_in_executor(self._get_pool() if cpu else None, fn, *args)
+                    return await asyncio.wait_for(future, self.timeout)
+                except asyncio.TimeoutError:
+                    self._timeouts += 1
+                    raise ToolTimeout(f"Tool '{tool}' timed out after {self.timeout:g}s")
+                finally:
+                    self._running[tool] -= 1
+        finally:
+            if not admitted:
+                self._waiting[tool] -= 1
+
+    def queue_depth(self) -> int:
+        """Calls waiting for a concurrency slot plus calls admitted but not yet picked up by a worker."""
+        running = sum(self._running.values())
+        return sum(self._waiting.values()) + max(0, running - self.workers)
+
+    def stats(self) -> Dict:
+        return {
+            "kind": self.kind,
+            "workers": self.workers,
+            "concurrencyPerTool": self.concurrency,
+            "timeoutSeconds": self.timeout,
+            "queueDepth": self.queue_depth(),
+            "waiting": {k: v for k, v in self._waiting.items() if v},
+            "running": {k: v for k, v in self._running.items() if v},
+            "timeouts": self._timeouts,
+        }
+
+    def recycle(self) -> None:
+        """Retire a process pool (its workers keep the snapshot they loaded): calls already submitted
+        finish on it, the next call starts new workers. Thread pools share the process state and stay."""
+        if self.kind != "process":
+            return
+        with self._pool_lock:
+            old, self._pool = self._pool, None
+        if old is not None:
+            old.shutdown(wait=False)
+
+    def shutdown(self) -> None:
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
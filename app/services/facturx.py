@@ -0,0 +1,526 @@
+"""Factur-X extraction: locate and inflate the embedded CII XML of a PDF/A-3 invoice.
+
+The PDF is read through its cross-reference data (classic tables, xref streams and
+object streams, PDF 1.5+) rather than by scanning bytes, because the embedded file is
+normally FlateDecode-compressed. The document catalog's /Names/EmbeddedFiles tree and
+/AF array are walked to find the invoice attachment, and only that stream is inflated.
+
+Everything works in place on bytes or an mmap (streams are sliced through memoryviews);
+extract_facturx_xml_from_file maps uploaded files instead of reading them into memory.
+"""
+import mmap
+import os
+import re
+import zlib
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Tuple, Union
+
+Buffer = Union[bytes, bytearray, memoryview, mmap.mmap]
+
+# Attachment names used by Factur-X / ZUGFeRD / XRechnung, by preference.
+XML_NAMES = ("factur-x.xml", "zugferd-invoice.xml", "xrechnung.xml")
+MAX_XML_ENV = "FE_FACTURX_MAX_XML_MB"
+
+_WS = b" \t\r\n\f\x00"
+_DELIMS = b"()<>[]{}/%"
+_NUMBER = re.compile(rb"[+-]?(?:\d+\.?\d*|\.\d+)")
+_REGULAR = re.compile(rb"[^ \t\r\n\f\x00()<>\[\]{}/%]+")
+_OBJ_HEADER = re.compile(rb"(\d+)\s+(\d+)\s+obj\b")
+_STARTXREF = re.compile(rb"startxref\s+(\d+)")
+_REF_TAIL = re.compile(rb"\s+(\d+)\s+R\b")
+
+
+class PDFError(ValueError):
+    pass
+
+
+class Name(str):
+    pass
+
+
+class Ref:
+    __slots__ = ("num", "gen")
+
+    def __init__(self, num: int, gen: int):
+        self.num = num
+        self.gen = gen
+
+
+class Stream:
+    __slots__ = ("dict", "start", "length")
+
+    def __init__(self, attrs: Dict, start: int, length: Optional[int]):
+        self.dict = attrs
+        self.start = start
+        self.length = length
+
+
+def max_xml_bytes() -> int:
+    return int(os.environ.get(MAX_XML_ENV, "200")) * 1024 * 1024
+
+
+class _Lexer:
+    """Recursive-descent reader for PDF objects at arbitrary offsets of a buffer."""
+
+    def __init__(self, buf: Buffer):
+        self.buf = buf
+        self.size = len(buf)
+
+    def skip_ws(self, pos: int) -> int:
+        buf, size = self.buf, self.size
+        while pos < size:
+            c = buf[pos]
+            if c in _WS:
+                pos += 1
+            elif c == 0x25:  # % comment
+                while pos < size and buf[pos] not in b"\r\n":
+                    pos += 1
+            else:
+                break
+        return pos
+
+    def keyword(self, pos: int) -> Tuple[bytes, int]:
+        pos = self.skip_ws(pos)
+        m = _REGULAR.match(self.buf, pos)
+        if not m:
+            return b"", pos
+        return bytes(m.group()), m.end()
+
+    def parse(self, pos: int) -> Tuple[Any, int]:
+        buf = self.buf
+        pos = self.skip_ws(pos)
+        if pos >= self.size:
+            raise PDFError("Unexpected end of PDF data")
+        c = buf[pos]
+        if c == 0x3C:  # <
+            if pos + 1 < self.size and buf[pos + 1] == 0x3C:
+                return self._dict(pos + 2)
+            end = buf.find(b">", pos)
+            if end == -1:
+                raise PDFError("Unterminated hex string")
+            raw = bytes(buf[pos + 1:end]).translate(None, _WS)
+            if len(raw) % 2:
+                raw += b"0"
+            return bytes.fromhex(raw.decode("ascii")), end + 1
+        if c == 0x5B:  # [
+            items: List[Any] = []
+            pos += 1
+            while True:
+                pos = self.skip_ws(pos)
+                if pos >= self.size:
+                    raise PDFError("Unterminated array")
+                if buf[pos] == 0x5D:
+                    return items, pos + 1
+                item, pos = self.parse(pos)
+                items.append(item)
+        if c == 0x2F:  # /
+            m = _REGULAR.match(buf, pos + 1)
+            raw = bytes(m.group()) if m else b""
+            return Name(re.sub(rb"#([0-9A-Fa-f]{2})", lambda h: bytes.fromhex(h.group(1).decode()), raw).decode("latin-1")), pos + 1 + len(raw)
+        if c == 0x28:  # (
+            return self._string(pos + 1)
+        m = _NUMBER.match(buf, pos)
+        if m:
+            text = bytes(m.group())
+            end = m.end()
+            if b"." not in text:
+                # "num gen R" is an indirect reference
+                m2 = _REF_TAIL.match(buf, end)
+                if m2:
+                    return Ref(int(text), int(m2.group(1))), m2.end()
+                return int(text), end
+            return float(text), end
+        word, end = self.keyword(pos)
+        if word == b"true":
+            return True, end
+        if word == b"false":
+            return False, end
+        if word == b"null":
+            return None, end
+        raise PDFError(f"Unexpected token {word[:20]!r} at offset {pos}")
+
+    def _dict(self, pos: int) -> Tuple[Dict, int]:
+        result: Dict[str, Any] = {}
+        buf = self.buf
+        while True:
+            pos = self.skip_ws(pos)
+            if pos + 1 >= self.size:
+                raise PDFError("Unterminated dictionary")
+            if buf[pos] == 0x3E and buf[pos + 1] == 0x3E:
+                return result, pos + 2
+            key, pos = self.parse(pos)
+            if not isinstance(key, Name):
+                raise PDFError("Dictionary key is not a name")
+            value, pos = self.parse(pos)
+            result[str(key)] = value
+
+    def _string(self, pos: int) -> Tuple[bytes, int]:
+        buf, out, depth = self.buf, bytearray(), 1
+        escapes = {0x6E: b"\n", 0x72: b"\r", 0x74: b"\t", 0x62: b"\b", 0x66: b"\f"}
+        while pos < self.size:
+            c = buf[pos]
+            if c == 0x5C:  # backslash
+                pos += 1
+                n = buf[pos]
+                if n in escapes:
+                    out += escapes[n]
+                    pos += 1
+                elif 0x30 <= n <= 0x37:
+                    digits = bytes(buf[pos:pos + 3])
+                    octal = re.match(rb"[0-7]{1,3}", digits).group()
+                    out.append(int(octal, 8) & 0xFF)
+                    pos += len(octal)
+                elif n in b"\r\n":
+                    pos += 2 if n == 0x0D and pos + 1 < self.size and buf[pos + 1] == 0x0A else 1
+                else:
+                    out.append(n)
+                    pos += 1
+                continue
+            if c == 0x28:
+                depth += 1
+            elif c == 0x29:
+                depth -= 1
+                if depth == 0:
+                    return bytes(out), pos + 1
+            out.append(c)
+            pos += 1
+        raise PDFError("Unterminated string")
+
+
+class PDFDocument:
+    """Cross-reference aware object reader; only what embedded-file lookup needs."""
+
+    def __init__(self, buf: Buffer):
+        self.buf = buf
+        self.lexer = _Lexer(buf)
+        # num -> ("offset", pos) | ("objstm", stream num, index)
+        self.xref: Dict[int, Tuple] = {}
+        self.trailer: Dict[str, Any] = {}
+        self._objstm_cache: Dict[int, Dict[int, Any]] = {}
+        try:
+            self._read_xref_chain()
+        except (PDFError, ValueError, IndexError, zlib.error):
+            self.xref, self.trailer = {}, {}
+        if "Root" not in self.trailer:
+            self._rebuild_xref()
+
+    # -- cross-reference -------------------------------------------------
+    def _read_xref_chain(self) -> None:
+        tail_start = max(0, len(self.buf) - 2048)
+        matches = list(_STARTXREF.finditer(self.buf, tail_start))
+        if not matches:
+            raise PDFError("startxref not found")
+        offset: Optional[int] = int(matches[-1].group(1))
+        seen = set()
+        while offset is not None and offset not in seen:
+            seen.add(offset)
+            trailer = self._read_xref_section(offset)
+            for key, value in trailer.items():
+                self.trailer.setdefault(key, value)
+            if isinstance(trailer.get("XRefStm"), int):
+                self._read_xref_section(trailer["XRefStm"])
+            prev = trailer.get("Prev")
+            offset = prev if isinstance(prev, int) else None
+
+    def _read_xref_section(self, offset: int) -> Dict[str, Any]:
+        word, pos = self.lexer.keyword(offset)
+        if word == b"xref":
+            return self._read_xref_table(pos)
+        _, _, obj = self._parse_indirect(offset)
+        if not isinstance(obj, Stream) or obj.dict.get("Type") != "XRef":
+            raise PDFError("Invalid cross-reference section")
+        self._read_xref_stream(obj)
+        return obj.dict
+
+    def _read_xref_table(self, pos: int) -> Dict[str, Any]:
+        lexer = self.lexer
+        while True:
+            word, after = lexer.keyword(pos)
+            if word == b"trailer":
+                trailer, _ = lexer.parse(after)
+                return trailer
+            start, pos = lexer.parse(pos)
+            count, pos = lexer.parse(pos)
+            for i in range(count):
+                entry_off, pos = lexer.parse(pos)
+                _gen, pos = lexer.parse(pos)
+                kind, pos = lexer.keyword(pos)
+                if kind == b"n" and start + i not in self.xref and entry_off > 0:
+                    self.xref[start + i] = ("offset", entry_off)
+                elif kind == b"f":
+                    self.xref.setdefault(start + i, ("free",))
+
+    def _read_xref_stream(self, stream: Stream) -> None:
+        data = self.stream_data(stream)
+        widths = stream.dict["W"]
+        index = stream.dict.get("Index", [0, stream.dict["Size"]])
+        pos = 0
+        for first, count in zip(index[0::2], index[1::2]):
+            for num in range(first, first + count):
+                fields = []
+                for w in widths:
+                    fields.append(int.from_bytes(data[pos:pos + w], "big") if w else None)
+                    pos += w
+                kind = 1 if widths[0] == 0 else fields[0]
+                if num in self.xref:
+                    continue
+                if kind == 1:
+                    self.xref[num] = ("offset", fields[1])
+                elif kind == 2:
+                    self.xref[num] = ("objstm", fields[1], fields[2])
+                else:
+                    self.xref[num] = ("free",)
+            if pos > len(data):
+                raise PDFError("Truncated xref stream")
+
+    def _rebuild_xref(self) -> None:
+        """Damaged or missing xref: index every "n g obj" header and pick the last trailer/catalog."""
+        self.xref = {}
+        for m in _OBJ_HEADER.finditer(self.buf):
+            self.xref[int(m.group(1))] = ("offset", m.start())
+        trailer_pos = self.buf.rfind(b"trailer")
+        if trailer_pos != -1:
+            try:
+                trailer, _ = self.lexer.parse(trailer_pos + len(b"trailer"))
+                if isinstance(trailer, dict):
+                    self.trailer = trailer
+            except PDFError:
+                pass
+        if "Root" not in self.trailer:
+            for num in sorted(self.xref):
+                try:
+                    obj = self.get(num)
+                except (PDFError, ValueError, IndexError, zlib.error):
+                    continue
+                if isinstance(obj, dict) and obj.get("Type") == "Catalog":
+                    self.trailer["Root"] = Ref(num, 0)
+                    break
+                if isinstance(obj, Stream) and obj.dict.get("Type") == "XRef" and "Root" in obj.dict:
+                    self.trailer["Root"] = obj.dict["Root"]
+                    break
+        if "Root" not in self.trailer:
+            raise PDFError("PDF catalog not found")
+
+    # -- objects -----------------------------------------------------------
+    def _parse_indirect(self, offset: int) -> Tuple[int, int, Any]:
+        lexer = self.lexer
+        m = _OBJ_HEADER.match(self.buf, lexer.skip_ws(offset))
+        if not m:
+            raise PDFError(f"No object at offset {offset}")
+        obj, pos = lexer.parse(m.end())
+        word, after = lexer.keyword(pos)
+        if word == b"stream" and isinstance(obj, dict):
+            buf = self.buf
+            if after < len(buf) and buf[after] == 0x0D:
+                after += 1
+            if after < len(buf) and buf[after] == 0x0A:
+                after += 1
+            length = obj.get("Length")
+            if isinstance(length, Ref):
+                length = None  # resolved lazily in stream_data, the object may not be indexed yet
+            obj = Stream(obj, after, length if isinstance(length, int) else None)
+        return int(m.group(1)), int(m.group(2)), obj
+
+    def get(self, num: int) -> Any:
+        entry = self.xref.get(num)
+        if entry is None or entry[0] == "free":
+            return None
+        if entry[0] == "offset":
+            return self._parse_indirect(entry[1])[2]
+        return self._from_objstm(entry[1], entry[2], num)
+
+    def _from_objstm(self, stream_num: int, index: int, num: int) -> Any:
+        objects = self._objstm_cache.get(stream_num)
+        if objects is None:
+            stream = self.get(stream_num)
+            if not isinstance(stream, Stream):
+                raise PDFError("Invalid object stream")
+            data = self.stream_data(stream)
+            lexer = _Lexer(data)
+            first = self.resolve(stream.dict["First"])
+            pos = 0
+            header = []
+            for _ in range(self.resolve(stream.dict["N"])):
+                obj_num, pos = lexer.parse(pos)
+                obj_off, pos = lexer.parse(pos)
+                header.append((obj_num, obj_off))
+            objects = {}
+            for obj_num, obj_off in header:
+                objects[obj_num], _ = lexer.parse(first + obj_off)
+            self._objstm_cache[stream_num] = objects
+        return objects.get(num)
+
+    def resolve(self, obj: Any, depth: int = 0) -> Any:
+        while isinstance(obj, Ref):
+            if depth > 32:
+                raise PDFError("Reference loop")
+            obj = self.get(obj.num)
+            depth += 1
+        return obj
+
+    def stream_bytes(self, stream: Stream) -> memoryview:
+        """Raw (still encoded) stream content, as a view on the PDF buffer; release() it after use."""
+        buf = self.buf
+        length = stream.length
+        if length is None:
+            length = self.resolve(stream.dict.get("Length"))
+        end = stream.start + length if isinstance(length, int) else -1
+        if end < stream.start or bytes(buf[end:end + 32]).lstrip(_WS)[:9] != b"endstream":
+            # Missing or wrong /Length: fall back to the endstream keyword
+            end = buf.find(b"endstream", stream.start)
+            if end == -1:
+                raise PDFError("Unterminated stream")
+            while end > stream.start and buf[end - 1] in b"\r\n":
+                end -= 1
+        return memoryview(buf)[stream.start:end]
+
+    def stream_data(self, stream: Stream, limit: Optional[int] = None) -> bytes:
+        filters = self.resolve(stream.dict.get("Filter"))
+        params = self.resolve(stream.dict.get("DecodeParms"))
+        if filters is None:
+            filters, params = [], []
+        elif not isinstance(filters, list):
+            filters, params = [filters], [params]
+        elif not isinstance(params, list):
+            params = [params] * len(filters)
+        raw = self.stream_bytes(stream)
+        try:
+            data: Any = raw
+            for name, parms in zip(filters, params):
+                if name not in ("FlateDecode", "Fl"):
+                    raise PDFError(f"Unsupported stream filter {name}")
+                inflater = zlib.decompressobj()
+                data = inflater.decompress(data, limit or 0)
+                if limit and inflater.unconsumed_tail:
+                    raise PDFError("Embedded file exceeds the size limit")
+                parms = self.resolve(parms)
+                if isinstance(parms, dict) and self.resolve(parms.get("Predictor", 1)) >= 10:
+                    data = _png_unpredict(data, self.resolve(parms.get("Columns", 1)))
+            return bytes(data)
+        finally:
+            raw.release()
+
+    # -- embedded files ----------------------------------------------------
+    def embedded_files(self) -> Iterator[Tuple[str, Dict]]:
+        """(file name, file specification) of every attachment in /EmbeddedFiles and /AF."""
+        root = self.resolve(self.trailer.get("Root"))
+        if not isinstance(root, dict):
+            raise PDFError("PDF catalog not found")
+        seen = set()
+        names = self.resolve(root.get("Names"))
+        if isinstance(names, dict):
+            for key, spec in self._name_tree(self.resolve(names.get("EmbeddedFiles")), 0):
+                spec = self.resolve(spec)
+                if isinstance(spec, dict):
+                    seen.add(id(spec))
+                    yield _filespec_name(spec, key), spec
+        for spec in self.resolve(root.get("AF")) or []:
+            spec = self.resolve(spec)
+            if isinstance(spec, dict) and id(spec) not in seen:
+                yield _filespec_name(spec, b""), spec
+
+    def _name_tree(self, node: Any, depth: int) -> Iterator[Tuple[bytes, Any]]:
+        if not isinstance(node, dict) or depth > 32:
+            return
+        pairs = self.resolve(node.get("Names")) or []
+        for key, value in zip(pairs[0::2], pairs[1::2]):
+            yield self.resolve(key), value
+        for kid in self.resolve(node.get("Kids")) or []:
+            yield from self._name_tree(self.resolve(kid), depth + 1)
+
+    def embedded_file_data(self, spec: Dict, limit: Optional[int] = None) -> bytes:
+        ef = self.resolve(spec.get("EF"))
+        if not isinstance(ef, dict):
+            raise PDFError("File specification has no embedded file")
+        stream = self.resolve(ef.get("UF") or ef.get("F"))
+        if not isinstance(stream, Stream):
+            raise PDFError("Embedded file stream not found")
+        return self.stream_data(stream, limit)
+
+
+def _png_unpredict(data: bytes, columns: int) -> bytes:
+    row_len = columns + 1
+    out = bytearray()
+    prev = bytearray(columns)
+    for i in range(0, len(data), row_len):
+        kind, row = data[i], bytearray(data[i + 1:i + row_len])
+        if kind == 2:
+            for j in range(len(row)):
+                row[j] = (row[j] + prev[j]) & 0xFF
+        elif kind != 0:
+            raise PDFError(f"Unsupported PNG predictor {kind} in xref stream")
+        out += row
+        prev = row
+    return bytes(out)
+
+
+def _decode_text(value: Any) -> str:
+    if not isinstance(value, bytes):
+        return str(value or "")
+    if value.startswith(b"\xfe\xff"):
+        return value[2:].decode("utf-16-be", "replace")
+    if value.startswith(b"\xef\xbb\xbf"):
+        return value[3:].decode("utf-8", "replace")
+    return value.decode("latin-1")
+
+
+def _filespec_name(spec: Dict, key: Any) -> str:
+    for field in ("UF", "F"):
+        if spec.get(field):
+            return _decode_text(spec[field])
+    return _decode_text(key)
+
+
+def _legacy_scan(buf: Buffer) -> bytes:
+    """Uncompressed attachments in PDFs whose structure cannot be read at all."""
+    start = buf.find(b"<?xml")
+    if start == -1:
+        raise ValueError("No embedded XML found in Factur-X payload")
+    end = -1
+    for marker in [b"</rsm:CrossIndustryInvoice>", b"</Invoice>"]:
+        idx = buf.find(marker, start)
+        if idx != -1:
+            end = idx + len(marker)
+            break
+    if end == -1:
+        end = len(buf)
+    return bytes(buf[start:end])
+
+
+def extract_facturx_xml(pdf: Buffer) -> bytes:
+    """Return the embedded invoice XML (factur-x.xml or equivalent) of a Factur-X PDF."""
+    if isinstance(pdf, memoryview):
+        pdf = pdf.tobytes()  # the parser needs find(); bytes and mmap are used in place
+    if bytes(pdf[:4]) != b"%PDF":
+        raise ValueError("Payload is not a PDF (missing %PDF header)")
+    try:
+        doc = PDFDocument(pdf)
+        attachments = list(doc.embedded_files())
+    except (PDFError, ValueError, KeyError, TypeError, IndexError, zlib.error):
+        return _legacy_scan(pdf)
+    if not attachments:
+        return _legacy_scan(pdf)
+    by_name = {name.lower(): spec for name, spec in attachments}
+    spec = next((by_name[n] for n in XML_NAMES if n in by_name), None)
+    if spec is None:
+        spec = next((s for name, s in attachments if name.lower().endswith(".xml")), None)
+    if spec is None:
+        raise ValueError("No XML attachment found in Factur-X payload")
+    try:
+        return doc.embedded_file_data(spec, max_xml_bytes())
+    except zlib.error as exc:
+        raise ValueError(f"Corrupt embedded XML stream: {exc}") from exc
+
+
+def extract_facturx_xml_from_file(fileobj: BinaryIO) -> bytes:
+    """Same as extract_facturx_xml for a file object; files backed by a descriptor are memory-mapped, not read."""
+    try:
+        fileno = fileobj.fileno()
+    except (AttributeError, OSError, ValueError):
+        fileno = None
+    if fileno is None:
+        return extract_facturx_xml(fileobj.read())
+    fileobj.flush()
+    if os.fstat(fileno).st_size == 0:
+        raise ValueError("Payload is not a PDF (missing %PDF header)")
+    with mmap.mmap(fileno, 0, access=mmap.ACCESS_READ) as mapped:
+        return extract_facturx_xml(mapped)
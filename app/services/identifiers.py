@@ -0,0 +1,318 @@
+"""French company identifier checks: SIREN, SIRET and FR VAT numbers.
+
+A SIREN is 9 digits and a SIRET 14 digits (SIREN + NIC), both with a Luhn check digit;
+La Poste establishments (SIREN 356000000) use a digit sum divisible by 5 instead. A French
+VAT number is FR + a 2-digit key + the SIREN, with key = (12 + 3 * (SIREN mod 97)) mod 97.
+
+Each identifier gets a one-digit result code (CODES); bulk results are the string of these
+codes in input order. validate_many() runs the digit and Luhn arithmetic on NumPy arrays
+when NumPy is installed (it is optional: FE_IDENTIFIERS_NUMPY=0 or its absence selects the
+pure-Python loop, which gives the same codes) and the batch is at least VECTOR_MIN long.
+The identifiers of a kind are joined into one ASCII buffer viewed as an (n, width) digit
+matrix, so the per-item Python work is reduced to the length filter.
+
+check_tree() backs the per-document checks: party identifiers tagged with the ISO 6523
+scheme 0002 (SIREN) or 0009 (SIRET) and FR VAT numbers of the parties in UBL/CII, the
+supplier and debtor identifiers of CPPStatut messages and the annuaire SIREN/SIRET
+elements. The fields are bound to root-anchored paths per format (no search of the
+invoice lines) and their values are checked with one validate_many() call per kind.
+E-reporting goes element by element through check_element() (schemeId, TaxRegistrationId)
+so that the streaming validator reports the same issues.
+"""
+import os
+from itertools import repeat
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from lxml import etree
+
+from ..models.schemas import RuleIssue
+
+try:
+    import numpy as np
+except ImportError:  # optional: pure-Python fallback
+    np = None
+
+NUMPY_ENV = "FE_IDENTIFIERS_NUMPY"
+MAX_ENV = "FE_IDENTIFIERS_MAX"
+# Below this many identifiers the array set-up costs more than the loop
+VECTOR_MIN = 64
+
+VALID, FORMAT, CHECKSUM, VAT_KEY = 0, 1, 2, 3
+CODES = {
+    VALID: "valide",
+    FORMAT: "longueur ou caractères invalides",
+    CHECKSUM: "clé de contrôle (Luhn) invalide",
+    VAT_KEY: "clé TVA incohérente avec le SIREN",
+}
+KINDS = ("siren", "siret", "vat", "auto")
+WIDTHS = {"siren": 9, "siret": 14, "vat": 13}
+LA_POSTE = "356000000"
+
+# ISO 6523 scheme identifiers and the attributes carrying them (e-reporting elements)
+SCHEMES = {"0002": "siren", "0009": "siret"}
+_SCHEME_ATTRIBUTES = ("schemeID", "schemeId", "qualifiant")
+# Elements holding an identifier of a fixed kind whatever their attributes
+_NAMED = {"IdSIREN": "siren", "IdSIRET": "siret", "IdLinSIREN": "siren", "IdLinSIRET": "siret"}
+_VAT_NAMES = {"TaxRegistrationId"}
+RULE_IDS = {"siren": "ID-SIREN", "siret": "ID-SIRET", "vat": "ID-TVA"}
+
+_NS = {
+    "cac": "urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2",
+    "cbc": "urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2",
+    "rsm": "urn:un:unece:uncefact:data:standard:CrossIndustryInvoice:100",
+    "ram": "urn:un:unece:uncefact:data:standard:ReusableAggregateBusinessInformationEntity:100",
+}
+_UBL_PARTIES = ("/*/cac:AccountingSupplierParty/cac:Party", "/*/cac:AccountingCustomerParty/cac:Party",
+                "/*/cac:PayeeParty", "/*/cac:TaxRepresentativeParty")
+_CII_HEADER = "/rsm:CrossIndustryInvoice/rsm:SupplyChainTradeTransaction"
+_CII_PARTIES = tuple(f"{_CII_HEADER}/{party}" for party in (
+    "ram:ApplicableHeaderTradeAgreement/ram:SellerTradeParty", "ram:ApplicableHeaderTradeAgreement/ram:BuyerTradeParty",
+    "ram:ApplicableHeaderTradeAgreement/ram:SellerTaxRepresentativeTradeParty",
+    "ram:ApplicableHeaderTradeSettlement/ram:PayeeTradeParty"))
+_CPP_ENTRY = "/CPPStatut/CPPFactureStatuts/CPPFactureStatutUnitaire"
+
+
+def _scheme_paths(parties: Sequence[str], fields: Sequence[str], scheme: str) -> List[str]:
+    return [f"{party}/{field}[@schemeID='{scheme}']" for party in parties for field in fields]
+
+
+_UBL_SCHEME_FIELDS = ("cbc:EndpointID", "cac:PartyIdentification/cbc:ID", "cac:PartyLegalEntity/cbc:CompanyID")
+_CII_SCHEME_FIELDS = ("ram:ID", "ram:GlobalID", "ram:SpecifiedLegalOrganization/ram:ID",
+                      "ram:URIUniversalCommunication/ram:URIID")
+# Format -> kind -> root-anchored paths of the elements holding an identifier of that kind
+_PATHS = {
+    "ubl": {
+        "siren": _scheme_paths(_UBL_PARTIES, _UBL_SCHEME_FIELDS, "0002"),
+        "siret": _scheme_paths(_UBL_PARTIES, _UBL_SCHEME_FIELDS, "0009"),
+        "vat": [f"{party}/cac:PartyTaxScheme/cbc:CompanyID" for party in _UBL_PARTIES],
+    },
+    "cii": {
+        "siren": _scheme_paths(_CII_PARTIES, _CII_SCHEME_FIELDS, "0002"),
+        "siret": _scheme_paths(_CII_PARTIES, _CII_SCHEME_FIELDS, "0009"),
+        "vat": [f"{party}/ram:SpecifiedTaxRegistration/ram:ID" for party in _CII_PARTIES],
+    },
+    # CPPStatut TypeIdentifiant: 1 SIRET, 2 VAT number
+    "cdv": {
+        "siret": [f"{_CPP_ENTRY}/Fournisseur[TypeIdentifiant='1']/Identifiant",
+                  f"{_CPP_ENTRY}/Debiteur[TypeIdentifiant='1']/Identifiant"],
+        "vat": [f"{_CPP_ENTRY}/Fournisseur[TypeIdentifiant='2']/Identifiant"],
+    },
+}
+_PATHS["creditnote-ubl"] = _PATHS["ubl"]
+# One compiled expression per path: libxml2 merges union node-sets in quadratic time
+_XPATHS = {fmt: {kind: [etree.XPath(path, namespaces=_NS) for path in paths] for kind, paths in kinds.items()}
+           for fmt, kinds in _PATHS.items()}
+# The annuaire nests its identifiers differently in F13 and F14: selected by tag instead
+_ANNUAIRE_TAGS = tuple(f"{{*}}{name}" for name in _NAMED)
+_LABELS = {"siren": "SIREN", "siret": "SIRET", "vat": "numéro de TVA"}
+
+
+def numpy_enabled() -> bool:
+    return np is not None and os.environ.get(NUMPY_ENV, "1").strip().lower() not in {"0", "false", "no"}
+
+
+def max_identifiers() -> int:
+    return int(os.environ.get(MAX_ENV, "5000000"))
+
+
+def normalise(value: str) -> str:
+    """Spaces removed, upper-cased ('fr 40 303 265 045' -> 'FR40303265045')."""
+    return "".join(str(value).split()).upper()
+
+
+def kind_of(value: str) -> str:
+    """Kind of a normalised identifier for kind=auto: FR prefix -> vat, 14 characters -> siret, else siren."""
+    if value.startswith("FR"):
+        return "vat"
+    return "siret" if len(value) == WIDTHS["siret"] else "siren"
+
+
+def luhn(digits: str) -> bool:
+    total = 0
+    for position, char in enumerate(reversed(digits)):
+        digit = ord(char) - 48
+        if position & 1:
+            digit = digit * 2 - 9 if digit > 4 else digit * 2
+        total += digit
+    return total % 10 == 0
+
+
+def vat_key(siren: int) -> int:
+    return (12 + 3 * (siren % 97)) % 97
+
+
+def validate_one(value: str, kind: str = "auto") -> int:
+    """Result code of one identifier (normalised here)."""
+    value = normalise(value)
+    if kind == "auto":
+        kind = kind_of(value)
+    if len(value) != WIDTHS[kind]:
+        return FORMAT
+    if kind == "vat":
+        if not value.startswith("FR") or not value[2:].isascii() or not value[2:].isdigit():
+            return FORMAT
+        if not luhn(value[4:]):
+            return CHECKSUM
+        return VALID if int(value[2:4]) == vat_key(int(value[4:])) else VAT_KEY
+    if not value.isascii() or not value.isdigit():
+        return FORMAT
+    if kind == "siret" and value.startswith(LA_POSTE):
+        return VALID if sum(map(int, value)) % 5 == 0 else CHECKSUM
+    return VALID if luhn(value) else CHECKSUM
+
+
+def _vector_luhn(digits: "np.ndarray") -> "np.ndarray":
+    width = digits.shape[1]
+    doubled = digits[:, width - 2::-2] * 2
+    doubled -= 9 * (doubled > 9)
+    return (digits[:, width - 1::-2].sum(axis=1) + doubled.sum(axis=1)) % 10 == 0
+
+
+def _vector_codes(values: Sequence[str], lengths: "np.ndarray", kind: str) -> "np.ndarray":
+    """Codes of normalised identifiers of one kind, computed on an (n, width) digit matrix."""
+    width = WIDTHS[kind]
+    codes = np.full(len(values), FORMAT, dtype=np.uint8)
+    rows = np.flatnonzero(lengths == width)
+    if not rows.size:
+        return codes
+    text = "".join(values) if rows.size == len(values) else "".join(values[i] for i in rows)
+    if not text.isascii():
+        ascii_rows = np.fromiter((values[i].isascii() for i in rows), dtype=bool, count=rows.size)
+        rows = rows[ascii_rows]
+        text = "".join(values[i] for i in rows)
+    chars = np.frombuffer(text.encode("ascii"), dtype=np.uint8).reshape(rows.size, width)
+    offset = 2 if kind == "vat" else 0
+    digits = chars[:, offset:].astype(np.int64) - 48
+    well_formed = ((digits >= 0) & (digits <= 9)).all(axis=1)
+    if kind == "vat":
+        well_formed &= (chars[:, 0] == ord("F")) & (chars[:, 1] == ord("R"))
+    rows, digits = rows[well_formed], digits[well_formed]
+    siren_digits = digits[:, 2:] if kind == "vat" else digits[:, :9]
+    result = np.where(_vector_luhn(siren_digits if kind == "vat" else digits), VALID, CHECKSUM).astype(np.uint8)
+    if kind == "siret":
+        la_poste = (siren_digits == np.array([int(c) for c in LA_POSTE])).all(axis=1)
+        result[la_poste] = np.where(digits[la_poste].sum(axis=1) % 5 == 0, VALID, CHECKSUM)
+    elif kind == "vat":
+        siren = siren_digits @ (10 ** np.arange(8, -1, -1, dtype=np.int64))
+        key = digits[:, 0] * 10 + digits[:, 1]
+        result[(result == VALID) & (key != (12 + 3 * (siren % 97)) % 97)] = VAT_KEY
+    codes[rows] = result
+    return codes
+
+
+def validate_many(values: Iterable[str], kind: str = "auto", vectorised: Optional[bool] = None) -> str:
+    """Result codes of many identifiers as a string, one digit per identifier in input order.
+
+    vectorised forces (True) or disables (False) the NumPy path; by default it is used when
+    available and worthwhile.
+    """
+    if kind not in KINDS:
+        raise ValueError(f"Unknown identifier kind {kind!r}; expected one of {', '.join(KINDS)}")
+    # Already normalised values (digits, upper-case FR) skip the split/join
+    values = [v if isinstance(v, str) and v.isalnum() and (v.isdigit() or v.isupper()) else normalise(v) for v in values]
+    if vectorised is None:
+        vectorised = numpy_enabled() and len(values) >= VECTOR_MIN
+    if not vectorised:
+        # Documents repeat the same few identifiers (one supplier per CDV entry): each is checked once
+        seen: Dict[str, str] = {}
+        return "".join(seen[v] if v in seen else seen.setdefault(v, str(validate_one(v, kind))) for v in values)
+    if np is None:
+        raise RuntimeError("NumPy is not installed")
+    lengths = np.fromiter(map(len, values), dtype=np.int64, count=len(values))
+    if kind != "auto":
+        codes = _vector_codes(values, lengths, kind)
+    else:
+        # kind_of() on arrays: FR prefix -> vat, 14 characters -> siret, else siren
+        vat = np.fromiter(map(str.startswith, values, repeat("FR")), dtype=bool, count=len(values))
+        siret = ~vat & (lengths == WIDTHS["siret"])
+        codes = np.empty(len(values), dtype=np.uint8)
+        for each, mask in (("vat", vat), ("siret", siret), ("siren", ~(vat | siret))):
+            rows = np.flatnonzero(mask)
+            if rows.size == len(values):
+                codes = _vector_codes(values, lengths, each)
+            elif rows.size:
+                codes[rows] = _vector_codes([values[i] for i in rows], lengths[rows], each)
+    return (codes + 48).tobytes().decode("ascii")
+
+
+def summary(codes: str, kind: str) -> Dict:
+    """Compact bulk result: counts, the code string and the code legend."""
+    valid = codes.count(str(VALID))
+    return {
+        "kind": kind,
+        "total": len(codes),
+        "valid": valid,
+        "invalid": len(codes) - valid,
+        "codes": codes,
+        "legend": {str(code): label for code, label in CODES.items()},
+        "engine": "numpy" if numpy_enabled() and len(codes) >= VECTOR_MIN else "python",
+    }
+
+
+def validate_report(values: Sequence[str], kind: str = "auto") -> Dict:
+    """validate_many() with its summary; raises ValueError past FE_IDENTIFIERS_MAX identifiers."""
+    if len(values) > max_identifiers():
+        raise ValueError(f"Too many identifiers ({len(values)} > {max_identifiers()})")
+    return summary(validate_many(values, kind), kind)
+
+
+def _local(tag: object) -> str:
+    return tag.rpartition("}")[2] if isinstance(tag, str) else ""
+
+
+def element_kind(elem: etree._Element) -> Optional[str]:
+    """Identifier kind held by an e-reporting (or annuaire) element, or None."""
+    for attribute in _SCHEME_ATTRIBUTES:
+        scheme = elem.get(attribute)
+        if scheme is not None:
+            if scheme in SCHEMES:
+                return SCHEMES[scheme]
+            break
+    name = _local(elem.tag)
+    if name in _VAT_NAMES:
+        return "vat"
+    return _NAMED.get(name)
+
+
+def _issue(elem: etree._Element, kind: str, value: str, code: int, rule_ids: Optional[Dict[str, str]]) -> RuleIssue:
+    return RuleIssue(ruleId=(rule_ids or RULE_IDS)[kind], severity="error", xpath=f".//{elem.tag}",
+                     message=f"{_LABELS[kind]} {value} invalide : {CODES[code]}")
+
+
+def check_element(elem: etree._Element, issues: List[RuleIssue], rule_ids: Optional[Dict[str, str]] = None) -> None:
+    """Issue for an invalid SIREN, SIRET or FR VAT number held by elem (other VAT numbers are not checked)."""
+    kind = element_kind(elem)
+    if kind is None:
+        return
+    value = normalise(elem.text or "")
+    if not value or (kind == "vat" and not value.startswith("FR")):
+        return
+    code = validate_one(value, kind)
+    if code != VALID:
+        issues.append(_issue(elem, kind, value, code, rule_ids))
+
+
+def checks_name(name: str) -> bool:
+    """Whether element local names like this one can hold an identifier checked by check_element."""
+    return name in _NAMED or name in _VAT_NAMES or name in {"CompanyId", "Id"}
+
+
+def check_tree(root: etree._Element, fmt: str, rule_ids: Optional[Dict[str, str]] = None) -> List[RuleIssue]:
+    """Issues for the invalid identifiers of a UBL, CII, CDV or annuaire document."""
+    found: Dict[str, List[etree._Element]] = {}
+    if fmt == "annuaire":
+        for elem in root.iter(*_ANNUAIRE_TAGS):
+            found.setdefault(_NAMED[_local(elem.tag)], []).append(elem)
+    else:
+        for kind, xpaths in _XPATHS.get(fmt, {}).items():
+            found[kind] = [elem for xpath in xpaths for elem in xpath(root)]
+    issues: List[RuleIssue] = []
+    for kind, elems in found.items():
+        values = [normalise(elem.text or "") for elem in elems]
+        if kind == "vat":
+            # Only FR VAT numbers have a known key
+            elems, values = [e for e, v in zip(elems, values) if v.startswith("FR")], [v for v in values if v.startswith("FR")]
+        for elem, value, code in zip(elems, values, validate_many(values, kind)):
+            if code != "0" and value:
+                issues.append(_issue(elem, kind, value, int(code), rule_ids))
+    return issues
@@ -0,0 +1,308 @@
+"""CDV lifecycle: current status per invoice and the allowed status transitions (Flux 6).
+
+The transition graph follows the lifecycle of the XP Z12-014 use cases and the status
+table of Annexe 2 (which lists the statuses but not their order): it is an approximation,
+kept here in one place and served by /cdv/status and /next_status (as "transitions", next
+to the published "allowed" map). The terminal statuses (Refusée, Encaissée, Rejetée,
+Annulée, ERREUR_ROUTAGE) allow no further transition; repeating the current status is
+accepted as a duplicate without changing anything.
+
+The current status of each invoice is stored in SQLite (FE_CDV_DB; when unset, in memory,
+or in FE_STATE_DIR with several workers) together with the history of accepted
+transitions. Status messages (CPPStatut, one event per CPPFactureStatutUnitaire, invoice =
+supplier identifier + IdFacture) are recorded in bulk by ingest(): events are taken in
+arrival order, the current statuses of a batch are read with one query and the accepted
+transitions written in one transaction per BATCH_SIZE events.
+
+With FE_CDV_CHECK=1, rules_engine checks every CDV message against the stored statuses
+without recording it (CDV-TRANSITION issues); the store generation is then part of the
+result cache keys.
+"""
+import os
+import sqlite3
+import threading
+from itertools import islice
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence
+
+from lxml import etree
+
+from ..models.schemas import RuleIssue
+from . import workers
+
+CHECK_ENV = "FE_CDV_CHECK"
+DB_ENV = "FE_CDV_DB"
+RULE_ID = "CDV-TRANSITION"
+# Events validated and written per transaction by ingest
+BATCH_SIZE = 5_000
+# Host parameters per SELECT ... IN (...) (SQLite allows 999 in older builds)
+_QUERY_CHUNK = 500
+
+_FOLLOW_UP = ["CDV-204", "CDV-205", "CDV-206", "CDV-207", "CDV-208", "CDV-210", "CDV-214", "CDV-227"]
+
+# Current status (None: invoice unknown) -> statuses allowed next
+TRANSITIONS: Dict[Optional[str], List[str]] = {
+    None: ["CDV-200"],
+    "CDV-200": ["CDV-201", "CDV-202", "CDV-213", "CDV-220"],
+    "CDV-201": ["CDV-202", "CDV-213", "CDV-220"],
+    "CDV-202": ["CDV-203", "CDV-213", "CDV-221", "CDV-220"],
+    "CDV-203": _FOLLOW_UP + ["CDV-220"],
+    "CDV-204": [s for s in _FOLLOW_UP if s != "CDV-204"] + ["CDV-220"],
+    "CDV-205": ["CDV-211", "CDV-212", "CDV-214"],
+    "CDV-206": ["CDV-205", "CDV-207", "CDV-211", "CDV-212"],
+    "CDV-207": ["CDV-205", "CDV-206", "CDV-208", "CDV-209", "CDV-210", "CDV-220"],
+    "CDV-208": ["CDV-209", "CDV-210", "CDV-220"],
+    "CDV-209": [s for s in _FOLLOW_UP if s != "CDV-227"],
+    "CDV-211": ["CDV-212"],
+    "CDV-214": ["CDV-205", "CDV-206", "CDV-207", "CDV-208", "CDV-210", "CDV-211"],
+    "CDV-227": [s for s in _FOLLOW_UP if s != "CDV-227"],
+    "CDV-210": [],
+    "CDV-212": [],
+    "CDV-213": [],
+    "CDV-220": [],
+    "CDV-221": [],
+}
+
+# Chorus Pro IdStatut (CPPStatut pivot) -> CDV status, by label; codes without a CDV equivalent are not tracked
+CPP_STATUSES = {
+    "01": "CDV-200",  # Déposée
+    "02": "CDV-201",  # En cours d'acheminement vers le destinataire
+    "03": "CDV-203",  # Mise à disposition du destinataire
+    "04": "CDV-213",  # Rejetée pour erreur de données d'acheminement
+    "05": "CDV-210",  # Rejetée par l'ordonnateur pour autre motif
+    "06": "CDV-208",  # Suspendue
+    "07": "CDV-205",  # Service fait
+    "08": "CDV-214",  # Mandatée / DP validée
+    "11": "CDV-211",  # Mise en paiement
+    "12": "CDV-209",  # Complétée
+}
+
+_STATUS_PATH = "CPPFactureStatuts/CPPFactureStatutUnitaire"
+_STATUS_XPATH = f"/CPPStatut/{_STATUS_PATH}"
+
+
+def status_code(value: Optional[str]) -> Optional[str]:
+    """CDV-xxx from 'CDV-205' or '205', None for anything else."""
+    value = (value or "").strip().upper()
+    if value.startswith("CDV-"):
+        value = value[4:]
+    return f"CDV-{value}" if len(value) == 3 and value.isdigit() else None
+
+
+def allowed(current: Optional[str], status: str) -> bool:
+    return status in TRANSITIONS.get(current, ())
+
+
+class StatusEvent(NamedTuple):
+    invoice: str
+    status: str
+    timestamp: str = ""
+
+
+class Outcome(NamedTuple):
+    invoice: str
+    status: str
+    previous: Optional[str]
+    # accepted, duplicate (status repeated) or rejected
+    result: str
+
+
+def invoice_key(supplier: str, invoice_id: str) -> str:
+    """Supplier identifier without spaces, upper-cased, and invoice identifier, joined by '/'."""
+    return f"{''.join(str(supplier).split()).upper()}/{str(invoice_id).strip()}"
+
+
+def _text(elem: etree._Element, path: str) -> str:
+    return (elem.findtext(path) or "").strip()
+
+
+def events_from_tree(root: etree._Element) -> List[StatusEvent]:
+    """Invoice status events of a CPPStatut message, by NumOrdre then document order.
+
+    ComplementStatut wins when it holds a CDV code; otherwise IdStatut goes through
+    CPP_STATUSES. Entries without a CDV status, supplier or invoice identifier are skipped.
+    """
+    if etree.QName(root).localname != "CPPStatut":
+        return []
+    entries = []
+    for position, entry in enumerate(root.iterfind(_STATUS_PATH)):
+        status = status_code(_text(entry, "DonneesStatut/ComplementStatut")) \
+            or CPP_STATUSES.get(_text(entry, "DonneesStatut/IdStatut").zfill(2))
+        supplier = _text(entry, "Fournisseur/Identifiant")
+        invoice_id = _text(entry, "DonneesStatut/IdFacture")
+        if not (status and supplier and invoice_id):
+            continue
+        order = entry.get("NumOrdre", "")
+        entries.append(((int(order) if order.isdigit() else position, position),
+                        StatusEvent(invoice_key(supplier, invoice_id), status,
+                                    _text(entry, "DonneesStatut/Horodatage"))))
+    return [event for _, event in sorted(entries, key=lambda item: item[0])]
+
+
+class LifecycleStore:
+    def __init__(self, db_path: str = ":memory:"):
+        self.db_path = db_path
+        # One connection per process, serialised by the lock
+        self._lock = threading.Lock()
+        self._conn = self._connect()
+        self._conn.execute("CREATE TABLE IF NOT EXISTS cdv_state (invoice TEXT PRIMARY KEY, status TEXT NOT NULL, "
+                           "updated_at TEXT NOT NULL)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS cdv_history (id INTEGER PRIMARY KEY, invoice TEXT NOT NULL, "
+                           "previous TEXT, status TEXT NOT NULL, timestamp TEXT NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS cdv_history_invoice ON cdv_history (invoice)")
+        self.received = 0
+        self.rejected = 0
+
+    @classmethod
+    def from_env(cls) -> "LifecycleStore":
+        return cls(db_path=os.environ.get(DB_ENV) or default_db())
+
+    def _connect(self) -> sqlite3.Connection:
+        self._pid = os.getpid()
+        conn = sqlite3.connect(self.db_path, timeout=5.0, isolation_level=None, check_same_thread=False)
+        if self.db_path != ":memory:":
+            conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def _db(self) -> sqlite3.Connection:
+        """The connection, reopened in a forked worker (SQLite file connections must not cross a fork)."""
+        if self._pid != os.getpid() and self.db_path != ":memory:":
+            self._conn = self._connect()
+        return self._conn
+
+    @property
+    def generation(self) -> int:
+        """Id of the last recorded transition; grows with every status change (from any process)."""
+        with self._lock:
+            return self._db().execute("SELECT COALESCE(MAX(id), 0) FROM cdv_history").fetchone()[0]
+
+    def current_many(self, invoices: Iterable[str]) -> Dict[str, str]:
+        """Stored status of the given invoices; unknown invoices are absent."""
+        with self._lock:
+            return _select_states(self._db(), invoices)
+
+    def current(self, invoice: str) -> Optional[str]:
+        return self.current_many([invoice]).get(invoice)
+
+    def history(self, invoice: str) -> List[Dict]:
+        with self._lock:
+            rows = self._db().execute("SELECT previous, status, timestamp FROM cdv_history WHERE invoice = ? "
+                                      "ORDER BY id", (invoice,)).fetchall()
+        return [{"previous": previous, "status": status, "timestamp": timestamp} for previous, status, timestamp in rows]
+
+    def check(self, events: Sequence[StatusEvent]) -> List[Outcome]:
+        """Outcome of each event against the stored statuses, chained within events; nothing is written."""
+        return _apply(events, self.current_many(e.invoice for e in events))
+
+    def ingest(self, events: Iterable[StatusEvent]) -> List[Outcome]:
+        """Validate and record events in arrival order, BATCH_SIZE per transaction."""
+        outcomes: List[Outcome] = []
+        events = iter(events)
+        while True:
+            batch = list(islice(events, BATCH_SIZE))
+            if not batch:
+                break
+            with self._lock:
+                db = self._db()
+                db.execute("BEGIN IMMEDIATE")
+                try:
+                    results = _apply(batch, _select_states(db, (e.invoice for e in batch)))
+                    changes = [(o.invoice, o.previous, o.status, e.timestamp)
+                               for o, e in zip(results, batch) if o.result == "accepted"]
+                    db.executemany("INSERT INTO cdv_history (invoice, previous, status, timestamp) VALUES (?, ?, ?, ?)",
+                                   changes)
+                    # Last accepted status of each invoice in the batch
+                    latest = {invoice: (status, timestamp) for invoice, _, status, timestamp in changes}
+                    db.executemany("INSERT INTO cdv_state (invoice, status, updated_at) VALUES (?, ?, ?) "
+                                   "ON CONFLICT(invoice) DO UPDATE SET status = excluded.status, "
+                                   "updated_at = excluded.updated_at",
+                                   [(invoice, status, timestamp) for invoice, (status, timestamp) in latest.items()])
+                except BaseException:
+                    db.execute("ROLLBACK")
+                    raise
+                db.execute("COMMIT")
+            self.received += len(batch)
+            self.rejected += sum(o.result == "rejected" for o in results)
+            outcomes.extend(results)
+        return outcomes
+
+    def count(self) -> int:
+        with self._lock:
+            return self._db().execute("SELECT COUNT(*) FROM cdv_state").fetchone()[0]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            by_status = dict(self._db().execute("SELECT status, COUNT(*) FROM cdv_state GROUP BY status ORDER BY status"))
+        return {
+            "enabled": enabled(),
+            "db": self.db_path,
+            "invoices": sum(by_status.values()),
+            "byStatus": by_status,
+            "generation": self.generation,
+            "received": self.received,
+            "rejected": self.rejected,
+        }
+
+
+def _select_states(db: sqlite3.Connection, invoices: Iterable[str]) -> Dict[str, str]:
+    invoices = list(dict.fromkeys(invoices))
+    found: Dict[str, str] = {}
+    for start in range(0, len(invoices), _QUERY_CHUNK):
+        chunk = invoices[start:start + _QUERY_CHUNK]
+        found.update(db.execute(f"SELECT invoice, status FROM cdv_state WHERE invoice IN ({','.join('?' * len(chunk))})",
+                                chunk))
+    return found
+
+
+def _apply(events: Iterable[StatusEvent], state: Dict[str, str]) -> List[Outcome]:
+    """Outcomes of events in order; state (invoice -> status) is updated with the accepted ones."""
+    outcomes = []
+    for event in events:
+        previous = state.get(event.invoice)
+        if event.status == previous:
+            result = "duplicate"
+        elif allowed(previous, event.status):
+            result = "accepted"
+            state[event.invoice] = event.status
+        else:
+            result = "rejected"
+        outcomes.append(Outcome(event.invoice, event.status, previous, result))
+    return outcomes
+
+
+def default_db() -> str:
+    """In memory for a single worker; a WAL file shared by the workers otherwise."""
+    return str(workers.state_path("cdv.sqlite3")) if workers.shared() else ":memory:"
+
+
+def enabled() -> bool:
+    return os.environ.get(CHECK_ENV, "").strip().lower() in {"1", "true", "yes"}
+
+
+_store: Optional[LifecycleStore] = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> LifecycleStore:
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = LifecycleStore.from_env()
+    return _store
+
+
+def cache_token() -> str:
+    """Part of the result cache keys: '' when the check is off, else the store generation."""
+    return f"cdv:{get_store().generation}" if enabled() else ""
+
+
+def transition_message(outcome: Outcome) -> str:
+    expected = ", ".join(TRANSITIONS.get(outcome.previous, ())) or "aucun (statut final)"
+    return (f"Transition CDV non autorisée pour la facture {outcome.invoice} : "
+            f"{outcome.previous or 'aucun statut'} -> {outcome.status} (attendu : {expected})")
+
+
+def check_tree(root: etree._Element) -> List[RuleIssue]:
+    """CDV-TRANSITION issue for each status of the message not allowed after the stored one."""
+    return [RuleIssue(ruleId=RULE_ID, severity="error", xpath=_STATUS_XPATH, message=transition_message(o))
+            for o in get_store().check(events_from_tree(root)) if o.result == "rejected"]
@@ -0,0 +1,177 @@
+"""Prometheus text-format metrics, without a client library dependency.
+
+Request counts and latency by format/flow/profile, per-stage latency (decode, Factur-X
+extraction, parse, XSD, rules, Schematron), payload sizes, plus cache and executor gauges
+read at scrape time. FE_METRICS=0 turns every observe_* call into an early return and
+/metrics into a 404.
+
+Documents validated inside process pools (batch, FE_MCP_EXECUTOR=process) are counted by
+the parent, but their stage timings stay in the workers and are not exported.
+"""
+import bisect
+import os
+import threading
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+ENABLED = os.environ.get("FE_METRICS", "1").strip().lower() not in {"0", "false", "no"}
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (1024, 10 * 1024, 100 * 1024, 1024 ** 2, 10 * 1024 ** 2, 100 * 1024 ** 2, 1024 ** 3)
+
+Labels = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _label_text(names: Sequence[str], values: Labels, extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values: Dict[Labels, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, values: Labels = (), amount: float = 1) -> None:
+        with self._lock:
+            self._values[values] = self._values.get(values, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for values, total in sorted(self._values.items()):
+            lines.append(f"{self.name}{_label_text(self.labels, values)} {_number(total)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts (last = +Inf), sum, count]
+        self._series: Dict[Labels, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, values: Labels, amount: float) -> None:
+        index = bisect.bisect_left(self.buckets, amount)
+        with self._lock:
+            series = self._series.get(values)
+            if series is None:
+                series = self._series[values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += amount
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for values, (counts, total, count) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else _number(bound)
+                labels = _label_text(self.labels, values, 'le="%s"' % le)
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_label_text(self.labels, values)} {_number(total)}")
+            lines.append(f"{self.name}_count{_label_text(self.labels, values)} {count}")
+        return lines
+
+
+REQUEST_LABELS = ("format", "flow", "profile", "result")
+REQUESTS = Counter("fe_validation_requests_total", "Validated documents by format, flow, profile and result.", REQUEST_LABELS)
+REQUEST_SECONDS = Histogram("fe_validation_duration_seconds", "End-to-end validation latency.", ("format", "flow", "profile"))
+STAGE_SECONDS = Histogram("fe_stage_duration_seconds", "Latency of each validation stage.", ("stage",))
+PAYLOAD_BYTES = Histogram("fe_payload_bytes", "Size of validated payloads.", ("format",), SIZE_BUCKETS)
+
+# name -> (help, type, callable returning {labels: value}); read at scrape time
+_gauges: Dict[str, Tuple[str, str, Callable[[], Dict[Tuple[Tuple[str, str], ...], float]]]] = {}
+
+
+def register_gauge(name: str, help_text: str, fn: Callable[[], Dict], kind: str = "gauge") -> None:
+    """fn returns {((label, value), ...): number}; an empty tuple key means no labels."""
+    _gauges[name] = (help_text, kind, fn)
+
+
+def observe_request(fmt: str, flow: Optional[str], profile: Optional[str], result: str,
+                    seconds: Optional[float] = None, size: Optional[int] = None) -> None:
+    if not ENABLED:
+        return
+    fmt, flow, profile = fmt or "", flow or "", profile or ""
+    REQUESTS.inc((fmt, flow, profile, result))
+    if seconds is not None:
+        REQUEST_SECONDS.observe((fmt, flow, profile), seconds)
+    if size is not None:
+        PAYLOAD_BYTES.observe((fmt,), size)
+
+
+def observe_stage(stage: str, seconds: float) -> None:
+    if ENABLED:
+        STAGE_SECONDS.observe((stage,), seconds)
+
+
+def observe_timings(timings: Dict[str, float]) -> None:
+    if ENABLED:
+        for stage, seconds in timings.items():
+            STAGE_SECONDS.observe((stage,), seconds)
+
+
+def _ratio(hits: int, misses: int) -> float:
+    return hits / (hits + misses) if hits + misses else 0.0
+
+
+def _builtin_gauges() -> List[str]:
+    from . import result_cache
+    from .xsd_validator import get_registry
+
+    schemas = get_registry().stats()
+    lines = [
+        "# HELP fe_schema_cache_lookups_total Compiled XSD registry lookups.",
+        "# TYPE fe_schema_cache_lookups_total counter",
+        f'fe_schema_cache_lookups_total{{result="hit"}} {schemas["hits"]}',
+        f'fe_schema_cache_lookups_total{{result="miss"}} {schemas["misses"]}',
+        "# HELP fe_schema_cache_hit_ratio Share of XSD lookups served by an already compiled schema.",
+        "# TYPE fe_schema_cache_hit_ratio gauge",
+        f"fe_schema_cache_hit_ratio {_number(_ratio(schemas['hits'], schemas['misses']))}",
+    ]
+    cache = result_cache.get_cache()
+    if cache is not None:
+        lines += [
+            "# HELP fe_result_cache_lookups_total Validation result cache lookups.",
+            "# TYPE fe_result_cache_lookups_total counter",
+            f'fe_result_cache_lookups_total{{result="hit",tier="memory"}} {cache.hits["memory"]}',
+            f'fe_result_cache_lookups_total{{result="hit",tier="disk"}} {cache.hits["disk"]}',
+            f'fe_result_cache_lookups_total{{result="miss",tier=""}} {cache.misses}',
+            "# HELP fe_result_cache_hit_ratio Share of lookups served by the result cache (both tiers).",
+            "# TYPE fe_result_cache_hit_ratio gauge",
+            f"fe_result_cache_hit_ratio {_number(_ratio(sum(cache.hits.values()), cache.misses))}",
+            "# HELP fe_result_cache_entries In-memory result cache entries.",
+            "# TYPE fe_result_cache_entries gauge",
+            f"fe_result_cache_entries {cache.stats()['entries']}",
+        ]
+    return lines
+
+
+def render() -> str:
+    lines: List[str] = []
+    for metric in (REQUESTS, REQUEST_SECONDS, STAGE_SECONDS, PAYLOAD_BYTES):
+        lines += metric.render()
+    lines += _builtin_gauges()
+    for name, (help_text, kind, fn) in sorted(_gauges.items()):
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+        for labels, value in fn().items():
+            names, values = zip(*labels) if labels else ((), ())
+            lines.append(f"{name}{_label_text(names, values)} {_number(value)}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,572 @@
+"""Single-parse validation pipeline.
+
+The payload is parsed once with the hardened parser of xml_parser and the same tree is
+handed to every stage (XSD, business rules, any stage added later). Each stage records
+its wall time in PipelineResult.timings, which also feeds the stage histograms of
+metrics. Raw request bodies can be fed chunk by chunk
+through IncrementalDocument instead, so the document bytes are never held in full.
+
+The stream_* functions report the same run as issue events (see events), yielded after
+each stage, with an optional max-errors cutoff that skips the remaining stages.
+
+Every run takes the current reference snapshot once (compiled schemas, rulebook, codelists)
+and keeps it to the end even if a reload publishes a new one meanwhile; its version is
+reported and is part of the result cache key.
+
+format=auto resolves the format, flow and profile from the head of the document before the
+parse (see detect); explicit flow/profile values still win.
+"""
+import base64
+import hashlib
+import time
+from dataclasses import dataclass, field
+from typing import BinaryIO, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from lxml import etree
+
+from ..models.schemas import RuleIssue, ValidationReport
+from . import detect, events, metrics, result_cache, rules_engine, snapshot, syntax
+from .facturx import extract_facturx_xml, extract_facturx_xml_from_file
+from .syntax import SyntaxEntry
+from .xml_parser import make_parser, parse_xml
+from .xsd_validator import XSDValidator
+
+
+class PayloadError(ValueError):
+    """Payload could not be turned into an XML document (bad encoding, unreadable Factur-X)."""
+
+
+def decode_payload(payload: str) -> bytes:
+    """Accept either raw XML (string, optional BOM) or base64."""
+    try:
+        stripped = payload.strip()
+        if stripped.startswith("<") or stripped.startswith("\ufeff<"):
+            return stripped.encode("utf-8")
+        return base64.b64decode(payload)
+    except Exception as exc:
+        raise PayloadError(f"Invalid payload encoding: {exc}") from exc
+
+
+def prepare_document(data: bytes, fmt: str) -> Tuple[bytes, str, str]:
+    """Return (xml_bytes, schema format, rules format); Factur-X PDFs are unpacked and validated as CII."""
+    if fmt.lower() == "facturx":
+        start = time.perf_counter()
+        try:
+            return extract_facturx_xml(data), "cii", "cii"
+        except Exception as exc:
+            raise PayloadError(f"Failed to extract Factur-X XML: {exc}") from exc
+        finally:
+            metrics.observe_stage("facturx", time.perf_counter() - start)
+    return data, fmt, fmt
+
+
+def resolve_format(data: bytes, fmt: str, flow: Optional[str], profile: Optional[str],
+                   name: Optional[str] = None) -> Tuple[str, Optional[str], Optional[str]]:
+    """(format, flow, profile) with format=auto detected from the head of data; raises PayloadError."""
+    if not detect.is_auto(fmt):
+        return fmt, flow, profile
+    start = time.perf_counter()
+    try:
+        found = detect.detect(data, name)
+    except detect.UnknownFormat as exc:
+        raise PayloadError(str(exc)) from exc
+    finally:
+        metrics.observe_stage("detect", time.perf_counter() - start)
+    return found.format, flow or found.flow, profile or found.profile
+
+
+def _embedded_profile(xml_bytes: bytes, profile: Optional[str], name: Optional[str]) -> Optional[str]:
+    """Profile of a Factur-X detected with format=auto, read from its extracted CII when the name gave none."""
+    if profile is not None:
+        return profile
+    try:
+        return detect.detect(xml_bytes, name).profile
+    except detect.UnknownFormat:
+        return None
+
+
+def prepare_facturx_file(fileobj: BinaryIO) -> Tuple[bytes, str, str]:
+    """prepare_document for an uploaded Factur-X file, memory-mapped rather than read when on disk."""
+    start = time.perf_counter()
+    try:
+        return extract_facturx_xml_from_file(fileobj), "cii", "cii"
+    except Exception as exc:
+        raise PayloadError(f"Failed to extract Factur-X XML: {exc}") from exc
+    finally:
+        metrics.observe_stage("facturx", time.perf_counter() - start)
+
+
+@dataclass
+class PipelineResult:
+    syntax: List[SyntaxEntry] = field(default_factory=list)
+    rules: List[RuleIssue] = field(default_factory=list)
+    codelists: List[RuleIssue] = field(default_factory=list)
+    timings: Dict[str, float] = field(default_factory=dict)
+    snapshot_version: Optional[str] = None
+
+    def to_report(self, structured: bool = False) -> ValidationReport:
+        """Text report (one string per syntax error), or structured: grouped syntax issues with counts."""
+        if not structured:
+            return ValidationReport(syntax=[str(e) for e in self.syntax], rules=self.rules, codelists=self.codelists,
+                                    snapshotVersion=self.snapshot_version)
+        groups = syntax.grouped(self.syntax)
+        return ValidationReport(syntax=[str(e) for e, _ in groups], rules=self.rules, codelists=self.codelists,
+                                syntaxIssues=[e.to_model(count) for e, count in groups],
+                                snapshotVersion=self.snapshot_version)
+
+
+@dataclass
+class ValidationContext:
+    root: etree._Element
+    fmt: str
+    flow: Optional[str]
+    profile: Optional[str]
+    rules_fmt: str
+    result: PipelineResult
+    reference: snapshot.ReferenceSnapshot
+    schematron: Sequence[str] = ()
+    # Issues still wanted by a max-errors cutoff; stages may stop producing past it
+    max_errors: Optional[int] = None
+
+
+Stage = Callable[[ValidationContext], None]
+
+
+class IncrementalDocument:
+    """XML body fed in chunks to lxml's feed parser; only the resulting tree is kept.
+
+    libxml2 feed parsers are bound to the thread that fed them: finishing one on a thread
+    that has parsed other documents corrupts memory. The thread that feeds calls finish()
+    and the tree is then handed to the validation thread by close().
+    """
+
+    def __init__(self):
+        # A fresh parser per document: feed state cannot be shared between interleaved requests.
+        self._parser = make_parser()
+        self._started = False
+        self._digest = hashlib.sha256()
+        # First bytes of the document, for format=auto
+        self.head = b""
+        self._head_size = detect.head_size()
+        self._root: Optional[etree._Element] = None
+        self.error: Optional[Exception] = None
+        self.size = 0
+        self.elapsed = 0.0
+
+    def feed(self, chunk: bytes) -> None:
+        if self.error is not None or not chunk:
+            return
+        self.size += len(chunk)
+        self._digest.update(chunk)
+        if not self._started:
+            # Same leniency as decode_payload, which strips the payload
+            chunk = chunk.lstrip()
+            if not chunk:
+                return
+            self._started = True
+        if len(self.head) < self._head_size:
+            self.head += chunk[:self._head_size - len(self.head)]
+        start = time.perf_counter()
+        try:
+            self._parser.feed(chunk)
+        except etree.XMLSyntaxError as exc:
+            self.error = exc
+        self.elapsed += time.perf_counter() - start
+
+    def digest(self) -> str:
+        """SHA-256 of the bytes fed so far (result cache key)."""
+        return self._digest.hexdigest()
+
+    def finish(self) -> None:
+        """End the parse on the feeding thread; a parser error is kept for close()."""
+        if self._root is not None or self.error is not None:
+            return
+        start = time.perf_counter()
+        try:
+            self._root = self._parser.close()
+        except etree.XMLSyntaxError as exc:
+            self.error = exc
+        finally:
+            self.elapsed += time.perf_counter() - start
+
+    def close(self) -> etree._Element:
+        self.finish()
+        if self.error is not None:
+            raise self.error
+        return self._root
+
+
+class ValidationPipeline:
+    """Parse once, then run the configured stages in order on the shared tree."""
+
+    def __init__(self, validator: Optional[XSDValidator] = None, stages: Optional[List[Tuple[str, Stage]]] = None):
+        self.validator = validator or XSDValidator()
+        # Without an explicit validator the XSD stage uses the run's snapshot registry
+        self._own_validator = validator is not None
+        self.stages: List[Tuple[str, Stage]] = stages if stages is not None else [
+            ("xsd", self._xsd_stage),
+            ("rules", self._rules_stage),
+        ]
+
+    def add_stage(self, name: str, stage: Stage) -> None:
+        self.stages.append((name, stage))
+
+    @staticmethod
+    def _schematron_stage(ctx: ValidationContext) -> None:
+        registry = ctx.reference.schematron
+        for name in ctx.schematron:
+            ctx.result.rules.extend(registry.validate_tree(ctx.root, name))
+
+    def _xsd_stage(self, ctx: ValidationContext) -> None:
+        validator = self.validator if self._own_validator else ctx.reference.validator
+        ctx.result.syntax.extend(validator.validate_entries(ctx.root, ctx.fmt, ctx.flow, ctx.profile, limit=ctx.max_errors))
+
+    @staticmethod
+    def _rules_stage(ctx: ValidationContext) -> None:
+        rule_issues, codelist_issues = rules_engine.evaluate_tree(ctx.root, ctx.rules_fmt, ctx.flow, ctx.reference.rulebook)
+        ctx.result.rules.extend(rule_issues)
+        ctx.result.codelists.extend(codelist_issues)
+
+    def run(self, xml_content: bytes, fmt: str, flow: Optional[str] = None, profile: Optional[str] = None,
+            rules_fmt: Optional[str] = None, schematron: Sequence[str] = (),
+            reference: Optional[snapshot.ReferenceSnapshot] = None) -> PipelineResult:
+        result = PipelineResult()
+        start = time.perf_counter()
+        try:
+            root = parse_xml(xml_content)
+        except Exception as exc:
+            result.timings["parse"] = time.perf_counter() - start
+            return self._parse_failed(exc, fmt, flow, profile, result, reference)
+        result.timings["parse"] = time.perf_counter() - start
+        return self.run_tree(root, fmt, flow, profile, rules_fmt, result, schematron, reference)
+
+    def run_document(self, document: IncrementalDocument, fmt: str, flow: Optional[str] = None,
+                     profile: Optional[str] = None, rules_fmt: Optional[str] = None,
+                     schematron: Sequence[str] = (),
+                     reference: Optional[snapshot.ReferenceSnapshot] = None) -> PipelineResult:
+        """Finish an incremental parse and run the stages; same result as run() on the whole body."""
+        result = PipelineResult()
+        try:
+            root = document.close()
+        except Exception as exc:
+            result.timings["parse"] = document.elapsed
+            return self._parse_failed(exc, fmt, flow, profile, result, reference)
+        result.timings["parse"] = document.elapsed
+        return self.run_tree(root, fmt, flow, profile, rules_fmt, result, schematron, reference)
+
+    def _parse_failed(self, exc: Exception, fmt: str, flow: Optional[str], profile: Optional[str],
+                      result: PipelineResult,
+                      reference: Optional[snapshot.ReferenceSnapshot] = None) -> PipelineResult:
+        result.snapshot_version = (reference or snapshot.current()).version
+        # Same report as the standalone validators: schema lookup first, then the parser error.
+        if self.validator.schema_path(fmt, flow, profile) is None:
+            result.syntax.append(syntax.text(self.validator.missing_schema_error(fmt, flow, profile)))
+        else:
+            result.syntax.append(syntax.from_exception(exc))
+        result.rules.append(rules_engine.parser_issue(exc))
+        metrics.observe_timings(result.timings)
+        return result
+
+    def run_tree(self, root: etree._Element, fmt: str, flow: Optional[str] = None, profile: Optional[str] = None,
+                 rules_fmt: Optional[str] = None, result: Optional[PipelineResult] = None,
+                 schematron: Sequence[str] = (),
+                 reference: Optional[snapshot.ReferenceSnapshot] = None) -> PipelineResult:
+        """Run the stages on a parsed tree; the Schematron stage only runs when rule sets are requested."""
+        result = result if result is not None else PipelineResult()
+        for _ in self._run_stages(root, fmt, flow, profile, rules_fmt, result, schematron, reference=reference):
+            pass
+        return result
+
+    def _run_stages(self, root: etree._Element, fmt: str, flow: Optional[str], profile: Optional[str],
+                    rules_fmt: Optional[str], result: PipelineResult, schematron: Sequence[str],
+                    limit: Optional[events.IssueLimit] = None,
+                    reference: Optional[snapshot.ReferenceSnapshot] = None) -> Iterator[str]:
+        """Run the stages, yielding each name once its issues are in result; stops early once limit is reached."""
+        reference = reference or snapshot.current()
+        result.snapshot_version = reference.version
+        ctx = ValidationContext(root=root, fmt=fmt, flow=flow, profile=profile, rules_fmt=rules_fmt or fmt,
+                                result=result, reference=reference, schematron=tuple(schematron or ()))
+        stages = self.stages + [("schematron", self._schematron_stage)] if ctx.schematron else self.stages
+        try:
+            for name, stage in stages:
+                if limit is not None:
+                    if limit.reached:
+                        break
+                    ctx.max_errors = limit.remaining()
+                start = time.perf_counter()
+                stage(ctx)
+                result.timings[name] = time.perf_counter() - start
+                yield name
+        finally:
+            metrics.observe_timings(result.timings)
+
+    def iter_tree(self, root: etree._Element, fmt: str, flow: Optional[str] = None, profile: Optional[str] = None,
+                  rules_fmt: Optional[str] = None, schematron: Sequence[str] = (),
+                  limit: Optional[events.IssueLimit] = None,
+                  reference: Optional[snapshot.ReferenceSnapshot] = None) -> Iterator[events.Event]:
+        """run_tree as issue events, yielded as each stage finishes (no summary)."""
+        limit = limit if limit is not None else events.IssueLimit()
+        result = PipelineResult()
+        for _ in self._run_stages(root, fmt, flow, profile, rules_fmt, result, schematron, limit, reference):
+            for kind in events.ISSUE_KINDS:
+                issues = getattr(result, kind)
+                yield from limit.take(kind, issues)
+                issues.clear()
+
+
+_default_pipeline: Optional[ValidationPipeline] = None
+
+
+def get_pipeline() -> ValidationPipeline:
+    """Process-wide default pipeline (stateless: compiled assets come from the reference snapshot)."""
+    global _default_pipeline
+    if _default_pipeline is None:
+        _default_pipeline = ValidationPipeline()
+    return _default_pipeline
+
+
+def _observed(fmt: str, flow: Optional[str], profile: Optional[str], size: Optional[int],
+              fn: Callable[..., ValidationReport], *args) -> ValidationReport:
+    """Run fn and record the request in metrics (count by result, latency, payload size)."""
+    if not metrics.ENABLED:
+        return fn(*args)
+    start = time.perf_counter()
+    try:
+        report = fn(*args)
+    except Exception:
+        metrics.observe_request(fmt, flow, profile, "error", time.perf_counter() - start, size)
+        raise
+    metrics.observe_request(fmt, flow, profile, report_result(report), time.perf_counter() - start, size)
+    return report
+
+
+def report_result(report: ValidationReport) -> str:
+    """'valid' when the report holds no issue at all, as in batch summaries."""
+    return "invalid" if report.syntax or report.rules or report.codelists else "valid"
+
+
+def _variant(structured: bool) -> str:
+    return "structured" if structured else ""
+
+
+def _resolved(data: bytes, fmt: str, flow: Optional[str], profile: Optional[str], name: Optional[str],
+              size: Optional[int]) -> Tuple[str, Optional[str], Optional[str]]:
+    """resolve_format, recording an undetectable document as an error request."""
+    try:
+        return resolve_format(data, fmt, flow, profile, name)
+    except PayloadError:
+        metrics.observe_request(fmt, flow, profile, "error", None, size)
+        raise
+
+
+def _validate_bytes(data: bytes, fmt: str, flow: Optional[str], profile: Optional[str],
+                    schematron: Sequence[str], structured: bool = False, name: Optional[str] = None,
+                    auto: bool = False) -> ValidationReport:
+    reference = snapshot.current()
+    cache = result_cache.get_cache()
+    key = None
+    if cache is not None:
+        key = result_cache.cache_key(hashlib.sha256(data).hexdigest(), fmt, flow, profile, schematron, _variant(structured),
+                                     reference.version)
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+    xml_bytes, fmt_for_schema, fmt_for_rules = prepare_document(data, fmt)
+    if auto and fmt == "facturx":
+        profile = _embedded_profile(xml_bytes, profile, name)
+    report = get_pipeline().run(xml_bytes, fmt_for_schema, flow, profile, rules_fmt=fmt_for_rules,
+                                schematron=schematron, reference=reference).to_report(structured)
+    if cache is not None:
+        cache.put(key, report)
+    return report
+
+
+def validate_bytes(data: bytes, fmt: str, flow: Optional[str] = None, profile: Optional[str] = None,
+                   schematron: Sequence[str] = (), structured: bool = False,
+                   name: Optional[str] = None) -> ValidationReport:
+    """Unpack and validate one raw document, through the result cache; raises PayloadError on unreadable input.
+
+    name (file name, when known) only serves format=auto, for the Base_/Full_ profile prefix.
+    """
+    auto = detect.is_auto(fmt)
+    fmt, flow, profile = _resolved(data, fmt, flow, profile, name, len(data))
+    return _observed(fmt, flow, profile, len(data), _validate_bytes, data, fmt, flow, profile, schematron, structured,
+                     name, auto)
+
+
+def _validate_document(document: IncrementalDocument, fmt: str, flow: Optional[str], profile: Optional[str],
+                       schematron: Sequence[str], structured: bool = False) -> ValidationReport:
+    reference = snapshot.current()
+    cache = result_cache.get_cache()
+    key = None
+    if cache is not None:
+        key = result_cache.cache_key(document.digest(), fmt, flow, profile, schematron, _variant(structured),
+                                     reference.version)
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+    report = get_pipeline().run_document(document, fmt, flow, profile, rules_fmt=fmt,
+                                         schematron=schematron, reference=reference).to_report(structured)
+    if cache is not None:
+        cache.put(key, report)
+    return report
+
+
+def validate_document(document: IncrementalDocument, fmt: str, flow: Optional[str] = None,
+                      profile: Optional[str] = None, schematron: Sequence[str] = (),
+                      structured: bool = False, name: Optional[str] = None) -> ValidationReport:
+    """validate_bytes for a body fed through IncrementalDocument (parsing is done, the stages may be skipped)."""
+    fmt, flow, profile = _resolved(document.head, fmt, flow, profile, name, document.size)
+    return _observed(fmt, flow, profile, document.size, _validate_document, document, fmt, flow, profile, schematron,
+                     structured)
+
+
+def _file_digest(fileobj: BinaryIO) -> str:
+    """SHA-256 of a seekable file, read in chunks from the start; the position is reset to 0."""
+    digest = hashlib.sha256()
+    fileobj.seek(0)
+    for chunk in iter(lambda: fileobj.read(1 << 20), b""):
+        digest.update(chunk)
+    fileobj.seek(0)
+    return digest.hexdigest()
+
+
+def _validate_facturx_file(fileobj: BinaryIO, flow: Optional[str], profile: Optional[str],
+                           schematron: Sequence[str], structured: bool = False, name: Optional[str] = None,
+                           auto: bool = False) -> ValidationReport:
+    reference = snapshot.current()
+    cache = result_cache.get_cache() if fileobj.seekable() else None
+    digest = _file_digest(fileobj) if cache is not None else None
+    xml_bytes, fmt_for_schema, fmt_for_rules = prepare_facturx_file(fileobj)
+    if auto:
+        flow, profile = flow or "f1", _embedded_profile(xml_bytes, profile, name)
+    key = None
+    if cache is not None:
+        # Keyed once flow/profile are resolved, as they may come from the embedded XML
+        key = result_cache.cache_key(digest, "facturx", flow, profile, schematron, _variant(structured), reference.version)
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+    report = get_pipeline().run(xml_bytes, fmt_for_schema, flow, profile, rules_fmt=fmt_for_rules,
+                                schematron=schematron, reference=reference).to_report(structured)
+    if cache is not None:
+        cache.put(key, report)
+    return report
+
+
+def validate_facturx_file(fileobj: BinaryIO, flow: Optional[str] = None, profile: Optional[str] = None,
+                          schematron: Sequence[str] = (), structured: bool = False, name: Optional[str] = None,
+                          auto: bool = False) -> ValidationReport:
+    """Validate an uploaded Factur-X file on one snapshot, through the result cache when the file is seekable.
+
+    auto: flow/profile detected when not given.
+    """
+    size = None
+    if fileobj.seekable():
+        size = fileobj.seek(0, 2)
+        fileobj.seek(0)
+    return _observed("facturx", flow, profile, size, _validate_facturx_file, fileobj, flow, profile, schematron, structured,
+                     name, auto)
+
+
+def validate_payload(payload: str, fmt: str, flow: Optional[str] = None, profile: Optional[str] = None,
+                     schematron: Sequence[str] = (), structured: bool = False) -> ValidationReport:
+    """Decode, unpack and validate one XML/base64 payload; raises PayloadError on undecodable input."""
+    start = time.perf_counter()
+    try:
+        data = decode_payload(payload)
+    except PayloadError:
+        metrics.observe_request(fmt, flow, profile, "error", time.perf_counter() - start)
+        raise
+    metrics.observe_stage("decode", time.perf_counter() - start)
+    return validate_bytes(data, fmt, flow, profile, schematron, structured)
+
+
+def _stream(parse: Callable[[], etree._Element], fmt: str, flow: Optional[str], profile: Optional[str],
+            rules_fmt: str, schematron: Sequence[str], limit: events.IssueLimit, size: Optional[int],
+            key: Optional[str], reference: snapshot.ReferenceSnapshot) -> Iterator[events.Event]:
+    pipeline = get_pipeline()
+    start = time.perf_counter()
+    # Only a complete report goes to the result cache
+    collected: Optional[List[events.Event]] = [] if key is not None else None
+    try:
+        root = parse()
+    except Exception as exc:
+        result = pipeline._parse_failed(exc, fmt, flow, profile, PipelineResult(), reference)
+        issues = events.report_events(result.to_report(), limit)
+    else:
+        issues = pipeline.iter_tree(root, fmt, flow, profile, rules_fmt, schematron, limit, reference)
+    for event in issues:
+        if collected is not None:
+            collected.append(event)
+        yield event
+    seconds = time.perf_counter() - start
+    metrics.observe_request(fmt, flow, profile, "valid" if limit.total == 0 else "invalid", seconds, size)
+    if collected is not None and not limit.reached:
+        report = events.to_report(collected)
+        report.snapshotVersion = reference.version
+        result_cache.get_cache().put(key, report)
+    yield limit.summary(durationSeconds=round(seconds, 6), snapshotVersion=reference.version)
+
+
+def _replay(report: ValidationReport, limit: events.IssueLimit, fmt: str, flow: Optional[str],
+            profile: Optional[str], size: int) -> Iterator[events.Event]:
+    metrics.observe_request(fmt, flow, profile, report_result(report), 0.0, size)
+    yield from events.report_events(report, limit)
+    yield limit.summary(cached=True, snapshotVersion=report.snapshotVersion)
+
+
+def stream_bytes(data: bytes, fmt: str, flow: Optional[str] = None, profile: Optional[str] = None,
+                 schematron: Sequence[str] = (), max_errors: Optional[int] = None,
+                 name: Optional[str] = None) -> Iterator[events.Event]:
+    """validate_bytes as issue events ending with a summary; PayloadError is raised here, before any event."""
+    limit = events.IssueLimit(max_errors)
+    auto = detect.is_auto(fmt)
+    fmt, flow, profile = _resolved(data, fmt, flow, profile, name, len(data))
+    reference = snapshot.current()
+    cache = result_cache.get_cache()
+    key = None
+    if cache is not None:
+        key = result_cache.cache_key(hashlib.sha256(data).hexdigest(), fmt, flow, profile, schematron,
+                                     version=reference.version)
+        cached = cache.get(key)
+        if cached is not None:
+            return _replay(cached, limit, fmt, flow, profile, len(data))
+    try:
+        xml_bytes, fmt_for_schema, fmt_for_rules = prepare_document(data, fmt)
+    except PayloadError:
+        metrics.observe_request(fmt, flow, profile, "error", None, len(data))
+        raise
+    if auto and fmt == "facturx":
+        profile = _embedded_profile(xml_bytes, profile, name)
+    return _stream(lambda: parse_xml(xml_bytes), fmt_for_schema, flow, profile, fmt_for_rules, schematron,
+                   limit, len(data), key, reference)
+
+
+def stream_document(document: IncrementalDocument, fmt: str, flow: Optional[str] = None,
+                    profile: Optional[str] = None, schematron: Sequence[str] = (),
+                    max_errors: Optional[int] = None, name: Optional[str] = None) -> Iterator[events.Event]:
+    """validate_document as issue events ending with a summary."""
+    limit = events.IssueLimit(max_errors)
+    fmt, flow, profile = _resolved(document.head, fmt, flow, profile, name, document.size)
+    reference = snapshot.current()
+    cache = result_cache.get_cache()
+    key = None
+    if cache is not None:
+        key = result_cache.cache_key(document.digest(), fmt, flow, profile, schematron, version=reference.version)
+        cached = cache.get(key)
+        if cached is not None:
+            return _replay(cached, limit, fmt, flow, profile, document.size)
+    return _stream(document.close, fmt, flow, profile, fmt, schematron, limit, document.size, key,
+                   reference)
+
+
+def stream_payload(payload: str, fmt: str, flow: Optional[str] = None, profile: Optional[str] = None,
+                   schematron: Sequence[str] = (), max_errors: Optional[int] = None) -> Iterator[events.Event]:
+    """validate_payload as issue events ending with a summary; raises PayloadError on undecodable input."""
+    try:
+        data = decode_payload(payload)
+    except PayloadError:
+        metrics.observe_request(fmt, flow, profile, "error")
+        raise
+    return stream_bytes(data, fmt, flow, profile, schematron, max_errors)
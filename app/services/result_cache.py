@@ -0,0 +1,168 @@
+"""Content-addressed cache of validation reports.
+
+Retries and replayed Flux 6 messages resend identical bytes, so reports are cached under
+SHA-256(payload) + format/flow/profile/Schematron rule sets + the version of the reference
+snapshot that validates them (XSD tree, rule and Schematron files, annex reference data;
+see snapshot), plus the duplicate index, CDV lifecycle store and annuaire index
+generations when those checks are on. A reload that publishes a new snapshot changes every key: stale entries are
+never served and simply age out.
+
+Two tiers: an in-process LRU bounded in entries and TTL, and an optional SQLite file
+(FE_RESULT_CACHE_DB) shared by the workers of a host, batch pool processes included.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Sequence, Tuple
+
+from ..models.schemas import ValidationReport
+from . import annuaire, duplicates, lifecycle, snapshot
+
+ENABLED_ENV = "FE_RESULT_CACHE"
+SIZE_ENV = "FE_RESULT_CACHE_SIZE"
+TTL_ENV = "FE_RESULT_CACHE_TTL"
+DB_ENV = "FE_RESULT_CACHE_DB"
+# Expired rows of the SQLite tier are purged once every PURGE_EVERY writes.
+PURGE_EVERY = 1000
+
+
+def enabled() -> bool:
+    return os.environ.get(ENABLED_ENV, "1").strip().lower() not in {"0", "false", "no"}
+
+
+def version_fingerprint() -> str:
+    """Version of the current reference snapshot."""
+    return snapshot.current().version
+
+
+def cache_key(payload_digest: str, fmt: str, flow: Optional[str], profile: Optional[str],
+              schematron: Sequence[str] = (), variant: str = "", version: Optional[str] = None) -> str:
+    """variant tells report shapes apart (text or structured syntax); version defaults to the current snapshot's."""
+    parts = [payload_digest, fmt or "", flow or "", profile or "", ",".join(schematron), variant,
+             version or version_fingerprint(), duplicates.cache_token(), lifecycle.cache_token(),
+             annuaire.cache_token()]
+    return hashlib.sha256("\0".join(parts).encode()).hexdigest()
+
+
+class ResultCache:
+    def __init__(self, max_entries: int = 1024, ttl: float = 3600.0, db_path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.db_path = db_path
+        self._memory: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._writes = 0
+        self.hits = {"memory": 0, "disk": 0}
+        self.misses = 0
+
+    @classmethod
+    def from_env(cls) -> "ResultCache":
+        return cls(
+            max_entries=int(os.environ.get(SIZE_ENV, "1024")),
+            ttl=float(os.environ.get(TTL_ENV, "3600")),
+            db_path=os.environ.get(DB_ENV) or None,
+        )
+
+    def _db(self) -> Optional[sqlite3.Connection]:
+        if not self.db_path:
+            return None
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # One connection per thread; WAL lets worker processes read while another writes.
+            conn = sqlite3.connect(self.db_path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, report TEXT NOT NULL, expires REAL NOT NULL)")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[ValidationReport]:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._memory.move_to_end(key)
+                    self.hits["memory"] += 1
+                    return ValidationReport.model_validate_json(entry[1])
+                del self._memory[key]
+        db = self._db()
+        if db is not None:
+            try:
+                row = db.execute("SELECT report, expires FROM results WHERE key = ?", (key,)).fetchone()
+            except sqlite3.Error:
+                row = None
+            if row is not None and row[1] > now:
+                self._remember(key, row[0], row[1])
+                self.hits["disk"] += 1
+                return ValidationReport.model_validate_json(row[0])
+        self.misses += 1
+        return None
+
+    def put(self, key: str, report: ValidationReport) -> None:
+        data = report.model_dump_json()
+        expires = time.time() + self.ttl
+        self._remember(key, data, expires)
+        db = self._db()
+        if db is None:
+            return
+        try:
+            db.execute("INSERT OR REPLACE INTO results (key, report, expires) VALUES (?, ?, ?)", (key, data, expires))
+            self._writes += 1
+            if self._writes % PURGE_EVERY == 0:
+                db.execute("DELETE FROM results WHERE expires <= ?", (time.time(),))
+        except sqlite3.Error:
+            pass  # the disk tier is best effort; a locked or full database must not fail validation
+
+    def _remember(self, key: str, data: str, expires: float) -> None:
+        with self._lock:
+            self._memory[key] = (expires, data)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+        db = self._db()
+        if db is not None:
+            db.execute("DELETE FROM results")
+
+    def stats(self) -> Dict:
+        hits = self.hits["memory"] + self.hits["disk"]
+        lookups = hits + self.misses
+        return {
+            "enabled": True,
+            "entries": len(self._memory),
+            "maxEntries": self.max_entries,
+            "ttlSeconds": self.ttl,
+            "disk": self.db_path,
+            "hits": dict(self.hits),
+            "misses": self.misses,
+            "hitRatio": round(hits / lookups, 4) if lookups else None,
+            "fingerprint": version_fingerprint(),
+        }
+
+
+_cache: Optional[ResultCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> Optional[ResultCache]:
+    """Process-wide cache, or None when FE_RESULT_CACHE=0."""
+    global _cache
+    if not enabled():
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResultCache.from_env()
+    return _cache
+
+
+def stats() -> Dict:
+    cache = get_cache()
+    return cache.stats() if cache is not None else {"enabled": False}
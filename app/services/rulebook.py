@@ -0,0 +1,296 @@
+"""Declarative business rules (Annexe 7 and EN16931) compiled to lxml XPath objects.
+
+Rules live as JSON in data/rules/*.json. Each rule names an id, an optional BT, the flows
+it applies to, one XPath binding per syntax (a single expression, or named operands) and a
+predicate:
+
+    required     message emitted when the bound node is missing
+    check.type   pattern | codelist | cardinality | arithmetic
+
+Rule files are compiled once and grouped by (format, flow). Bindings should be anchored at
+the root (/*/cbc:ID, /rsm:CrossIndustryInvoice/...): plain child paths of that kind are
+merged into one path trie per group and all of them are extracted in a single walk that
+only enters matching elements, so a 10k-line invoice costs one pass over the header
+instead of one descendant scan of the whole tree per field. Other expressions (predicates, functions, //) are compiled to
+etree.XPath. Within a group each distinct expression is evaluated once per document.
+Codelist findings go to the report's codelists, everything else to rules.
+"""
+import json
+import re
+from pathlib import Path
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+
+from lxml import etree
+
+from ..models.schemas import RuleIssue
+
+RULES_DIR = Path(__file__).resolve().parents[2] / "data" / "rules"
+VALUE = "value"  # operand name of single-expression bindings
+CHECK_TYPES = {"pattern", "codelist", "cardinality", "arithmetic"}
+# /step/step/... with (prefixed) names or *, no predicates or axes: handled by the path trie
+_CHILD_PATH = re.compile(r"^(?:/(?:\*|(?:[A-Za-z_][\w.-]*:)?[A-Za-z_][\w.-]*))+$")
+
+
+class RulebookError(ValueError):
+    pass
+
+
+class CompiledRule:
+    __slots__ = ("rule_id", "bt", "severity", "operands", "required", "check", "pattern", "allowed", "message", "issue_id")
+
+    def __init__(self, rule_id: str, bt: Optional[str], severity: str, operands: Dict[str, str],
+                 required: Optional[str], check: Dict[str, Any], allowed: Optional[FrozenSet[str]] = None):
+        self.rule_id = rule_id
+        self.bt = bt
+        self.severity = severity
+        self.operands = operands  # operand name -> XPath expression
+        self.required = required
+        self.check = check
+        self.message: str = check.get("message", "")
+        self.issue_id: str = check.get("issueId", rule_id)
+        self.pattern = re.compile(check["pattern"]) if check.get("type") == "pattern" else None
+        self.allowed = allowed if check.get("type") == "codelist" else None
+
+    def issue(self, message: str, operand: str = VALUE, rule_id: Optional[str] = None) -> RuleIssue:
+        return RuleIssue(ruleId=rule_id or self.rule_id, severity=self.severity,
+                         xpath=self.operands.get(operand), message=message)
+
+    def apply(self, values: Dict[str, List[etree._Element]], issues: List[RuleIssue], codelist_issues: List[RuleIssue]) -> None:
+        kind = self.check.get("type")
+        nodes = values.get(VALUE, [])
+        text = _text(nodes[0]) if nodes else None
+        if self.required and not text and kind != "cardinality":
+            issues.append(self.issue(self.required))
+            return
+        if kind == "pattern":
+            if text and not self.pattern.match(text):
+                issues.append(self.issue(self.message.format(value=text)))
+        elif kind == "codelist":
+            # An empty codelist (reference data not deployed) disables the check. Every bound
+            # node is checked (VAT breakdowns, line codes), each wrong value reported once.
+            if not self.allowed:
+                return
+            reported = set()
+            for node in nodes:
+                code = _text(node)
+                if code and code not in self.allowed and code not in reported:
+                    reported.add(code)
+                    codelist_issues.append(self.issue(self.message.format(value=code), rule_id=self.issue_id))
+        elif kind == "cardinality":
+            low, high = self.check.get("min", 0), self.check.get("max")
+            if len(nodes) < low or (high is not None and len(nodes) > high):
+                message = self.required if not nodes and self.required else self.message
+                issues.append(self.issue(message.format(count=len(nodes))))
+        elif kind == "arithmetic":
+            sides = [_sum(values, self.check["left"]), _sum(values, self.check["right"])]
+            if None in sides:
+                return
+            left, right = sides
+            if abs(left - right) > self.check.get("tolerance", 0.0):
+                issues.append(self.issue(self.message.format(left=f"{left:g}", right=f"{right:g}"), operand=self.check["right"][0]))
+
+
+def _text(node: Any) -> Optional[str]:
+    if isinstance(node, str):  # attribute or text() results
+        return node.strip()
+    if node.text is None:
+        return None
+    return node.text.strip()
+
+
+def _as_list(result: Any) -> List:
+    """XPath node-sets stay as they are; scalar results (count(), sum(), ...) become one string value."""
+    return result if isinstance(result, list) else [str(result)]
+
+
+def _sum(values: Dict[str, List], operands: List[str]) -> Optional[float]:
+    """Sum of every node bound to the operands; None when one is absent or not numeric."""
+    total = 0.0
+    for operand in operands:
+        nodes = values.get(operand)
+        if not nodes:
+            return None
+        for node in nodes:
+            try:
+                total += float(_text(node) or "")
+            except ValueError:
+                return None
+    return total
+
+
+class _PathTrie:
+    """Anchored child paths sharing their prefixes; children are keyed by Clark tag or '*'.
+
+    Branches are walked in Python, tag filtering being left to libxml2 (iterchildren), so
+    only header elements on the way to a field become Python objects. A branch that is a
+    plain chain down to a single field (typically a per-line amount) is handed over as one
+    relative ETXPath evaluated from the current element instead of being walked line by line.
+    """
+
+    __slots__ = ("children", "exprs", "_walk", "_chains", "_wildcard")
+
+    def __init__(self):
+        self.children: Dict[str, "_PathTrie"] = {}
+        self.exprs: List[str] = []
+        self._walk: Tuple[str, ...] = ()
+        self._chains: List[Tuple[etree.ETXPath, List[str]]] = []
+        self._wildcard: Optional["_PathTrie"] = None
+
+    def add(self, expr: str, namespaces: Dict[str, str]) -> None:
+        node = self
+        for step in expr[1:].split("/"):
+            if ":" in step:
+                prefix, local = step.split(":", 1)
+                if prefix not in namespaces:
+                    raise RulebookError(f"Undefined namespace prefix {prefix!r} in {expr!r}")
+                step = f"{{{namespaces[prefix]}}}{local}"
+            node = node.children.setdefault(step, _PathTrie())
+        node.exprs.append(expr)
+
+    def freeze(self) -> None:
+        """Split children into walked branches and chains; call once all paths are added."""
+        walk, self._chains = [], []
+        for key, child in self.children.items():
+            child.freeze()
+            if key == "*":
+                self._wildcard = child
+                continue
+            steps, node = [key], child
+            while not node.exprs and len(node.children) == 1:
+                (next_key, node), = node.children.items()
+                steps.append(next_key)
+            if len(steps) > 1 and not node.children:
+                self._chains.append((etree.ETXPath("/".join(steps)), node.exprs))
+            else:
+                walk.append(key)
+        self._walk = tuple(walk)
+
+    def extract(self, root: etree._Element, results: Dict[str, List]) -> None:
+        """Append the nodes of every path to results, in document order, in one walk from root."""
+        for key in (root.tag, "*"):
+            sub = self.children.get(key)
+            if sub is not None:
+                sub._visit(root, results)
+
+    def _visit(self, elem: etree._Element, results: Dict[str, List]) -> None:
+        for expr in self.exprs:
+            results[expr].append(elem)
+        for xpath, exprs in self._chains:
+            nodes = xpath(elem)
+            for expr in exprs:
+                results[expr].extend(nodes)
+        wildcard = self._wildcard
+        if wildcard is not None:
+            for child in elem.iterchildren(etree.Element):
+                sub = self.children.get(child.tag)
+                if sub is not None and child.tag in self._walk:
+                    sub._visit(child, results)
+                wildcard._visit(child, results)
+        elif self._walk:
+            children = self.children
+            for child in elem.iterchildren(*self._walk):
+                children[child.tag]._visit(child, results)
+
+
+class _Group:
+    """Rules of one (format, flow), their anchored paths in one trie and other expressions compiled once."""
+
+    __slots__ = ("rules", "paths", "xpaths")
+
+    def __init__(self):
+        self.rules: List[CompiledRule] = []
+        self.paths = _PathTrie()
+        self.xpaths: Dict[str, Optional[etree.XPath]] = {}  # None for expressions served by the trie
+
+    def compile(self, expr: str, namespaces: Dict[str, str]) -> None:
+        if expr in self.xpaths:
+            return
+        if _CHILD_PATH.match(expr):
+            self.paths.add(expr, namespaces)
+            self.xpaths[expr] = None
+        else:
+            self.xpaths[expr] = etree.XPath(expr, namespaces=namespaces)
+
+    def extract(self, root: etree._Element) -> Dict[str, List]:
+        results: Dict[str, List] = {expr: [] for expr, xpath in self.xpaths.items() if xpath is None}
+        self.paths.extract(root, results)
+        for expr, xpath in self.xpaths.items():
+            if xpath is not None:
+                results[expr] = _as_list(xpath(root))
+        return results
+
+
+class Rulebook:
+    """Rules of rules_dir compiled against the codelists and annex rules of a reference snapshot (default: current)."""
+
+    def __init__(self, rules_dir: Path = RULES_DIR, reference=None):
+        if reference is None:
+            from .snapshot import current
+            reference = current()
+        self.rules_dir = rules_dir
+        self.reference = reference
+        self._groups: Dict[Tuple[str, str], _Group] = {}
+        self.rule_count = 0
+        self._load()
+
+    def _load(self) -> None:
+        for path in sorted(self.rules_dir.glob("*.json")):
+            try:
+                spec = json.loads(path.read_text(encoding="utf-8"))
+            except ValueError as exc:
+                raise RulebookError(f"{path.name}: {exc}") from exc
+            namespaces = spec.get("namespaces", {})
+            for raw in spec.get("rules", []):
+                self._add(raw, namespaces, path.name)
+        for group in self._groups.values():
+            group.paths.freeze()
+
+    def _add(self, raw: Dict[str, Any], namespaces: Dict[str, str], source: str) -> None:
+        rule_id = raw.get("id")
+        check = raw.get("check", {})
+        if not rule_id or check.get("type") not in CHECK_TYPES:
+            raise RulebookError(f"{source}: rule {rule_id!r} needs an id and a check type in {sorted(CHECK_TYPES)}")
+        annex = self.reference.rules.get(rule_id, {})
+        flows = raw.get("flows") or annex.get("flows") or []
+        severity = raw.get("severity") or annex.get("severity") or "error"
+        for fmt, binding in raw.get("bindings", {}).items():
+            operands = {VALUE: binding} if isinstance(binding, str) else dict(binding)
+            # Per-syntax variants of the check (e.g. date formats differ between UBL and CII)
+            fmt_check = {**check, **check.get("syntax", {}).get(fmt, {})}
+            fmt_check.pop("syntax", None)
+            allowed = None
+            if fmt_check.get("type") == "codelist":
+                allowed = self.reference.codelist_index.codes(fmt_check["codelist"])
+            rule = CompiledRule(rule_id, raw.get("bt"), severity, operands, raw.get("required"), fmt_check, allowed)
+            for flow in flows:
+                group = self._groups.setdefault((fmt, flow), _Group())
+                for expr in operands.values():
+                    try:
+                        group.compile(expr, namespaces)
+                    except (etree.XPathSyntaxError, RulebookError) as exc:
+                        raise RulebookError(f"{source}: rule {rule_id}: invalid XPath {expr!r}: {exc}") from exc
+                group.rules.append(rule)
+        self.rule_count += 1
+
+    def rules_for(self, fmt: str, flow: Optional[str]) -> List[CompiledRule]:
+        group = self._groups.get((fmt, flow or ""))
+        return group.rules if group else []
+
+    def evaluate(self, root: etree._Element, fmt: str, flow: Optional[str]) -> Tuple[List[RuleIssue], List[RuleIssue]]:
+        """(rule issues, codelist issues) of every rule bound to fmt/flow, in rule file order."""
+        issues: List[RuleIssue] = []
+        codelist_issues: List[RuleIssue] = []
+        group = self._groups.get((fmt, flow or ""))
+        if group is None:
+            return issues, codelist_issues
+        results = group.extract(root)
+        for rule in group.rules:
+            values = {name: results[expr] for name, expr in rule.operands.items()}
+            rule.apply(values, issues, codelist_issues)
+        return issues, codelist_issues
+
+
+def get_rulebook() -> Rulebook:
+    """Rulebook of the current reference snapshot, compiled on first use."""
+    from .snapshot import current
+    return current().rulebook
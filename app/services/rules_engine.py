@@ -1,134 +1,94 @@
 import re
-from typing import List, Tuple
+from typing import Dict, List, Tuple
 from lxml import etree
 from ..models.schemas import RuleIssue
-from ..routers import reference
+from . import annuaire, duplicates, identifiers, lifecycle, rulebook
+from .xml_parser import parse_xml
 
 
-ALLOWED_TYPE_CODES = {entry["code"] for entry in reference.CODELISTS.get("UNTDID1001", [])}
-ALLOWED_CADRES = set(reference.CODELISTS.get("CADRES", []))
-ALLOWED_DEV_CODES = {entry["code"] for entry in reference.CODELISTS.get("ISO4217", [])} if reference.CODELISTS.get("ISO4217") else set()
-ALLOWED_COUNTRIES = {entry["code"] for entry in reference.CODELISTS.get("ISO3166", [])} if reference.CODELISTS.get("ISO3166") else set()
-ID_PATTERN = re.compile(r"^[A-Za-z0-9\s\-+_/]{1,35}$")
-DATE_PATTERN = re.compile(r"^\d{4}-\d{2}-\d{2}$")
 DATE_COMPACT_PATTERN = re.compile(r"^\d{8}$")
+# Clark tag -> local name; bounded so documents with arbitrary tag names cannot grow it forever
+_LOCAL_NAMES: Dict[object, str] = {}
+_LOCAL_NAMES_MAX = 4096
+# The annuaire keeps its historical rule ids for SIREN/SIRET issues
+ANNUAIRE_RULE_IDS = {**identifiers.RULE_IDS, "siren": "ANN-SIREN", "siret": "ANN-SIRET"}
 
 
-def _text_or_none(root: etree._Element, xpath: str, ns: dict) -> str | None:
-    node = root.find(xpath, ns)
-    if node is None or node.text is None:
-        return None
-    return node.text.strip()
+def local_name(tag: object) -> str:
+    """Local part of an element tag ('' for comments and PIs), cached instead of building an etree.QName per node."""
+    name = _LOCAL_NAMES.get(tag)
+    if name is None:
+        name = tag.rpartition("}")[2] if isinstance(tag, str) else ""
+        if len(_LOCAL_NAMES) < _LOCAL_NAMES_MAX:
+            _LOCAL_NAMES[tag] = name
+    return name
 
 
-def check_ubl_f1(root: etree._Element) -> Tuple[List[RuleIssue], List[RuleIssue]]:
-    issues: List[RuleIssue] = []
-    codelist_issues: List[RuleIssue] = []
-    ns = {"cbc": "urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2"}
-
-    inv_id = _text_or_none(root, ".//cbc:ID", ns)
-    if not inv_id:
-        issues.append(RuleIssue(ruleId="G1.05", severity="error", xpath=".//cbc:ID", message="Identifiant de facture manquant"))
-    elif not ID_PATTERN.match(inv_id):
-        issues.append(RuleIssue(ruleId="G1.05", severity="error", xpath=".//cbc:ID", message="Identifiant de facture invalide (caractères ou longueur >35)"))
-
-    issue_date = _text_or_none(root, ".//cbc:IssueDate", ns)
-    if not issue_date:
-        issues.append(RuleIssue(ruleId="G1.09", severity="error", xpath=".//cbc:IssueDate", message="Date d'émission manquante"))
-    elif not DATE_PATTERN.match(issue_date):
-        issues.append(RuleIssue(ruleId="G1.09", severity="error", xpath=".//cbc:IssueDate", message="Date d'émission non au format AAAA-MM-JJ"))
-
-    inv_type = _text_or_none(root, ".//cbc:InvoiceTypeCode", ns)
-    if not inv_type:
-        issues.append(RuleIssue(ruleId="G1.01", severity="error", xpath=".//cbc:InvoiceTypeCode", message="Code type de facture manquant"))
-    elif inv_type not in ALLOWED_TYPE_CODES:
-        codelist_issues.append(RuleIssue(ruleId="UNTDID1001", severity="error", xpath=".//cbc:InvoiceTypeCode", message=f"Code {inv_type} non autorisé"))
-
-    # Cadre de facturation (G1.02) si présent dans un champ standard (non normatif, mais contrôlable via un attribut)
-    cadre = _text_or_none(root, ".//cbc:BuyerReference", ns)
-    if cadre and ALLOWED_CADRES and cadre not in ALLOWED_CADRES:
-        codelist_issues.append(RuleIssue(ruleId="G1.02", severity="error", xpath=".//cbc:BuyerReference", message=f"Cadre de facturation {cadre} non autorisé"))
+def ereporting_checks_name(name: str) -> bool:
+    """Whether check_ereporting_element looks at elements with this local name."""
+    return "Date" in name or "date" in name or identifiers.checks_name(name)
 
-    return issues, codelist_issues
+
+def check_ereporting_element(elem: etree._Element, issues: List[RuleIssue]) -> None:
+    """Per-element e-reporting checks (dates AAAAMMJJ, identifiers); also run by the streaming validator as elements close."""
+    name = local_name(elem.tag)
+    if "Date" in name or "date" in name:
+        txt = (elem.text or "").strip()
+        if txt and not DATE_COMPACT_PATTERN.match(txt):
+            issues.append(RuleIssue(ruleId="G1.09", severity="error", xpath=f".//{elem.tag}", message="Date non au format AAAAMMJJ"))
+    if identifiers.checks_name(name):
+        identifiers.check_element(elem, issues)
+
+
+def check_ubl_f1(root: etree._Element) -> Tuple[List[RuleIssue], List[RuleIssue]]:
+    return rulebook.get_rulebook().evaluate(root, "ubl", "f1")
 
 
 def check_cii_f1(root: etree._Element) -> Tuple[List[RuleIssue], List[RuleIssue]]:
-    issues: List[RuleIssue] = []
-    codelist_issues: List[RuleIssue] = []
-    ns = {
-        "rsm": "urn:un:unece:uncefact:data:standard:CrossIndustryInvoice:100",
-        "ram": "urn:un:unece:uncefact:data:standard:ReusableAggregateBusinessInformationEntity:100",
-        "udt": "urn:un:unece:uncefact:data:standard:UnqualifiedDataType:100",
-    }
-
-    inv_id = _text_or_none(root, ".//rsm:ExchangedDocument/ram:ID", ns)
-    if not inv_id:
-        issues.append(RuleIssue(ruleId="G1.05", severity="error", xpath=".//rsm:ExchangedDocument/ram:ID", message="Identifiant de facture manquant"))
-    elif not ID_PATTERN.match(inv_id):
-        issues.append(RuleIssue(ruleId="G1.05", severity="error", xpath=".//rsm:ExchangedDocument/ram:ID", message="Identifiant de facture invalide (caractères ou longueur >35)"))
-
-    issue_date = _text_or_none(root, ".//rsm:ExchangedDocument/ram:IssueDateTime/udt:DateTimeString", ns)
-    if not issue_date:
-        issues.append(RuleIssue(ruleId="G1.09", severity="error", xpath=".//ram:IssueDateTime/udt:DateTimeString", message="Date d'émission manquante"))
-    elif not DATE_COMPACT_PATTERN.match(issue_date):
-        issues.append(RuleIssue(ruleId="G1.09", severity="error", xpath=".//ram:IssueDateTime/udt:DateTimeString", message="Date d'émission non au format AAAAMMJJ"))
-
-    inv_type = _text_or_none(root, ".//rsm:ExchangedDocument/ram:TypeCode", ns)
-    if not inv_type:
-        issues.append(RuleIssue(ruleId="G1.01", severity="error", xpath=".//rsm:ExchangedDocument/ram:TypeCode", message="Code type de facture manquant"))
-    elif inv_type not in ALLOWED_TYPE_CODES:
-        codelist_issues.append(RuleIssue(ruleId="UNTDID1001", severity="error", xpath=".//rsm:ExchangedDocument/ram:TypeCode", message=f"Code {inv_type} non autorisé"))
-
-    # Devise BT-5 : monnaie des totaux
-    currency = _text_or_none(root, ".//ram:ApplicableHeaderTradeSettlement/ram:InvoiceCurrencyCode", ns)
-    if currency and ALLOWED_DEV_CODES and currency not in ALLOWED_DEV_CODES:
-        codelist_issues.append(RuleIssue(ruleId="G1.10", severity="error", xpath=".//ram:ApplicableHeaderTradeSettlement/ram:InvoiceCurrencyCode", message=f"Devise {currency} non autorisée (ISO 4217)"))
+    return rulebook.get_rulebook().evaluate(root, "cii", "f1")
 
-    return issues, codelist_issues
+
+def parser_issue(exc: Exception) -> RuleIssue:
+    return RuleIssue(ruleId="PARSER", severity="error", xpath=None, message=str(exc))
 
 
 def evaluate(xml_content: bytes, fmt: str, flow: str | None = None) -> Tuple[List[RuleIssue], List[RuleIssue]]:
     """Apply basic business and codelist checks based on format/flow."""
+    try:
+        root = parse_xml(xml_content)
+    except Exception as exc:
+        return [parser_issue(exc)], []
+    return evaluate_tree(root, fmt, flow)
+
+
+def evaluate_tree(root: etree._Element, fmt: str, flow: str | None = None,
+                  book: rulebook.Rulebook | None = None) -> Tuple[List[RuleIssue], List[RuleIssue]]:
+    """Same checks as evaluate(), on an already parsed document; book defaults to the current snapshot's."""
     fmt = fmt.lower() if fmt else fmt
     flow = flow.lower() if flow else flow
 
-    issues: List[RuleIssue] = []
-    codelist_issues: List[RuleIssue] = []
+    # Declarative rules (data/rules) bound to this format and flow
+    issues, codelist_issues = (book or rulebook.get_rulebook()).evaluate(root, fmt, flow)
 
-    try:
-        root = etree.fromstring(xml_content)
-    except Exception as exc:
-        issues.append(RuleIssue(ruleId="PARSER", severity="error", xpath=None, message=str(exc)))
-        return issues, codelist_issues
+    # Invoice already recorded in the duplicate index (FE_DUPLICATE_CHECK=1)
+    if flow == "f1" and fmt in duplicates.FORMATS and duplicates.enabled():
+        issues.extend(duplicates.check_tree(root, fmt))
 
-    if fmt == "ubl" and flow == "f1":
-        return check_ubl_f1(root)
-    if fmt == "cii" and flow == "f1":
-        return check_cii_f1(root)
+    # Buyer addressable in the annuaire index at the issue date (FE_ANNUAIRE_CHECK=1)
+    if flow == "f1" and fmt in annuaire.FORMATS and annuaire.enabled():
+        issues.extend(annuaire.check_tree(root, fmt))
+
+    # Status transitions against the CDV lifecycle store (FE_CDV_CHECK=1)
+    if fmt == "cdv" and lifecycle.enabled():
+        issues.extend(lifecycle.check_tree(root))
 
     # Minimal generic checks for e-reporting: dates AAAAMMJJ
     if fmt == "ereporting":
-        issues = []
-        for elem in root.iter():
-            lname = etree.QName(elem.tag).localname if isinstance(elem.tag, str) else ""
-            if "Date" in lname or "date" in lname:
-                txt = (elem.text or "").strip()
-                if txt and not DATE_COMPACT_PATTERN.match(txt):
-                    issues.append(RuleIssue(ruleId="G1.09", severity="error", xpath=f".//{elem.tag}", message="Date non au format AAAAMMJJ"))
+        for elem in root.iter(etree.Element):
+            check_ereporting_element(elem, issues)
         return issues, codelist_issues
 
-    # Minimal generic checks pour l'annuaire : SIREN/SIRET longueurs
-    if fmt == "annuaire":
-        issues = []
-        for elem in root.iter():
-            lname = etree.QName(elem.tag).localname if isinstance(elem.tag, str) else ""
-            txt = (elem.text or "").strip()
-            if not txt:
-                continue
-            if lname.upper() == "SIREN" and len(txt) != 9:
-                issues.append(RuleIssue(ruleId="ANN-SIREN", severity="error", xpath=f".//{elem.tag}", message="SIREN doit contenir 9 chiffres"))
-            if lname.upper() == "SIRET" and len(txt) != 14:
-                issues.append(RuleIssue(ruleId="ANN-SIRET", severity="error", xpath=f".//{elem.tag}", message="SIRET doit contenir 14 chiffres"))
-        return issues, codelist_issues
+    # SIREN/SIRET (chiffres + clé de Luhn) et numéros de TVA FR des parties
+    issues.extend(identifiers.check_tree(root, fmt, ANNUAIRE_RULE_IDS if fmt == "annuaire" else None))
 
     return issues, codelist_issues
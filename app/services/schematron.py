@@ -0,0 +1,151 @@
+"""Schematron validation with compiled XSLT cached on disk and in memory.
+
+Rule sets live in data/schematron: ISO Schematron files (*.sch, XPath 1.0 / queryBinding
+xslt, compiled with lxml's isoschematron skeleton) or already compiled XSLT 1.0 stylesheets
+(*.xsl, *.xslt). Compiling a .sch takes several XSLT passes, so the result is written to
+FE_SCHEMATRON_CACHE_DIR, keyed by the SHA-256 of the source and the lxml version, and every
+process loads it from there at most once. The official EN16931/CIUS rule sets target XSLT
+2.0, which libxslt does not run; they have to be rewritten in XPath 1.0 to be used here.
+"""
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from lxml import etree, isoschematron
+
+from ..models.schemas import RuleIssue
+
+SCHEMATRON_DIR = Path(__file__).resolve().parents[2] / "data" / "schematron"
+CACHE_DIR_ENV = "FE_SCHEMATRON_CACHE_DIR"
+SVRL_NS = "http://purl.oclc.org/dsdl/svrl"
+_SOURCE_SUFFIXES = (".sch", ".xsl", ".xslt")
+_SEVERITIES = {"fatal": "error", "error": "error", "warning": "warning", "warn": "warning",
+               "info": "info", "information": "info"}
+
+
+class UnknownRuleSet(ValueError):
+    pass
+
+
+def cache_dir() -> Path:
+    return Path(os.environ.get(CACHE_DIR_ENV) or Path(tempfile.gettempdir()) / "fe-mcp-schematron")
+
+
+class _RuleSetEntry:
+    __slots__ = ("name", "xslt", "compile_seconds", "from_disk", "hits", "lock")
+
+    def __init__(self, name: str, xslt: etree.XSLT, compile_seconds: float, from_disk: bool):
+        self.name = name
+        self.xslt = xslt
+        self.compile_seconds = compile_seconds
+        self.from_disk = from_disk
+        self.hits = 0
+        # Same as XSD schemas: the error log lives on the XSLT object.
+        self.lock = threading.Lock()
+
+
+class SchematronRegistry:
+    """Process-wide cache of compiled rule sets, backed by the on-disk XSLT cache."""
+
+    def __init__(self, base_dir: Path = SCHEMATRON_DIR):
+        self.base_dir = base_dir
+        self._entries: Dict[str, _RuleSetEntry] = {}
+        self._lock = threading.Lock()
+
+    def available(self) -> List[str]:
+        if not self.base_dir.exists():
+            return []
+        return sorted(p.stem for p in self.base_dir.iterdir() if p.suffix in _SOURCE_SUFFIXES)
+
+    def source(self, name: str) -> Path:
+        for suffix in _SOURCE_SUFFIXES:
+            path = self.base_dir / f"{name}{suffix}"
+            if path.is_file():
+                return path
+        raise UnknownRuleSet(f"Unknown Schematron rule set '{name}' (available: {', '.join(self.available()) or 'none'})")
+
+    def entry(self, name: str) -> _RuleSetEntry:
+        entry = self._entries.get(name)
+        if entry is None:
+            with self._lock:
+                entry = self._entries.get(name)
+                if entry is None:
+                    entry = self._entries[name] = self._load(name)
+                    return entry
+        entry.hits += 1
+        return entry
+
+    def _load(self, name: str) -> _RuleSetEntry:
+        source = self.source(name)
+        start = time.perf_counter()
+        if source.suffix != ".sch":
+            xslt = etree.XSLT(etree.parse(str(source)))
+            return _RuleSetEntry(name, xslt, time.perf_counter() - start, from_disk=True)
+        data = source.read_bytes()
+        digest = hashlib.sha256(data + etree.__version__.encode()).hexdigest()[:16]
+        cached = cache_dir() / f"{name}.{digest}.xsl"
+        if cached.exists():
+            xslt = etree.XSLT(etree.parse(str(cached)))
+            return _RuleSetEntry(name, xslt, time.perf_counter() - start, from_disk=True)
+        compiled = isoschematron.Schematron(etree.fromstring(data, base_url=str(source)), store_xslt=True).validator_xslt
+        cached.parent.mkdir(parents=True, exist_ok=True)
+        tmp = cached.with_suffix(f".{os.getpid()}.tmp")
+        compiled.write(str(tmp))
+        os.replace(tmp, cached)
+        xslt = etree.XSLT(compiled)
+        return _RuleSetEntry(name, xslt, time.perf_counter() - start, from_disk=False)
+
+    def warm_up(self) -> Dict[str, float]:
+        """Load every available rule set; returns load time per rule set."""
+        return {name: self.entry(name).compile_seconds for name in self.available()}
+
+    def validate_tree(self, root: etree._Element, name: str) -> List[RuleIssue]:
+        entry = self.entry(name)
+        with entry.lock:
+            svrl = entry.xslt(root.getroottree())
+        return svrl_issues(svrl.getroot(), name)
+
+    def stats(self) -> Dict:
+        return {
+            "cacheDir": str(cache_dir()),
+            "available": self.available(),
+            "ruleSets": {
+                name: {"hits": e.hits, "loadSeconds": round(e.compile_seconds, 6), "fromDiskCache": e.from_disk}
+                for name, e in list(self._entries.items())
+            },
+        }
+
+
+def svrl_issues(svrl: Optional[etree._Element], rule_set: str) -> List[RuleIssue]:
+    """failed-assert and successful-report entries of an SVRL report as RuleIssue."""
+    issues: List[RuleIssue] = []
+    if svrl is None:
+        return issues
+    for node in svrl.iterchildren(f"{{{SVRL_NS}}}failed-assert", f"{{{SVRL_NS}}}successful-report"):
+        text = node.find(f"{{{SVRL_NS}}}text")
+        message = " ".join((text.text or "").split()) if text is not None else ""
+        flag = (node.get("flag") or node.get("role") or "error").lower()
+        issues.append(RuleIssue(
+            ruleId=node.get("id") or rule_set,
+            severity=_SEVERITIES.get(flag, "error"),
+            xpath=node.get("location"),
+            message=message or node.get("test", ""),
+        ))
+    return issues
+
+
+def get_registry() -> SchematronRegistry:
+    """Registry of the current reference snapshot."""
+    from .snapshot import current
+    return current().schematron
+
+
+def check_rule_sets(names: Iterable[str]) -> None:
+    """Raise UnknownRuleSet before any work is done when a requested rule set does not exist."""
+    registry = get_registry()
+    for name in names:
+        registry.source(name)
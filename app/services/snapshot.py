@@ -0,0 +1,239 @@
+"""Versioned reference snapshots, swapped atomically on reload.
+
+A ReferenceSnapshot is one load of everything validation reads besides the document: the
+annex reference data (rules, codelists, required fields, CDV statuses) with its codelist
+index, the XSD and Schematron registries and the declarative rulebook compiled against
+those codelists. Its data is never modified once published; compiled objects are only
+added to its registries on first use.
+
+current() returns the published snapshot. A request takes it once and uses it to the end,
+so reload() can load and compile a new snapshot while requests are served, then swap the
+single module reference: requests already running finish on the old snapshot, which is
+freed with the last of them. Reloads are triggered by POST /snapshot/reload, by SIGHUP
+(scripts/serve.py forwards it to its workers) or by a watcher thread polling the source
+files every FE_RELOAD_INTERVAL seconds.
+
+version hashes the annex content and the state of the XSD, rule and Schematron trees. It
+is reported with every validation and is part of the result cache keys.
+
+Process pools (batch workers, FE_MCP_EXECUTOR=process) hold their own snapshot, loaded
+when each worker starts. They register an on_publish() hook that retires the pool, so
+the next task starts workers that load the published snapshot.
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from . import annex_store, codelists
+from .rulebook import RULES_DIR, Rulebook
+from .schematron import SCHEMATRON_DIR, SchematronRegistry
+from .xsd_validator import XSD_DIR, SchemaRegistry, XSDValidator
+
+INTERVAL_ENV = "FE_RELOAD_INTERVAL"
+
+logger = logging.getLogger(__name__)
+
+
+def tree_state(base: Path) -> str:
+    """Hash of the names, sizes and mtimes of the files under base (no content read)."""
+    digest = hashlib.sha256()
+    if base.exists():
+        for path in sorted(p for p in base.rglob("*") if p.is_file()):
+            stat = path.stat()
+            digest.update(f"{path.relative_to(base)}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode())
+    return digest.hexdigest()
+
+
+def _trees() -> str:
+    return "\0".join(tree_state(base) for base in (XSD_DIR, RULES_DIR, SCHEMATRON_DIR))
+
+
+def sources_state() -> str:
+    """Cheap fingerprint of every source file (stat only); the watcher reloads when it changes."""
+    parts = [_trees()]
+    base = annex_store.cache_dir()
+    if base is not None:
+        for name in annex_store.SOURCES + [annex_store.STORE_NAME]:
+            path = base / name
+            if path.exists():
+                stat = path.stat()
+                parts.append(f"{name}\0{stat.st_size}\0{stat.st_mtime_ns}")
+    return hashlib.sha256("\n".join(parts).encode()).hexdigest()
+
+
+class ReferenceSnapshot:
+    def __init__(self, data: Dict[str, Any], trees: str = ""):
+        self.rules: Dict[str, Dict] = {**annex_store.DEFAULT_RULES, **data["rules"]}
+        self.codelists: Dict[str, list] = data["codelists"]
+        required = {**annex_store.DEFAULT_REQUIRED_FIELDS, **data["requiredFields"]}
+        self.required_fields = {tuple(key.split("|", 1)): fields for key, fields in required.items()}
+        self.cdv_statuses = data["cdvStatuses"]
+        self.content_hash: Optional[str] = data["contentHash"]
+        self.version = hashlib.sha256(f"{self.content_hash or ''}\0{trees}".encode()).hexdigest()[:12]
+        self.loaded_at = time.time()
+        self.codelist_index = codelists.CodelistIndex(self.codelists, self.content_hash)
+        self.schemas = SchemaRegistry(XSD_DIR)
+        self.validator = XSDValidator(XSD_DIR, registry=self.schemas)
+        self.schematron = SchematronRegistry()
+        self._rulebook: Optional[Rulebook] = None
+        self._rulebook_lock = threading.Lock()
+
+    @classmethod
+    def load(cls) -> "ReferenceSnapshot":
+        """Read the reference data and the state of the source trees (nothing compiled yet)."""
+        return cls(annex_store.load_reference(), _trees())
+
+    @property
+    def rulebook(self) -> Rulebook:
+        """Declarative rules compiled against this snapshot's codelists, on first use."""
+        if self._rulebook is None:
+            with self._rulebook_lock:
+                if self._rulebook is None:
+                    self._rulebook = Rulebook(RULES_DIR, self)
+        return self._rulebook
+
+    def compile(self) -> Dict[str, float]:
+        """Compile every schema, rule set and the rulebook; returns seconds per step."""
+        timings = {}
+        for name, step in (("xsd", self.schemas.warm_up), ("schematron", self.schematron.warm_up),
+                           ("rulebook", lambda: self.rulebook)):
+            start = time.perf_counter()
+            step()
+            timings[name] = round(time.perf_counter() - start, 6)
+        return timings
+
+    def info(self) -> Dict[str, Any]:
+        return {"version": self.version, "contentHash": self.content_hash,
+                "loadedAt": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(self.loaded_at)),
+                "codelists": len(self.codelists), "rules": len(self.rules)}
+
+
+_current: Optional[ReferenceSnapshot] = None
+# Serialises loads; readers never take it once a snapshot is published
+_load_lock = threading.Lock()
+# sources: sources_state() when the sources were last read, for the watcher
+_state: Dict[str, Any] = {"reloads": 0, "previous": None, "lastError": None, "sources": None}
+_publish_hooks: List[Callable[[], None]] = []
+
+
+def on_publish(hook: Callable[[], None]) -> Callable[[], None]:
+    """Call hook() after every reload that publishes a new snapshot (worker pools recycle there)."""
+    _publish_hooks.append(hook)
+    return hook
+
+
+def current() -> ReferenceSnapshot:
+    """The published snapshot, loaded on first use."""
+    snapshot = _current
+    return snapshot if snapshot is not None else _initial()
+
+
+def _initial() -> ReferenceSnapshot:
+    global _current
+    with _load_lock:
+        if _current is None:
+            _state["sources"] = sources_state()
+            _current = ReferenceSnapshot.load()
+        return _current
+
+
+def reload(force: bool = False) -> Dict[str, Any]:
+    """Load and compile a new snapshot, then publish it; unchanged sources keep the current one unless force.
+
+    Any error while loading or compiling leaves the current snapshot in place and is raised.
+    """
+    global _current
+    with _load_lock:
+        old = _current
+        start = time.perf_counter()
+        try:
+            _state["sources"] = sources_state()
+            new = ReferenceSnapshot.load()
+            if old is not None and new.version == old.version and not force:
+                return {"reloaded": False, "version": old.version}
+            timings = new.compile()
+        except Exception as exc:
+            _state["lastError"] = f"{type(exc).__name__}: {exc}"
+            raise
+        _current = new
+        _state.update(reloads=_state["reloads"] + 1, previous=old.version if old else None, lastError=None)
+    seconds = round(time.perf_counter() - start, 6)
+    logger.info("reference snapshot %s published (previous %s, %.3fs)", new.version, _state["previous"], seconds)
+    for hook in list(_publish_hooks):
+        try:
+            hook()
+        except Exception:
+            logger.exception("snapshot publish hook %r failed", hook)
+    return {"reloaded": True, "version": new.version, "previous": _state["previous"], "seconds": seconds,
+            "steps": timings}
+
+
+def reload_in_background() -> threading.Thread:
+    """reload() on a daemon thread (signal handlers, watcher); errors are logged and kept in status()."""
+    def run():
+        try:
+            reload()
+        except Exception:
+            logger.exception("reference snapshot reload failed, keeping %s", current().version)
+
+    thread = threading.Thread(target=run, name="fe-snapshot-reload", daemon=True)
+    thread.start()
+    return thread
+
+
+def status() -> Dict[str, Any]:
+    watcher = _watcher
+    return {**current().info(), "reloads": _state["reloads"], "previous": _state["previous"],
+            "lastError": _state["lastError"], "watchInterval": watcher.interval if watcher else None}
+
+
+class Watcher(threading.Thread):
+    """Polls sources_state() and reloads when the files under the watched trees change."""
+
+    def __init__(self, interval: float):
+        super().__init__(name="fe-snapshot-watcher", daemon=True)
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def run(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            try:
+                current()
+                if sources_state() != _state["sources"]:
+                    reload()
+            except Exception:
+                logger.exception("reference snapshot reload failed, keeping %s", current().version)
+
+    def stop(self) -> None:
+        self._stop_event.set()
+
+
+_watcher: Optional[Watcher] = None
+
+
+def watch_interval() -> float:
+    try:
+        return max(0.0, float(os.environ.get(INTERVAL_ENV, "0") or 0))
+    except ValueError:
+        return 0.0
+
+
+def start_watcher() -> Optional[Watcher]:
+    """Start the watcher when FE_RELOAD_INTERVAL is set (seconds > 0); one per process."""
+    global _watcher
+    interval = watch_interval()
+    if interval and _watcher is None:
+        _watcher = Watcher(interval)
+        _watcher.start()
+    return _watcher
+
+
+def stop_watcher() -> None:
+    global _watcher
+    if _watcher is not None:
+        _watcher.stop()
+        _watcher = None
@@ -0,0 +1,194 @@
+"""Streaming validation of large e-reporting (F10) files.
+
+Monthly F10 reports run to hundreds of MB, more than a worker can hold as one lxml tree.
+EReportingStream is fed the body chunk by chunk and never keeps more than the report header
+and the record being read:
+
+- a pull parser delivers elements as they close; per-element rules
+  (rules_engine.check_ereporting_element) run on them, then each record (Invoice,
+  Transactions) is cleared and dropped from its parent. Only records and elements the
+  rules look at (names taken from the e-reporting XSD files) are handed to Python, the
+  rest stays in libxml2;
+- XSD validation runs in a second pull parser with the schema attached, which only reports
+  records (so they can be cleared there too). libxml2 stops at the first schema error: that
+  error is reported, the validating parser is dropped and the rest of the file is still
+  checked against the rules;
+- declarative rules (data/rules) bound to e-reporting run at the end on what is left, the
+  header, together with the per-element rules for header elements the XSD does not declare
+  (the document is then schema-invalid anyway, but the report matches the tree pipeline).
+
+Issues come out of feed()/close() as soon as they are found, as events (see events);
+close() ends with a summary. Past max_errors issues the rest of the body is ignored. The
+whole file is checked against the reference snapshot current when the stream was opened.
+"""
+import functools
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from lxml import etree
+
+from ..models.schemas import RuleIssue
+from . import events, metrics, rules_engine, snapshot, syntax
+from .xml_parser import huge_tree_enabled
+from .xsd_validator import XSDValidator
+
+FORMAT = "ereporting"
+# Repeated children of TransactionsReport / PaymentsReport
+RECORD_TAGS = frozenset({"Invoice", "Transactions"})
+
+XS_ELEMENT = "{http://www.w3.org/2001/XMLSchema}element"
+
+
+@functools.lru_cache(maxsize=8)
+def checked_tags(schema_dir: Path) -> Tuple[str, ...]:
+    """Pull parser tag filter: records plus every element declared in the XSD files that the rules check."""
+    names = set(RECORD_TAGS)
+    for xsd in schema_dir.glob("*.xsd"):
+        for decl in etree.parse(str(xsd)).iter(XS_ELEMENT):
+            name = decl.get("name")
+            if name and rules_engine.ereporting_checks_name(name):
+                names.add(name)
+    return tuple(sorted(f"{{*}}{name}" for name in names))
+
+
+def _drop(elem: etree._Element) -> None:
+    """Clear a processed record and remove the records before it from their parent (header elements stay)."""
+    elem.clear()
+    parent = elem.getparent()
+    if parent is None:
+        return
+    previous = elem.getprevious()
+    while previous is not None and previous.tag in RECORD_TAGS:
+        parent.remove(previous)
+        previous = elem.getprevious()
+
+
+def _parser_options() -> Dict[str, Any]:
+    # Same hardening as xml_parser.make_parser
+    return dict(resolve_entities=False, no_network=True, load_dtd=False, huge_tree=huge_tree_enabled())
+
+
+class EReportingStream:
+    def __init__(self, flow: Optional[str] = None, profile: Optional[str] = None, validator: Optional[XSDValidator] = None,
+                 max_errors: Optional[int] = None):
+        self.flow = flow.lower() if flow else flow
+        self.profile = profile
+        self._schema_parser: Optional[etree.XMLPullParser] = None
+        self._pending: List[events.Event] = []
+        self.limit = events.IssueLimit(max_errors)
+        self.reference = snapshot.current()
+        validator = validator or self.reference.validator
+        schema_path = validator.schema_path(FORMAT, self.flow, profile)
+        if schema_path is None:
+            self._emit("syntax", syntax.text(validator.missing_schema_error(FORMAT, self.flow, profile)))
+            # Without the XSD to list the checked names, every element goes through the rules
+            self._parser = etree.XMLPullParser(events=("end",), **_parser_options())
+            self._checked: frozenset = frozenset()
+        else:
+            schema = validator._get_schema(schema_path)
+            tags = checked_tags(schema_path.parent)
+            self._parser = etree.XMLPullParser(events=("end",), tag=tags, **_parser_options())
+            self._checked = frozenset(tag[3:] for tag in tags)
+            self._schema_parser = etree.XMLPullParser(events=("end",), tag=RECORD_TAGS, schema=schema, **_parser_options())
+        self._started = False
+        self._failed = False
+        self._start = time.perf_counter()
+        self.size = 0
+        self.records = 0
+
+    def _emit(self, kind: str, issue: Any) -> None:
+        self._pending += self.limit.take(kind, (issue,))
+
+    def _drain(self) -> List[events.Event]:
+        events, self._pending = self._pending, []
+        return events
+
+    def feed(self, chunk: bytes) -> List[events.Event]:
+        """Parse one chunk; returns the issues found in it."""
+        if self._failed or self.limit.reached or not chunk:
+            return self._drain()
+        self.size += len(chunk)
+        if not self._started:
+            chunk = chunk.lstrip()  # same leniency as decode_payload
+            if not chunk:
+                return self._drain()
+            self._started = True
+        try:
+            self._parser.feed(chunk)
+        except etree.XMLSyntaxError as exc:
+            self._parse_failed(exc)
+            return self._drain()
+        # Fed second: the chunk is well-formed so far, any error from this parser is a schema error
+        self._feed_schema(chunk)
+        self._process()
+        return self._drain()
+
+    def _feed_schema(self, chunk: Optional[bytes]) -> None:
+        parser = self._schema_parser
+        if parser is None:
+            return
+        try:
+            if chunk is None:
+                parser.close()
+            else:
+                parser.feed(chunk)
+                for _, elem in parser.read_events():
+                    _drop(elem)
+        except etree.XMLSyntaxError as exc:
+            self._schema_parser = None
+            self._emit("syntax", syntax.from_exception(exc))
+
+    def _process(self) -> None:
+        issues: List[RuleIssue] = []
+        for _, elem in self._parser.read_events():
+            if elem.tag in RECORD_TAGS:
+                self.records += 1
+                _drop(elem)
+            else:
+                rules_engine.check_ereporting_element(elem, issues)
+        for issue in issues:
+            self._emit("rules", issue)
+
+    def _check_skeleton(self, root: etree._Element) -> None:
+        if not self._checked:
+            return
+        issues: List[RuleIssue] = []
+        for elem in root.iter(etree.Element):
+            if rules_engine.local_name(elem.tag) not in self._checked:
+                rules_engine.check_ereporting_element(elem, issues)
+        for issue in issues:
+            self._emit("rules", issue)
+
+    def _parse_failed(self, exc: Exception) -> None:
+        self._failed = True
+        self._schema_parser = None
+        self._emit("syntax", syntax.from_exception(exc))
+        self._emit("rules", rules_engine.parser_issue(exc))
+
+    def close(self) -> List[events.Event]:
+        """Finish parsing; returns the last issues followed by ("summary", dict)."""
+        if not self._failed and not self.limit.reached:
+            if not self._started:
+                self._parse_failed(etree.XMLSyntaxError("Document is empty", None, 1, 1))
+            else:
+                try:
+                    root = self._parser.close()
+                except etree.XMLSyntaxError as exc:
+                    self._parse_failed(exc)
+                else:
+                    self._feed_schema(None)
+                    self._process()
+                    self._check_skeleton(root)
+                    rule_issues, codelist_issues = self.reference.rulebook.evaluate(root, FORMAT, self.flow)
+                    for issue in rule_issues:
+                        self._emit("rules", issue)
+                    for issue in codelist_issues:
+                        self._emit("codelists", issue)
+        duration = time.perf_counter() - self._start
+        result = "valid" if self.limit.total == 0 else "invalid"
+        metrics.observe_request(FORMAT, self.flow, self.profile, result, duration, self.size)
+        summary = self.limit.summary(records=self.records, bytes=self.size, durationSeconds=round(duration, 6),
+                                     snapshotVersion=self.reference.version)
+        return self._drain() + [summary]
+
@@ -0,0 +1,66 @@
+"""Structured syntax issues (parser and XSD errors).
+
+Schema error logs are kept as SyntaxEntry tuples (line, column, domain, type, element path,
+message) rather than formatted strings: str() still gives the historical lxml text form,
+computed only when a text report is asked for. A badly broken file repeats the same error
+on every invoice line, so structured reports group entries that differ only by position
+(same domain, type, message and element path without indexes) and count them.
+"""
+import re
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from ..models.schemas import SyntaxIssue
+
+_INDEX = re.compile(r"\[\d+\]")
+
+
+class SyntaxEntry(NamedTuple):
+    line: int
+    column: int
+    domain: str
+    type: str
+    path: Optional[str]
+    message: str
+    level: str = "ERROR"
+    filename: str = ""
+
+    def __str__(self) -> str:
+        if not self.domain:
+            return self.message
+        return f"{self.filename}:{self.line}:{self.column}:{self.level}:{self.domain}:{self.type}: {self.message}"
+
+    def group_key(self) -> Tuple:
+        return self.domain, self.type, _INDEX.sub("", self.path) if self.path else None, self.message
+
+    def to_model(self, count: int = 1) -> SyntaxIssue:
+        return SyntaxIssue(line=self.line or None, column=self.column if self.line else None, domain=self.domain or None,
+                           type=self.type or None, path=self.path, message=self.message, count=count)
+
+
+def from_log(entry) -> SyntaxEntry:
+    """From an lxml error log entry."""
+    return SyntaxEntry(entry.line, entry.column, entry.domain_name, entry.type_name, entry.path, entry.message,
+                       entry.level_name, entry.filename)
+
+
+def from_exception(exc: Exception) -> SyntaxEntry:
+    """From a parser exception or any other failure; str() is str(exc)."""
+    line = getattr(exc, "lineno", None) or 0
+    return SyntaxEntry(line, getattr(exc, "offset", None) or 0, "", "", None, str(exc))
+
+
+def text(message: str) -> SyntaxEntry:
+    return SyntaxEntry(0, 0, "", "", None, message)
+
+
+def grouped(entries: Iterable[SyntaxEntry]) -> List[Tuple[SyntaxEntry, int]]:
+    """(first entry, occurrences) per distinct error, in order of first appearance."""
+    groups: Dict[Tuple, List] = {}
+    for entry in entries:
+        key = entry.group_key()
+        group = groups.get(key)
+        if group is None:
+            groups[key] = [entry, 1]
+        else:
+            group[1] += 1
+    return [(entry, count) for entry, count in groups.values()]
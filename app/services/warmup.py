@@ -0,0 +1,71 @@
+"""Process warm-up and readiness.
+
+run() loads everything a request would otherwise build on first use: the reference
+snapshot (reference data and codelist index, every mapped XSD, the Schematron rule sets,
+the declarative rulebook), the e-reporting tag filter, the annuaire index
+(FE_ANNUAIRE_FILES) and, when the check is on, the duplicate index filter. The pre-fork
+launcher (scripts/serve.py) calls it once in the master with freeze=True: gc.freeze() then
+moves the warmed objects to the permanent generation, so the collector in the forked
+workers never writes to their pages and they stay shared copy-on-write instead of being
+duplicated per worker.
+
+/ready answers 503 until run() has finished (or mark_ready() was called when warm-up is
+left to first use), so a load balancer only routes to warm workers.
+"""
+import gc
+import os
+import threading
+import time
+from typing import Dict
+
+from . import annuaire, duplicates, snapshot, streaming, xsd_validator
+
+_ready = threading.Event()
+_timings: Dict[str, float] = {}
+_state: Dict = {"seconds": None, "frozen": 0, "pid": None}
+
+
+def run(freeze: bool = False) -> Dict[str, float]:
+    """Build every process-wide cache; returns the seconds spent per step."""
+    ereporting_dir = (xsd_validator.XSD_DIR / xsd_validator._SCHEMA_MAP[(streaming.FORMAT, None, None)]).parent
+    start = time.perf_counter()
+    steps = (
+        ("reference", snapshot.current),
+        ("xsd", lambda: snapshot.current().schemas.warm_up()),
+        ("schematron", lambda: snapshot.current().schematron.warm_up()),
+        ("rulebook", lambda: snapshot.current().rulebook),
+        ("ereporting", lambda: streaming.checked_tags(ereporting_dir)),
+        ("duplicates", lambda: duplicates.enabled() and duplicates.get_index()),
+        ("annuaire", annuaire.get_index),
+    )
+    for name, step in steps:
+        step_start = time.perf_counter()
+        step()
+        _timings[name] = round(time.perf_counter() - step_start, 6)
+    if freeze:
+        gc.collect()
+        gc.freeze()
+        _state["frozen"] = gc.get_freeze_count()
+    _state.update(seconds=round(time.perf_counter() - start, 6), pid=os.getpid())
+    mark_ready()
+    return dict(_timings)
+
+
+def mark_ready() -> None:
+    _ready.set()
+
+
+def is_ready() -> bool:
+    return _ready.is_set()
+
+
+def status() -> Dict:
+    return {"ready": is_ready(), "pid": os.getpid(), "warmedInPid": _state["pid"], "warmUpSeconds": _state["seconds"],
+            "steps": dict(_timings), "frozenObjects": _state["frozen"]}
+
+
+def reset() -> None:
+    """Back to not ready (tests)."""
+    _ready.clear()
+    _timings.clear()
+    _state.update(seconds=None, frozen=0, pid=None)
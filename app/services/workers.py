@@ -0,0 +1,33 @@
+"""Worker processes of the deployment, for the stores that must agree across them.
+
+scripts/serve.py exports FE_WORKERS and FE_STATE_DIR (a fresh temporary directory) to its
+workers; with another launcher (uvicorn --workers, gunicorn) set FE_WORKERS by hand. With
+more than one worker, the stores kept in process memory by default (annuaire loads,
+duplicate index, CDV lifecycle) default to files in FE_STATE_DIR instead, shared by the
+workers.
+"""
+import os
+import tempfile
+from pathlib import Path
+
+WORKERS_ENV = "FE_WORKERS"
+STATE_DIR_ENV = "FE_STATE_DIR"
+
+
+def count() -> int:
+    try:
+        return max(1, int(os.environ.get(WORKERS_ENV) or 1))
+    except ValueError:
+        return 1
+
+
+def shared() -> bool:
+    """True when state kept in process memory would differ from one worker to the next."""
+    return count() > 1
+
+
+def state_path(name: str) -> Path:
+    """Path of a shared store in FE_STATE_DIR (default: one directory per parent process in the temp dir)."""
+    base = Path(os.environ.get(STATE_DIR_ENV) or Path(tempfile.gettempdir()) / f"fe-state-{os.getppid()}")
+    base.mkdir(parents=True, exist_ok=True)
+    return base / name
@@ -0,0 +1,36 @@
+import os
+import threading
+from lxml import etree
+
+# lxml refuses text nodes > 10 MB and very deep trees unless huge_tree is set.
+# Large F10/F1 files need it; keep it opt-out rather than implicit.
+HUGE_TREE_ENV = "FE_XML_HUGE_TREE"
+
+_local = threading.local()
+
+
+def huge_tree_enabled() -> bool:
+    return os.environ.get(HUGE_TREE_ENV, "1").strip().lower() not in {"0", "false", "no"}
+
+
+def make_parser() -> etree.XMLParser:
+    """Hardened parser: no network access, no DTD loading, no entity expansion."""
+    return etree.XMLParser(
+        resolve_entities=False,
+        no_network=True,
+        load_dtd=False,
+        dtd_validation=False,
+        huge_tree=huge_tree_enabled(),
+    )
+
+
+def get_parser() -> etree.XMLParser:
+    """Reusable parser, one per thread (lxml parsers serialise concurrent use)."""
+    parser = getattr(_local, "parser", None)
+    if parser is None:
+        parser = _local.parser = make_parser()
+    return parser
+
+
+def parse_xml(xml_content: bytes) -> etree._Element:
+    return etree.fromstring(xml_content, parser=get_parser())
@@ -1,6 +1,15 @@
+import itertools
+import os
+import threading
+import time
+from contextlib import contextmanager
 from pathlib import Path
-from typing import List, Optional
+from typing import Dict, Iterator, List, Optional
 from lxml import etree
+from . import syntax
+from .xml_parser import parse_xml
+
+XSD_DIR = Path(__file__).resolve().parents[2] / "data/xsd"
 
 # Map format/profile to schema files. Extend as needed.
 _SCHEMA_MAP = {
@@ -13,14 +22,166 @@ _SCHEMA_MAP = {
     # Flux 6 (CDV) approximated with Chorus Pro Statut Pivot schema
     ("cdv", "f6", None): "cpp/CPPStatutPivot_V1_19.xsd",
     ("ereporting", None, None): "3- XSD_v3.1/1 - E-reporting/ereporting.xsd",
+    ("annuaire", "f12", None): "3- XSD_v3.1/0 - Annuaire/actualisation/Annuaire_Actualisation_F12-F13.xsd",
+    ("annuaire", "f13", None): "3- XSD_v3.1/0 - Annuaire/actualisation/Annuaire_Actualisation_F12-F13.xsd",
+    ("annuaire", "f14", None): "3- XSD_v3.1/0 - Annuaire/consultation/Annuaire_Consultation_F14.xsd",
     ("annuaire", None, None): "3- XSD_v3.1/0 - Annuaire/common/Annuaire_Commun.xsd",
 }
 
+# "1"/"true"/"eager" compiles every schema of _SCHEMA_MAP at startup; anything else compiles lazily on first use.
+PRELOAD_ENV = "FE_XSD_PRELOAD"
+# Compiled instances per schema for concurrent validations (default: CPU count, at most 4)
+INSTANCES_ENV = "FE_XSD_INSTANCES"
+
+
+def preload_enabled() -> bool:
+    return os.environ.get(PRELOAD_ENV, "").strip().lower() in {"1", "true", "yes", "eager"}
+
+
+def max_instances() -> int:
+    return max(1, int(os.environ.get(INSTANCES_ENV) or min(4, os.cpu_count() or 1)))
+
+
+class _SchemaEntry:
+    """A compiled schema and the idle instances validations borrow.
+
+    lxml keeps the error log on the schema object, so one instance validates one document at
+    a time; libxml2 validates without the GIL. A validation takes an idle instance, else
+    compiles another one (up to FE_XSD_INSTANCES), else waits for one to be returned. The
+    lock covers the pool and the counters, never a validation.
+    """
+
+    __slots__ = ("path", "schema", "compile_seconds", "hits", "instances", "limit", "lock", "_idle", "_returned")
+
+    def __init__(self, path: Path, schema: etree.XMLSchema, compile_seconds: float, limit: int = 1):
+        self.path = path
+        self.schema = schema
+        self.compile_seconds = compile_seconds
+        self.hits = 0
+        self.instances = 1
+        self.limit = limit
+        self.lock = threading.Lock()
+        self._idle = [schema]
+        self._returned = threading.Condition(self.lock)
+
+    def hit(self) -> None:
+        with self.lock:
+            self.hits += 1
+
+    @contextmanager
+    def borrow(self) -> Iterator[etree.XMLSchema]:
+        with self.lock:
+            while not self._idle and self.instances >= self.limit:
+                self._returned.wait()
+            schema = self._idle.pop() if self._idle else None
+            if schema is None:
+                self.instances += 1
+        if schema is None:
+            try:
+                schema = etree.XMLSchema(etree.parse(str(self.path)))
+            except BaseException:
+                with self.lock:
+                    self.instances -= 1
+                    self._returned.notify()
+                raise
+        try:
+            yield schema
+        finally:
+            with self.lock:
+                self._idle.append(schema)
+                self._returned.notify()
+
+
+class SchemaRegistry:
+    """Cache of compiled XSD schemas, shared by the REST and MCP entry points.
+
+    Schemas are compiled once per path (under a lock, so concurrent first requests do not
+    compile the same tree twice) and reused for every subsequent validation; concurrent
+    validations add instances of a schema (see _SchemaEntry). The registry of the default
+    tree belongs to the reference snapshot (see snapshot).
+    """
 
-class XSDValidator:
     def __init__(self, base_dir: Path):
         self.base_dir = base_dir
-        self._cache = {}
+        self._entries: Dict[Path, _SchemaEntry] = {}
+        self._lock = threading.Lock()
+        self._misses = 0
+
+    def entry(self, path: Path) -> _SchemaEntry:
+        entry = self._entries.get(path)
+        if entry is None:
+            with self._lock:
+                entry = self._entries.get(path)
+                if entry is None:
+                    self._misses += 1
+                    start = time.perf_counter()
+                    schema = etree.XMLSchema(etree.parse(str(path)))
+                    entry = _SchemaEntry(path, schema, time.perf_counter() - start, max_instances())
+                    self._entries[path] = entry
+                    return entry
+        entry.hit()
+        return entry
+
+    def get(self, path: Path) -> etree.XMLSchema:
+        return self.entry(path).schema
+
+    def warm_up(self) -> Dict[str, float]:
+        """Compile every schema referenced by _SCHEMA_MAP; returns compile time per schema."""
+        timings: Dict[str, float] = {}
+        for target in sorted({t for t in _SCHEMA_MAP.values() if t}):
+            path = self.base_dir / target
+            if not path.exists():
+                continue
+            timings[target] = self.entry(path).compile_seconds
+        return timings
+
+    def stats(self) -> Dict:
+        schemas = {}
+        for path, entry in list(self._entries.items()):
+            try:
+                name = str(path.relative_to(self.base_dir))
+            except ValueError:
+                name = str(path)
+            schemas[name] = {"hits": entry.hits, "instances": entry.instances, "compileSeconds": round(entry.compile_seconds, 6)}
+        return {
+            "compiled": len(schemas),
+            "misses": self._misses,
+            "hits": sum(s["hits"] for s in schemas.values()),
+            "schemas": schemas,
+        }
+
+
+_registries: Dict[Path, SchemaRegistry] = {}
+_registries_lock = threading.Lock()
+
+
+def get_registry(base_dir: Path = XSD_DIR) -> SchemaRegistry:
+    """Return the registry for base_dir: the current reference snapshot's for the default tree, else one per tree."""
+    base_dir = Path(base_dir).resolve()
+    if base_dir == XSD_DIR:
+        from .snapshot import current
+        return current().schemas
+    registry = _registries.get(base_dir)
+    if registry is None:
+        with _registries_lock:
+            registry = _registries.setdefault(base_dir, SchemaRegistry(base_dir))
+    return registry
+
+
+def warm_up() -> Dict[str, float]:
+    """Compile every mapped schema of the default tree (startup hook, pool worker initializer)."""
+    return get_registry().warm_up()
+
+
+class XSDValidator:
+    def __init__(self, base_dir: Path = XSD_DIR, registry: Optional[SchemaRegistry] = None):
+        self.base_dir = Path(base_dir).resolve()
+        self._registry = registry
+
+    @property
+    def registry(self) -> SchemaRegistry:
+        """The given registry, else the one get_registry() resolves at call time (follows snapshot reloads)."""
+        return self._registry if self._registry is not None else get_registry(self.base_dir)
 
     def _resolve_schema(self, fmt: str, flow: Optional[str], profile: Optional[str]) -> Optional[Path]:
         key = (fmt, flow, profile)
@@ -38,26 +199,50 @@ class XSDValidator:
         return None
 
     def _get_schema(self, path: Path) -> etree.XMLSchema:
-        if path in self._cache:
-            return self._cache[path]
-        xml = etree.parse(str(path))
-        schema = etree.XMLSchema(xml)
-        self._cache[path] = schema
-        return schema
+        return self.registry.get(path)
 
-    def validate(self, xml_content: bytes, fmt: str, flow: Optional[str] = None, profile: Optional[str] = None) -> List[str]:
-        errors: List[str] = []
-        schema_path = self._resolve_schema(fmt, flow, profile)
-        if schema_path is None or not schema_path.exists():
-            errors.append(f"No schema found for format={fmt}, flow={flow}, profile={profile}")
+    def schema_path(self, fmt: str, flow: Optional[str] = None, profile: Optional[str] = None) -> Optional[Path]:
+        """Resolved schema file for format/flow/profile, or None when unmapped or missing on disk."""
+        path = self._resolve_schema(fmt, flow, profile)
+        if path is None or not path.exists():
+            return None
+        return path
+
+    @staticmethod
+    def missing_schema_error(fmt: str, flow: Optional[str], profile: Optional[str]) -> str:
+        return f"No schema found for format={fmt}, flow={flow}, profile={profile}"
+
+    def validate_tree(self, doc: etree._Element, fmt: str, flow: Optional[str] = None, profile: Optional[str] = None,
+                      limit: Optional[int] = None) -> List[str]:
+        """Validate an already parsed document against the schema mapped to format/flow/profile."""
+        return [str(e) for e in self.validate_entries(doc, fmt, flow, profile, limit)]
+
+    def validate_entries(self, doc: etree._Element, fmt: str, flow: Optional[str] = None, profile: Optional[str] = None,
+                         limit: Optional[int] = None) -> List[syntax.SyntaxEntry]:
+        """validate_tree with structured errors.
+
+        limit caps the number of error log entries kept (a broken file can log tens of thousands).
+        """
+        errors: List[syntax.SyntaxEntry] = []
+        schema_path = self.schema_path(fmt, flow, profile)
+        if schema_path is None:
+            errors.append(syntax.text(self.missing_schema_error(fmt, flow, profile)))
             return errors
         try:
-            doc = etree.fromstring(xml_content)
-            schema = self._get_schema(schema_path)
-            schema.assertValid(doc)
-        except etree.DocumentInvalid:
-            for e in schema.error_log:
-                errors.append(str(e))
-        except Exception as ex:  # pragma: no cover - unexpected parser errors
-            errors.append(str(ex))
+            with self.registry.entry(schema_path).borrow() as schema:
+                if not schema.validate(doc):
+                    log = schema.error_log
+                    for e in log if limit is None else itertools.islice(log, limit):
+                        errors.append(syntax.from_log(e))
+        except Exception as ex:  # pragma: no cover - unexpected schema errors
+            errors.append(syntax.from_exception(ex))
         return errors
+
+    def validate(self, xml_content: bytes, fmt: str, flow: Optional[str] = None, profile: Optional[str] = None) -> List[str]:
+        if self.schema_path(fmt, flow, profile) is None:
+            return [self.missing_schema_error(fmt, flow, profile)]
+        try:
+            doc = parse_xml(xml_content)
+        except Exception as ex:
+            return [str(ex)]
+        return self.validate_tree(doc, fmt, flow, profile)
@@ -0,0 +1,57 @@
+"""pytest-benchmark cases for the validation pipeline on synthetic documents.
+
+    pip install pytest pytest-benchmark
+    pytest benchmarks --benchmark-autosave            # then --benchmark-compare to diff runs
+
+scripts/bench.py covers larger documents, percentiles and peak RSS per stage.
+"""
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "scripts"))
+os.environ.setdefault("FE_RESULT_CACHE", "0")
+
+import synthetic  # noqa: E402
+from app.services import pipeline, rules_engine  # noqa: E402
+
+CASES = [(kind, lines) for kind in sorted(synthetic.KINDS) for lines in (1, 1000)]
+
+
+def _document(kind, lines):
+    data, fmt, flow, profile = synthetic.generate(kind, lines)
+    pipeline.validate_bytes(synthetic.generate(kind, 1)[0], fmt, flow, profile)  # schema compiled outside the timing
+    return data, fmt, flow, profile
+
+
+@pytest.mark.parametrize("kind,lines", CASES)
+def test_pipeline(benchmark, kind, lines):
+    data, fmt, flow, profile = _document(kind, lines)
+    result = benchmark(pipeline.get_pipeline().run, data, fmt, flow, profile)
+    assert not result.syntax and not result.rules
+
+
+@pytest.mark.parametrize("kind,lines", CASES)
+def test_parse(benchmark, kind, lines):
+    data = _document(kind, lines)[0]
+    benchmark(pipeline.parse_xml, data)
+
+
+@pytest.mark.parametrize("kind,lines", CASES)
+def test_xsd(benchmark, kind, lines):
+    data, fmt, flow, profile = _document(kind, lines)
+    root = pipeline.parse_xml(data)
+    benchmark(pipeline.get_pipeline().validator.validate_tree, root, fmt, flow, profile)
+
+
+@pytest.mark.parametrize("kind,lines", CASES)
+def test_rules(benchmark, kind, lines):
+    data, fmt, flow, _ = _document(kind, lines)
+    root = pipeline.parse_xml(data)
+    benchmark(rules_engine.evaluate_tree, root, fmt, flow)
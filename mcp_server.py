@@ -10,8 +10,9 @@ Modes:
 """
 import sys
 import json
-import base64
+import asyncio
 import argparse
+import time
 from pathlib import Path
 from typing import Optional
 
@@ -22,8 +23,11 @@ from mcp.types import Tool, TextContent
 # Add app to path
 sys.path.insert(0, str(Path(__file__).parent))
 
-from app.services.xsd_validator import XSDValidator
-from app.services import rules_engine
+from app.models.schemas import BatchDocument
+from app.services import batch, identifiers, metrics, result_cache, schematron, snapshot, warmup
+from app.services.executor import ToolExecutor, ToolTimeout
+from app.services.pipeline import PayloadError, report_result, validate_payload
+from app.services.xsd_validator import get_registry, preload_enabled, warm_up
 from app.routers import reference
 
 DATA_DIR = Path(__file__).parent / "data"
@@ -31,23 +35,15 @@ XSD_DIR = DATA_DIR / "xsd"
 
 server = Server("fe-compliance")
 
-
-def extract_facturx_xml(pdf_bytes: bytes) -> bytes:
-    """Extract embedded XML from Factur-X PDF."""
-    if not pdf_bytes.startswith(b"%PDF"):
-        raise ValueError("Payload is not a PDF (missing %PDF header)")
-    start = pdf_bytes.find(b"<?xml")
-    if start == -1:
-        raise ValueError("No embedded XML found in Factur-X payload")
-    end = -1
-    for marker in [b"</rsm:CrossIndustryInvoice>", b"</Invoice>"]:
-        idx = pdf_bytes.find(marker, start)
-        if idx != -1:
-            end = idx + len(marker)
-            break
-    if end == -1:
-        end = len(pdf_bytes)
-    return pdf_bytes[start:end]
+# CPU-bound tools run off the event loop so one large document cannot stall other SSE sessions.
+# Process workers (FE_MCP_EXECUTOR=process) compile the schemas once at start-up and are
+# replaced when a new reference snapshot is published.
+tool_executor = ToolExecutor.from_env(initializer=warm_up)
+snapshot.on_publish(tool_executor.recycle)
+metrics.register_gauge("fe_executor_queue_depth", "MCP tool calls waiting for a worker.",
+                       lambda: {(): tool_executor.queue_depth()})
+metrics.register_gauge("fe_executor_running", "MCP tool calls running, by tool.",
+                       lambda: {(("tool", k),): v for k, v in tool_executor.stats()["running"].items()})
 
 
 @server.list_tools()
@@ -62,8 +58,8 @@ async def list_tools():
                 "properties": {
                     "format": {
                         "type": "string",
-                        "description": "Invoice format: ubl, cii, facturx, cdv, ereporting, annuaire",
-                        "enum": ["ubl", "cii", "facturx", "cdv", "ereporting", "annuaire"]
+                        "description": "Invoice format: auto (detected from the document, default), ubl, creditnote-ubl, cii, facturx, cdv, ereporting, annuaire",
+                        "enum": ["auto", "ubl", "creditnote-ubl", "cii", "facturx", "cdv", "ereporting", "annuaire"]
                     },
                     "payload": {
                         "type": "string",
@@ -78,9 +74,40 @@ async def list_tools():
                         "type": "string",
                         "description": "Profile: base or full",
                         "enum": ["base", "full"]
+                    },
+                    "schematron": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "description": "Optional Schematron rule sets to run as well, e.g. en16931-cii or en16931-ubl"
+                    }
+                },
+                "required": ["payload"]
+            }
+        ),
+        Tool(
+            name="validate_batch",
+            description="Validate many documents at once (spread over worker processes). Returns one report per document plus an aggregate summary.",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "documents": {
+                        "type": "array",
+                        "description": "Documents to validate, each with the same fields as validate_invoice plus an optional name",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "name": {"type": "string"},
+                                "format": {"type": "string", "enum": ["auto", "ubl", "creditnote-ubl", "cii", "facturx", "cdv", "ereporting", "annuaire"]},
+                                "payload": {"type": "string"},
+                                "flow": {"type": "string", "enum": ["f1", "f6", "f10", "f13", "f14"]},
+                                "profile": {"type": "string", "enum": ["base", "full"]},
+                                "schematron": {"type": "array", "items": {"type": "string"}}
+                            },
+                            "required": ["payload"]
+                        }
                     }
                 },
-                "required": ["format", "payload"]
+                "required": ["documents"]
             }
         ),
         Tool(
@@ -196,6 +223,26 @@ async def list_tools():
                 "type": "object",
                 "properties": {}
             }
+        ),
+        Tool(
+            name="validate_identifiers",
+            description="Validate many SIREN, SIRET or French VAT numbers (digits, Luhn key, VAT key). Returns counts and one result code per identifier, in order, as a string.",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "identifiers": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "description": "Identifiers to validate (spaces ignored)"
+                    },
+                    "kind": {
+                        "type": "string",
+                        "enum": list(identifiers.KINDS),
+                        "description": "Identifier kind; auto: FR prefix -> VAT, 14 characters -> SIRET, else SIREN"
+                    }
+                },
+                "required": ["identifiers"]
+            }
         )
     ]
 
@@ -205,70 +252,67 @@ async def call_tool(name: str, arguments: dict):
     """Handle tool invocations."""
 
     if name == "validate_invoice":
-        fmt = arguments.get("format", "ubl")
+        fmt = arguments.get("format", "auto")
         payload = arguments.get("payload", "")
         flow = arguments.get("flow")
         profile = arguments.get("profile")
+        rule_sets = tuple(arguments.get("schematron") or ())
 
-        # Decode payload
+        # Process workers keep their own metrics: record the call here instead.
+        in_process = tool_executor.kind == "process"
+        start = time.perf_counter()
         try:
-            stripped = payload.strip()
-            if stripped.startswith("<") or stripped.startswith("\ufeff<"):
-                xml_bytes = stripped.encode("utf-8")
-            else:
-                xml_bytes = base64.b64decode(payload)
-        except Exception as e:
-            return [TextContent(type="text", text=json.dumps({"error": f"Invalid payload encoding: {e}"}))]
-
-        fmt_for_schema = fmt
-        fmt_for_rules = fmt
-
-        # Handle Factur-X
-        if fmt.lower() == "facturx":
-            try:
-                xml_bytes = extract_facturx_xml(xml_bytes)
-                fmt_for_schema = "cii"
-                fmt_for_rules = "cii"
-            except Exception as e:
-                return [TextContent(type="text", text=json.dumps({"error": f"Failed to extract Factur-X XML: {e}"}))]
-
-        # XSD validation
-        validator = XSDValidator(base_dir=XSD_DIR)
-        syntax_errors = validator.validate(xml_bytes, fmt_for_schema, flow, profile)
-
-        # Business rules
-        rule_issues, codelist_issues = rules_engine.evaluate(xml_bytes, fmt_for_rules, flow)
+            schematron.check_rule_sets(rule_sets)
+            report = await tool_executor.run("validate_invoice", validate_payload, payload, fmt, flow, profile, rule_sets)
+        except (PayloadError, schematron.UnknownRuleSet, ToolTimeout) as e:
+            if in_process:
+                metrics.observe_request(fmt, flow, profile, "error", time.perf_counter() - start)
+            return [TextContent(type="text", text=json.dumps({"error": str(e)}))]
+        if in_process:
+            metrics.observe_request(fmt, flow, profile, report_result(report), time.perf_counter() - start, len(payload))
 
         result = {
-            "syntax": syntax_errors,
-            "rules": [{"ruleId": r.ruleId, "severity": r.severity, "xpath": r.xpath, "message": r.message} for r in rule_issues],
-            "codelists": [{"ruleId": r.ruleId, "severity": r.severity, "xpath": r.xpath, "message": r.message} for r in codelist_issues]
+            "syntax": report.syntax,
+            "rules": [{"ruleId": r.ruleId, "severity": r.severity, "xpath": r.xpath, "message": r.message} for r in report.rules],
+            "codelists": [{"ruleId": r.ruleId, "severity": r.severity, "xpath": r.xpath, "message": r.message} for r in report.codelists],
+            "snapshotVersion": report.snapshotVersion,
         }
         return [TextContent(type="text", text=json.dumps(result, ensure_ascii=False, indent=2))]
 
+    elif name == "validate_batch":
+        try:
+            documents = [BatchDocument(**doc) for doc in arguments.get("documents", [])]
+            response = await tool_executor.run("validate_batch", batch.run_batch, batch.items_from_requests(documents), cpu=False)
+        except (ValueError, TypeError, ToolTimeout) as e:
+            return [TextContent(type="text", text=json.dumps({"error": str(e)}))]
+        return [TextContent(type="text", text=json.dumps(response.model_dump(mode="json"), ensure_ascii=False))]
+
     elif name == "get_codelist":
         codelist_name = arguments.get("name", "")
-        if codelist_name not in reference.CODELISTS:
+        codelist = snapshot.current().codelist_index.get(codelist_name)
+        if codelist is None:
             return [TextContent(type="text", text=json.dumps({"error": f"Codelist '{codelist_name}' not found"}))]
-        return [TextContent(type="text", text=json.dumps(reference.CODELISTS[codelist_name], ensure_ascii=False, indent=2))]
+        return [TextContent(type="text", text=codelist.body.decode("utf-8"))]
 
     elif name == "get_required_fields":
         profile = arguments.get("profile", "base")
         flow = arguments.get("flow", "f1")
         key = (profile, flow)
-        if key not in reference.REQUIRED_FIELDS:
+        required_fields = snapshot.current().required_fields
+        if key not in required_fields:
             return [TextContent(type="text", text=json.dumps({"error": f"No required fields for profile={profile}, flow={flow}"}))]
-        return [TextContent(type="text", text=json.dumps(reference.REQUIRED_FIELDS[key], indent=2))]
+        return [TextContent(type="text", text=json.dumps(required_fields[key], indent=2))]
 
     elif name == "get_rule":
         rule_id = arguments.get("rule_id", "")
-        if rule_id not in reference.RULES:
+        rules = snapshot.current().rules
+        if rule_id not in rules:
             return [TextContent(type="text", text=json.dumps({"error": f"Rule '{rule_id}' not found"}))]
-        rule = reference.RULES[rule_id]
+        rule = rules[rule_id]
         return [TextContent(type="text", text=json.dumps({"id": rule_id, **rule}, ensure_ascii=False, indent=2))]
 
     elif name == "get_refusal_codes":
-        codes = reference.CODELISTS.get("CDV_REFUS", [])
+        codes = snapshot.current().codelists.get("CDV_REFUS", [])
         return [TextContent(type="text", text=json.dumps(codes, ensure_ascii=False, indent=2))]
 
     elif name == "get_next_status":
@@ -287,7 +331,7 @@ async def call_tool(name: str, arguments: dict):
         required_formats = {"ubl", "cii"}
         required_profiles = {"base", "full"}
         required_cdv = {"CDV-200", "CDV-202", "CDV-203", "CDV-205", "CDV-207", "CDV-211", "CDV-212", "CDV-213", "CDV-220"}
-        required_cadres = set(reference.CODELISTS.get("CADRES", []))
+        required_cadres = set(snapshot.current().codelists.get("CADRES", []))
 
         result = {
             "missingFormats": list(required_formats - formats),
@@ -305,7 +349,15 @@ async def call_tool(name: str, arguments: dict):
         return [TextContent(type="text", text=json.dumps(result, ensure_ascii=False, indent=2))]
 
     elif name == "list_available_codelists":
-        return [TextContent(type="text", text=json.dumps(list(reference.CODELISTS.keys()), indent=2))]
+        return [TextContent(type="text", text=json.dumps(list(snapshot.current().codelists.keys()), indent=2))]
+
+    elif name == "validate_identifiers":
+        try:
+            result = await tool_executor.run("validate_identifiers", identifiers.validate_report,
+                                             list(arguments.get("identifiers", [])), arguments.get("kind", "auto"))
+        except (ValueError, TypeError, ToolTimeout) as e:
+            return [TextContent(type="text", text=json.dumps({"error": str(e)}))]
+        return [TextContent(type="text", text=json.dumps(result, ensure_ascii=False))]
 
     return [TextContent(type="text", text=json.dumps({"error": f"Unknown tool: {name}"}))]
 
@@ -316,10 +368,11 @@ async def call_tool(name: str, arguments: dict):
 
 def create_sse_app():
     """Create Starlette app with SSE transport for remote MCP access."""
+    from contextlib import asynccontextmanager
     from mcp.server.sse import SseServerTransport
     from starlette.applications import Starlette
     from starlette.routing import Route, Mount
-    from starlette.responses import JSONResponse
+    from starlette.responses import JSONResponse, PlainTextResponse
 
     sse = SseServerTransport("/messages/")
 
@@ -331,12 +384,36 @@ def create_sse_app():
         return await sse.handle_post_message(request.scope, request.receive, request._send)
 
     async def health(request):
-        return JSONResponse({"status": "ok", "server": "fe-compliance", "mode": "sse"})
+        return JSONResponse({"status": "ok", "server": "fe-compliance", "mode": "sse", "schemas": get_registry(XSD_DIR).stats()["compiled"], "executor": tool_executor.stats(), "resultCache": result_cache.stats(), "snapshot": snapshot.current().version})
+
+    async def ready(request):
+        status = warmup.status()
+        return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+    async def metrics_route(request):
+        if not metrics.ENABLED:
+            return PlainTextResponse("Metrics disabled (FE_METRICS=0)", status_code=404)
+        return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+    @asynccontextmanager
+    async def lifespan(app):
+        if not warmup.is_ready():
+            if preload_enabled():
+                warmup.run()
+            else:
+                warmup.mark_ready()
+        snapshot.start_watcher()
+        yield
+        snapshot.stop_watcher()
+        tool_executor.shutdown()
 
     return Starlette(
         debug=True,
+        lifespan=lifespan,
         routes=[
             Route("/", endpoint=health),
+            Route("/ready", endpoint=ready),
+            Route("/metrics", endpoint=metrics_route),
             Route("/sse", endpoint=handle_sse),
             Route("/messages/", endpoint=handle_messages, methods=["POST"]),
         ]
@@ -353,6 +430,8 @@ app = create_sse_app()
 
 async def run_stdio():
     """Run MCP server in stdio mode (local)."""
+    if preload_enabled():
+        get_registry(XSD_DIR).warm_up()
     async with stdio_server() as (read_stream, write_stream):
         await server.run(read_stream, write_stream, server.create_initialization_options())
 
@@ -372,8 +451,6 @@ def main():
     parser.add_argument("--port", type=int, default=8001, help="Port for SSE mode (default: 8001)")
     args = parser.parse_args()
 
-    import asyncio
-
     if args.sse:
         print(f"Starting MCP server in SSE mode on {args.host}:{args.port}")
         print(f"  - Health check: http://{args.host}:{args.port}/")
@@ -0,0 +1,213 @@
+"""Benchmark the validation pipeline on synthetic documents (see scripts/synthetic.py).
+
+Each case (document kind x line count) runs in a fresh spawned process so its peak RSS is
+its own. The case first validates a 1-line document of the same kind so schema compilation
+is excluded, then runs every stage once in order (decode, parse, xsd, rules) and records
+the peak RSS reached after each one, then times --repeat full runs. Results are written as
+JSON; --compare prints the p50/p99 change against an earlier results file.
+
+Usage:
+    python scripts/bench.py --lines 1 1000 100000 --out bench.json
+    python scripts/bench.py --kinds ubl-full cii-full --compare bench.json --out bench-new.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "scripts"))
+
+import synthetic  # noqa: E402
+
+STAGES = ("decode", "parse", "xsd", "rules")
+DEFAULT_LINES = (1, 100, 10_000)
+
+
+def _peak_rss_kib() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak  # bytes on macOS, KiB elsewhere
+
+
+def _percentile(samples: List[float], pct: float) -> float:
+    """Nearest-rank percentile."""
+    ordered = sorted(samples)
+    return ordered[max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered) + 0.5) - 1))]
+
+
+def _summary(samples: List[float], size: int) -> Dict:
+    mean = statistics.fmean(samples)
+    return {
+        "p50Ms": round(_percentile(samples, 50) * 1000, 4),
+        "p99Ms": round(_percentile(samples, 99) * 1000, 4),
+        "meanMs": round(mean * 1000, 4),
+        "docsPerSecond": round(1 / mean, 2) if mean else None,
+        "mbPerSecond": round(size / 1e6 / mean, 2) if mean else None,
+    }
+
+
+def _run_stages(text: str, fmt: str, flow: Optional[str], profile: Optional[str]) -> Dict[str, float]:
+    from app.services import pipeline, rules_engine
+
+    timings = {}
+    start = time.perf_counter()
+    data = pipeline.decode_payload(text)
+    timings["decode"] = time.perf_counter() - start
+    start = time.perf_counter()
+    root = pipeline.parse_xml(data)
+    timings["parse"] = time.perf_counter() - start
+    start = time.perf_counter()
+    pipeline.get_pipeline().validator.validate_tree(root, fmt, flow, profile)
+    timings["xsd"] = time.perf_counter() - start
+    start = time.perf_counter()
+    rules_engine.evaluate_tree(root, fmt, flow)
+    timings["rules"] = time.perf_counter() - start
+    return timings
+
+
+def run_case(kind: str, lines: int, repeat: int) -> Dict:
+    """Benchmark one case in the current process; meant to run in a fresh one."""
+    os.environ["FE_RESULT_CACHE"] = "0"
+    os.environ["FE_METRICS"] = "0"
+    from app.services import pipeline, rules_engine
+
+    warm, fmt, flow, profile = synthetic.generate(kind, 1)
+    report = pipeline.validate_bytes(warm, fmt, flow, profile)  # compiles the schema and the rulebook
+
+    data = synthetic.generate(kind, lines)[0]
+    text = data.decode("utf-8")
+    rss = {"start": _peak_rss_kib()}
+    # First pass, stage by stage: the growth of the high-water mark after each stage is its peak RSS.
+    root = None
+    for stage in STAGES:
+        if stage == "decode":
+            payload = pipeline.decode_payload(text)
+        elif stage == "parse":
+            root = pipeline.parse_xml(payload)
+        elif stage == "xsd":
+            syntax = pipeline.get_pipeline().validator.validate_tree(root, fmt, flow, profile)
+        else:
+            rules, codelists = rules_engine.evaluate_tree(root, fmt, flow)
+        rss[stage] = _peak_rss_kib()
+    del root, payload
+
+    samples: Dict[str, List[float]] = {stage: [] for stage in STAGES}
+    totals: List[float] = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        timings = _run_stages(text, fmt, flow, profile)
+        totals.append(time.perf_counter() - start)
+        for stage, seconds in timings.items():
+            samples[stage].append(seconds)
+
+    previous = rss["start"]
+    stages = {}
+    for stage in STAGES:
+        stages[stage] = {**_summary(samples[stage], len(data)), "peakRssDeltaKiB": rss[stage] - previous}
+        previous = rss[stage]
+    return {
+        "kind": kind,
+        "format": fmt,
+        "flow": flow,
+        "profile": profile,
+        "lines": lines,
+        "bytes": len(data),
+        "repeat": repeat,
+        "issues": {"syntax": len(syntax), "rules": len(rules), "codelists": len(codelists), "warmup": len(report.syntax)},
+        "total": _summary(totals, len(data)),
+        "stages": stages,
+        "peakRssKiB": _peak_rss_kib(),
+    }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _default_repeat(lines: int) -> int:
+    return 50 if lines <= 1000 else 10 if lines <= 10_000 else 3
+
+
+def compare(baseline: Dict, current: Dict) -> List[str]:
+    """One line per case and stage found in both runs: p50/p99 now, and the change in %."""
+    previous = {(c["kind"], c["lines"]): c for c in baseline.get("cases", [])}
+    rows = []
+    for case in current["cases"]:
+        old = previous.get((case["kind"], case["lines"]))
+        if old is None:
+            continue
+        for stage in ("total",) + STAGES:
+            new_stats = case["total"] if stage == "total" else case["stages"][stage]
+            old_stats = old["total"] if stage == "total" else old["stages"].get(stage)
+            if not old_stats:
+                continue
+            deltas = []
+            for key in ("p50Ms", "p99Ms"):
+                before, after = old_stats[key], new_stats[key]
+                deltas.append(f"{key[:3]} {after:10.3f} ms ({(after - before) / before * 100:+6.1f} %)" if before else f"{key[:3]} {after:10.3f} ms")
+            rows.append(f"{case['kind']:<11} {case['lines']:>7} {stage:<6} " + "  ".join(deltas))
+    return rows
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--kinds", nargs="+", choices=sorted(synthetic.KINDS), default=sorted(synthetic.KINDS))
+    parser.add_argument("--lines", nargs="+", type=int, default=list(DEFAULT_LINES))
+    parser.add_argument("--repeat", type=int, help="Timed runs per case (default: 50, 10 or 3 depending on size)")
+    parser.add_argument("--out", type=Path, help="Write JSON results to this file (stdout when omitted)")
+    parser.add_argument("--compare", type=Path, help="Earlier results file to diff against")
+    parser.add_argument("--in-process", action="store_true", help="Run cases in this process (peak RSS then accumulates)")
+    args = parser.parse_args()
+
+    cases = []
+    context = multiprocessing.get_context("spawn")
+    for kind in args.kinds:
+        for lines in args.lines:
+            repeat = args.repeat or _default_repeat(lines)
+            if args.in_process:
+                result = run_case(kind, lines, repeat)
+            else:
+                with context.Pool(1) as pool:
+                    result = pool.apply(run_case, (kind, lines, repeat))
+            cases.append(result)
+            print(f"{kind:<11} {lines:>7} lines  p50 {result['total']['p50Ms']:10.3f} ms  p99 {result['total']['p99Ms']:10.3f} ms  "
+                  f"peak RSS {result['peakRssKiB'] / 1024:8.1f} MiB", file=sys.stderr)
+
+    import lxml.etree
+
+    results = {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": platform.python_version(),
+            "lxml": lxml.etree.__version__,
+            "libxml2": ".".join(map(str, lxml.etree.LIBXML_VERSION)),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "cases": cases,
+    }
+    text = json.dumps(results, indent=2)
+    if args.out:
+        args.out.write_text(text + "\n", encoding="utf-8")
+    else:
+        print(text)
+    if args.compare:
+        for row in compare(json.loads(args.compare.read_text(encoding="utf-8")), results):
+            print(row, file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,27 @@
-"""Convert annexes XLSX into JSON caches for rules/codelists.
+"""Convert annexes XLSX into JSON caches for rules/codelists, then compile the reference store.
 
 Usage:
     python scripts/build_annex_cache.py --src ../specifications-externes-v3.1/2-\ Annexes_v3.1 --out ../MCP/data/annexes_cache
+    python scripts/build_annex_cache.py --store-only --out data/annexes_cache_embedded
 
 Notes:
-- Requires openpyxl.
+- Requires openpyxl (not needed with --store-only).
 - Currently extracts sheet headers and rows as-is; tailor extractors per annex.
+- The JSON caches are then reduced to reference_store.json (see app/services/annex_store.py),
+  the single file the service reads at startup.
 """
 
 import argparse
 import json
+import sys
 from pathlib import Path
 from typing import Any
-import openpyxl
 from datetime import datetime, date
 
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.services import annex_store  # noqa: E402
+
 
 def serialize_cell(val: Any) -> Any:
     if isinstance(val, (datetime, date)):
@@ -23,6 +30,8 @@ def serialize_cell(val: Any) -> Any:
 
 
 def load_workbook(path: Path) -> dict[str, Any]:
+    import openpyxl
+
     wb = openpyxl.load_workbook(path, data_only=True)
     data = {}
     for sheet in wb.sheetnames:
@@ -36,18 +45,26 @@ def load_workbook(path: Path) -> dict[str, Any]:
 
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument("--src", type=Path, required=True, help="Directory containing annex XLSX")
+    parser.add_argument("--src", type=Path, help="Directory containing annex XLSX")
     parser.add_argument("--out", type=Path, required=True, help="Output directory for JSON cache")
+    parser.add_argument("--store-only", action="store_true", help="Only recompile reference_store.json from the JSON caches in --out")
     args = parser.parse_args()
 
-    args.out.mkdir(parents=True, exist_ok=True)
+    if not args.store_only:
+        if args.src is None:
+            parser.error("--src is required unless --store-only is given")
+        args.out.mkdir(parents=True, exist_ok=True)
+        for xlsx in args.src.glob("*.xlsx"):
+            content = load_workbook(xlsx)
+            out_path = args.out / f"{xlsx.stem}.json"
+            with out_path.open("w", encoding="utf-8") as f:
+                json.dump(content, f, ensure_ascii=False, indent=2)
+            print(f"Wrote {out_path}")
 
-    for xlsx in args.src.glob("*.xlsx"):
-        content = load_workbook(xlsx)
-        out_path = args.out / f"{xlsx.stem}.json"
-        with out_path.open("w", encoding="utf-8") as f:
-            json.dump(content, f, ensure_ascii=False, indent=2)
-        print(f"Wrote {out_path}")
+    store = annex_store.build_store(args.out)
+    store_path = args.out / annex_store.STORE_NAME
+    annex_store.write_store(store, store_path)
+    print(f"Wrote {store_path} (content {store['contentHash'][:12]})")
 
 
 if __name__ == "__main__":
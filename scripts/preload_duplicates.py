@@ -0,0 +1,78 @@
+"""Preload the duplicate invoice index (DOUBLE_FACT) from historical data.
+
+Sources are CSV files with a seller,number,issueDate header (issueDate AAAA-MM-JJ, AAAAMMJJ
+or the year alone) and UBL/CII invoices (.xml files, or directories searched recursively).
+Keys are streamed into the SQLite database in transactions of duplicates.BATCH_SIZE rows,
+so millions of rows load with flat memory; keys already recorded are skipped. Running
+services pick the new rows up within FE_DUPLICATE_REFRESH seconds.
+
+Usage:
+    python scripts/preload_duplicates.py --db /var/lib/fe/duplicates.sqlite3 factures-2024.csv archives/2025/
+"""
+import argparse
+import csv
+import sys
+import time
+from pathlib import Path
+from typing import Iterable, Iterator
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.services import detect, duplicates  # noqa: E402
+from app.services.xml_parser import parse_xml  # noqa: E402
+
+
+def _files(paths: Iterable[Path]) -> Iterator[Path]:
+    for path in paths:
+        if path.is_dir():
+            yield from sorted(p for p in path.rglob("*") if p.suffix.lower() in {".csv", ".xml"})
+        else:
+            yield path
+
+
+def keys_from_csv(path: Path) -> Iterator[duplicates.DuplicateKey]:
+    with path.open(newline="", encoding="utf-8-sig") as fh:
+        for row in csv.DictReader(fh):
+            if row.get("seller") and row.get("number") and row.get("issueDate"):
+                yield duplicates.DuplicateKey.of(row["seller"], row["number"], row["issueDate"])
+
+
+def key_from_xml(path: Path):
+    data = path.read_bytes()
+    try:
+        fmt = detect.detect(data).format
+        return duplicates.key_from_tree(parse_xml(data), fmt)
+    except Exception:
+        return None
+
+
+def keys(paths: Iterable[Path], skipped: list) -> Iterator[duplicates.DuplicateKey]:
+    for path in _files(paths):
+        if path.suffix.lower() == ".csv":
+            yield from keys_from_csv(path)
+            continue
+        key = key_from_xml(path)
+        if key is None:
+            skipped.append(path)
+        else:
+            yield key
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("sources", nargs="+", type=Path, help="CSV files, XML invoices or directories")
+    parser.add_argument("--db", required=True, help=f"SQLite database (the services read ${duplicates.DB_ENV})")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    # Writer only: no Bloom filter to fill
+    index = duplicates.DuplicateIndex(args.db, capacity=0, refresh=0)
+    skipped: list = []
+    added = index.add_many(keys(args.sources, skipped))
+    for path in skipped:
+        print(f"[preload] skipped {path}: not an F1 UBL/CII invoice with seller, number and issue date", file=sys.stderr)
+    print(f"[preload] {added} new keys, {index.count()} in {args.db} ({time.perf_counter() - start:.1f}s)")
+
+
+if __name__ == "__main__":
+    main()
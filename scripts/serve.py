@@ -0,0 +1,154 @@
+"""Pre-fork launcher: warm up once in the master, then fork the uvicorn workers.
+
+`uvicorn --workers N` spawns fresh interpreters, so each worker re-reads the reference data
+and recompiles every schema (seconds of start-up and tens of MB each). This launcher imports
+the app and runs warmup.run(freeze=True) in the master, binds the socket, then forks the
+workers: they start warm and share the compiled schemas and reference indexes copy-on-write.
+The automatic GC stays off in the master until the fork (as the gc.freeze() docs advise) and
+is re-enabled in each worker. A worker that dies is re-forked from the warm master;
+SIGTERM/SIGINT stop the workers (graceful uvicorn shutdown) and then the master. SIGHUP
+reloads the reference snapshot in the master (so later forks start on it) and in every
+worker (see app.services.snapshot). FE_WORKERS and FE_STATE_DIR (a temporary directory
+removed at exit, unless set) are exported so that run-time state is shared by the workers
+(see app.services.workers).
+
+Usage:
+    python scripts/serve.py --workers 4 --port 8000
+    python scripts/serve.py --app mcp_server:app --port 8001
+"""
+import argparse
+import gc
+import os
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+# Exported to the workers (see app.services.workers)
+WORKERS_ENV = "FE_WORKERS"
+STATE_DIR_ENV = "FE_STATE_DIR"
+
+
+def _bind(host: str, port: int, backlog: int) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _worker(app, sock: socket.socket, args) -> None:
+    import uvicorn
+    from app.services import snapshot
+
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGHUP, lambda signum, frame: snapshot.reload_in_background())
+    gc.enable()
+    config = uvicorn.Config(app, log_level=args.log_level, timeout_keep_alive=args.keep_alive)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def _fork(app, sock: socket.socket, args) -> int:
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            _worker(app, sock, args)
+        except BaseException:
+            code = 1
+        os._exit(code)
+    return pid
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--app", default="app.main:app", help="ASGI app import string (default: app.main:app)")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=int(os.environ.get(WORKERS_ENV) or os.cpu_count() or 1),
+                        help=f"number of workers (default: ${WORKERS_ENV} or the CPU count)")
+    parser.add_argument("--backlog", type=int, default=2048)
+    parser.add_argument("--keep-alive", type=int, default=5)
+    parser.add_argument("--log-level", default="info")
+    parser.add_argument("--no-freeze", action="store_true", help="skip gc.freeze() after the warm-up")
+    args = parser.parse_args()
+    os.environ[WORKERS_ENV] = str(max(1, args.workers))
+    state_dir = None
+    if not os.environ.get(STATE_DIR_ENV):
+        state_dir = os.environ[STATE_DIR_ENV] = tempfile.mkdtemp(prefix="fe-state-")
+
+    from uvicorn.importer import import_from_string
+
+    gc.disable()
+    app = import_from_string(args.app)
+    from app.services import snapshot, warmup
+
+    timings = warmup.run(freeze=not args.no_freeze)
+    print(f"[serve] warm-up {warmup.status()['warmUpSeconds']}s {timings}, "
+          f"{warmup.status()['frozenObjects']} objects frozen", flush=True)
+    sock = _bind(args.host, args.port, args.backlog)
+
+    workers: Dict[int, float] = {}
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def reload(signum, frame):
+        try:
+            print(f"[serve] reload {snapshot.reload()}", flush=True)
+        except Exception as exc:
+            print(f"[serve] reload failed, keeping {snapshot.current().version}: {exc}", flush=True)
+        if not args.no_freeze:
+            gc.collect()
+            gc.freeze()
+        for pid in list(workers):
+            try:
+                os.kill(pid, signal.SIGHUP)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGHUP, reload)
+    for _ in range(max(1, args.workers)):
+        workers[_fork(app, sock, args)] = time.monotonic()
+    print(f"[serve] {len(workers)} workers on {args.host}:{args.port} (pids {sorted(workers)})", flush=True)
+
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        started = workers.pop(pid, None)
+        if started is None or stopping:
+            continue
+        print(f"[serve] worker {pid} exited ({os.waitstatus_to_exitcode(status)}), re-forking", flush=True)
+        if time.monotonic() - started < 1:
+            time.sleep(1)  # do not spin on a worker that dies at start-up
+        workers[_fork(app, sock, args)] = time.monotonic()
+    sock.close()
+    if state_dir is not None:
+        shutil.rmtree(state_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
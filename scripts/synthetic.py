@@ -0,0 +1,203 @@
+"""Synthetic documents for benchmarks: UBL/CII F1 invoices, CDV status messages, e-reporting.
+
+Documents are schema-valid against the XSD mapped for their format/flow/profile and pass the
+F1 business rules, so timings are not skewed by error reporting. Line counts go from 1 to
+100k; the text is built with str.join, so generating a 100k-line invoice takes well under a
+second.
+
+Usage:
+    python scripts/synthetic.py --kind ubl --lines 1000 --out /tmp/ubl-1000.xml
+"""
+import argparse
+import sys
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple
+
+UBL_NS = (
+    'xmlns="urn:oasis:names:specification:ubl:schema:xsd:Invoice-2" '
+    'xmlns:cac="urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2" '
+    'xmlns:cbc="urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2"'
+)
+CII_NS = (
+    'xmlns:rsm="urn:un:unece:uncefact:data:standard:CrossIndustryInvoice:100" '
+    'xmlns:ram="urn:un:unece:uncefact:data:standard:ReusableAggregateBusinessInformationEntity:100" '
+    'xmlns:udt="urn:un:unece:uncefact:data:standard:UnqualifiedDataType:100"'
+)
+MAX_LINES = 100_000
+
+
+def _amounts(lines: int) -> Tuple[str, str, str]:
+    """(line amount, total excl. VAT, VAT) with every line at 10.00 and 20 % VAT."""
+    total = 10 * lines
+    return "10.00", f"{total:.2f}", f"{total * 0.2:.2f}"
+
+
+def _vat(siren: str) -> str:
+    """French VAT number of a SIREN (FR + key + SIREN)."""
+    return f"FR{(12 + 3 * (int(siren) % 97)) % 97:02d}{siren}"
+
+
+def _party_ubl(role: str, siren: str) -> str:
+    return (
+        f"<cac:{role}><cac:Party>"
+        f"<cac:PostalAddress><cac:Country><cbc:IdentificationCode>FR</cbc:IdentificationCode></cac:Country></cac:PostalAddress>"
+        f"<cac:PartyTaxScheme><cbc:CompanyID>{_vat(siren)}</cbc:CompanyID><cac:TaxScheme><cbc:ID>VAT</cbc:ID></cac:TaxScheme></cac:PartyTaxScheme>"
+        f'<cac:PartyLegalEntity><cbc:CompanyID schemeID="0002">{siren}</cbc:CompanyID></cac:PartyLegalEntity>'
+        f"</cac:Party></cac:{role}>"
+    )
+
+
+def ubl_invoice(lines: int = 1, profile: str = "base") -> bytes:
+    """F1 UBL invoice; as in CII, F1 Base has no invoice lines and each line is a VAT breakdown row instead."""
+    line_amount, total, vat = _amounts(lines)
+    subtotal = (
+        '<cac:TaxSubtotal><cbc:TaxableAmount currencyID="EUR">{basis}</cbc:TaxableAmount>'
+        '<cbc:TaxAmount currencyID="EUR">{vat}</cbc:TaxAmount><cac:TaxCategory><cbc:ID>S</cbc:ID><cbc:Percent>20</cbc:Percent>'
+        "<cac:TaxScheme><cbc:ID>VAT</cbc:ID></cac:TaxScheme></cac:TaxCategory></cac:TaxSubtotal>"
+    )
+    subtotals = subtotal.format(basis=total, vat=vat) if profile == "full" else subtotal.format(basis=line_amount, vat="2.00") * lines
+    head = (
+        f'<?xml version="1.0" encoding="UTF-8"?>\n<Invoice {UBL_NS}>'
+        "<cbc:CustomizationID>urn:cen.eu:en16931:2017</cbc:CustomizationID><cbc:ProfileID>B1</cbc:ProfileID>"
+        "<cbc:ID>F2025-000001</cbc:ID><cbc:IssueDate>2025-07-01</cbc:IssueDate><cbc:DueDate>2025-07-31</cbc:DueDate>"
+        "<cbc:InvoiceTypeCode>380</cbc:InvoiceTypeCode><cbc:DocumentCurrencyCode>EUR</cbc:DocumentCurrencyCode>"
+        + _party_ubl("AccountingSupplierParty", "100000009")
+        + _party_ubl("AccountingCustomerParty", "200000008")
+        + f'<cac:TaxTotal><cbc:TaxAmount currencyID="EUR">{vat}</cbc:TaxAmount>{subtotals}</cac:TaxTotal>'
+        f'<cac:LegalMonetaryTotal><cbc:TaxExclusiveAmount currencyID="EUR">{total}</cbc:TaxExclusiveAmount></cac:LegalMonetaryTotal>'
+    )
+    body = ""
+    if profile == "full":
+        line = (
+            '<cac:InvoiceLine><cbc:InvoicedQuantity unitCode="C62">1</cbc:InvoicedQuantity><cac:Item><cbc:Name>Article {n}</cbc:Name></cac:Item>'
+            f'<cac:Price><cbc:PriceAmount currencyID="EUR">{line_amount}</cbc:PriceAmount></cac:Price></cac:InvoiceLine>'
+        )
+        body = "".join(line.format(n=n) for n in range(1, lines + 1))
+    return (head + body + "</Invoice>").encode("utf-8")
+
+
+def _party_cii(role: str, name: str, siren: str) -> str:
+    return (
+        f'<ram:{role}><ram:Name>{name}</ram:Name><ram:SpecifiedLegalOrganization><ram:ID schemeID="0002">{siren}</ram:ID></ram:SpecifiedLegalOrganization>'
+        "<ram:PostalTradeAddress><ram:CountryID>FR</ram:CountryID></ram:PostalTradeAddress>"
+        f'<ram:SpecifiedTaxRegistration><ram:ID schemeID="VA">{_vat(siren)}</ram:ID></ram:SpecifiedTaxRegistration></ram:{role}>'
+    )
+
+
+def cii_invoice(lines: int = 1, profile: str = "base") -> bytes:
+    """F1 CII invoice; the F1 Base CII schema has no invoice lines, so there each line is a VAT breakdown row."""
+    line_amount, total, vat = _amounts(lines)
+    head = (
+        f'<?xml version="1.0" encoding="UTF-8"?>\n<rsm:CrossIndustryInvoice {CII_NS}>'
+        "<rsm:ExchangedDocumentContext><ram:BusinessProcessSpecifiedDocumentContextParameter><ram:ID>B1</ram:ID>"
+        "</ram:BusinessProcessSpecifiedDocumentContextParameter><ram:GuidelineSpecifiedDocumentContextParameter>"
+        "<ram:ID>urn:cen.eu:en16931:2017</ram:ID></ram:GuidelineSpecifiedDocumentContextParameter></rsm:ExchangedDocumentContext>"
+        "<rsm:ExchangedDocument><ram:ID>F2025-000001</ram:ID><ram:TypeCode>380</ram:TypeCode>"
+        '<ram:IssueDateTime><udt:DateTimeString format="102">20250701</udt:DateTimeString></ram:IssueDateTime></rsm:ExchangedDocument>'
+        "<rsm:SupplyChainTradeTransaction>"
+    )
+    tax = (
+        "<ram:ApplicableTradeTax><ram:CalculatedAmount>{vat}</ram:CalculatedAmount><ram:TypeCode>VAT</ram:TypeCode>"
+        "<ram:BasisAmount>{basis}</ram:BasisAmount><ram:CategoryCode>S</ram:CategoryCode>"
+        "<ram:RateApplicablePercent>20</ram:RateApplicablePercent></ram:ApplicableTradeTax>"
+    )
+    if profile == "full":
+        line = (
+            "<ram:IncludedSupplyChainTradeLineItem><ram:SpecifiedTradeProduct><ram:Name>Article {n}</ram:Name></ram:SpecifiedTradeProduct>"
+            f"<ram:SpecifiedLineTradeAgreement><ram:GrossPriceProductTradePrice><ram:ChargeAmount>{line_amount}</ram:ChargeAmount>"
+            f"</ram:GrossPriceProductTradePrice><ram:NetPriceProductTradePrice><ram:ChargeAmount>{line_amount}</ram:ChargeAmount>"
+            "</ram:NetPriceProductTradePrice></ram:SpecifiedLineTradeAgreement>"
+            '<ram:SpecifiedLineTradeDelivery><ram:BilledQuantity unitCode="C62">1</ram:BilledQuantity></ram:SpecifiedLineTradeDelivery>'
+            "</ram:IncludedSupplyChainTradeLineItem>"
+        )
+        body = "".join(line.format(n=n) for n in range(1, lines + 1))
+        taxes = tax.format(vat=vat, basis=total)
+    else:
+        body = ""
+        taxes = tax.format(vat="2.00", basis=line_amount) * lines
+    tail = (
+        "<ram:ApplicableHeaderTradeAgreement>"
+        + _party_cii("SellerTradeParty", "Fournisseur SA", "100000009")
+        + _party_cii("BuyerTradeParty", "Client SARL", "200000008")
+        + "</ram:ApplicableHeaderTradeAgreement><ram:ApplicableHeaderTradeDelivery/>"
+        "<ram:ApplicableHeaderTradeSettlement><ram:InvoiceCurrencyCode>EUR</ram:InvoiceCurrencyCode>"
+        + taxes
+        + '<ram:SpecifiedTradePaymentTerms><ram:DueDateDateTime><udt:DateTimeString format="102">20250731</udt:DateTimeString></ram:DueDateDateTime></ram:SpecifiedTradePaymentTerms>'
+        f"<ram:SpecifiedTradeSettlementHeaderMonetarySummation><ram:TaxBasisTotalAmount>{total}</ram:TaxBasisTotalAmount>"
+        f'<ram:TaxTotalAmount currencyID="EUR">{vat}</ram:TaxTotalAmount></ram:SpecifiedTradeSettlementHeaderMonetarySummation>'
+        "</ram:ApplicableHeaderTradeSettlement></rsm:SupplyChainTradeTransaction></rsm:CrossIndustryInvoice>"
+    )
+    return (head + body + tail).encode("utf-8")
+
+
+def cdv_message(lines: int = 1, profile: str = "base") -> bytes:
+    """CPPStatut pivot message carrying one invoice status per line."""
+    head = (
+        '<?xml version="1.0" encoding="UTF-8"?>\n<CPPStatut Version="V1_19"><Enveloppe><EnveloppeUnitaire><Parametres>'
+        "<ParametreIndiv><Code>DtPrd</Code><Valeurparametre>2025-07-01</Valeurparametre></ParametreIndiv>"
+        "<ParametreIndiv><Code>IdFlx</Code><Valeurparametre>FLX-000001</Valeurparametre></ParametreIndiv>"
+        "</Parametres><Partenaires><Recepteur><Id>PPF</Id></Recepteur><Emetteur><Id>PA0001</Id></Emetteur>"
+        f'</Partenaires></EnveloppeUnitaire></Enveloppe><CPPFactureStatuts compteur="{lines}">'
+    )
+    line = (
+        '<CPPFactureStatutUnitaire NumOrdre="{n}"><Fournisseur><TypeIdentifiant>1</TypeIdentifiant><Identifiant>10000000900017</Identifiant>'
+        "<RaisonSociale>Fournisseur SA</RaisonSociale></Fournisseur><Debiteur><TypeIdentifiant>1</TypeIdentifiant>"
+        "<Identifiant>20000000800017</Identifiant></Debiteur><DonneesStatut><IdStatut>01</IdStatut>"
+        "<Horodatage>2025-07-01T10:00:00</Horodatage><IdFacture>F2025-{n:06d}</IdFacture></DonneesStatut></CPPFactureStatutUnitaire>"
+    )
+    body = "".join(line.format(n=n) for n in range(1, lines + 1))
+    return (head + body + "</CPPFactureStatuts></CPPStatut>").encode("utf-8")
+
+
+def ereporting_report(lines: int = 1, profile: str = "base") -> bytes:
+    """Flux 10.3 report of aggregated B2C transactions, one day per line."""
+    head = (
+        '<?xml version="1.0" encoding="UTF-8"?>\n<Report><ReportDocument><Id>RPT-000001</Id>'
+        "<IssueDateTime><DateTimeString>20250801</DateTimeString></IssueDateTime><TypeCode>10.3</TypeCode>"
+        '<Sender><Id schemeId="0002">100000009</Id><Name>Fournisseur SA</Name><RoleCode>SE</RoleCode></Sender>'
+        '<Issuer><Id schemeId="0002">100000009</Id><Name>Fournisseur SA</Name><RoleCode>SE</RoleCode></Issuer></ReportDocument>'
+        "<TransactionsReport><ReportPeriod><StartDate>20250701</StartDate><EndDate>20250731</EndDate></ReportPeriod>"
+    )
+    line = (
+        "<Transactions><Date>{date}</Date><TransactionsCurrency>EUR</TransactionsCurrency><CategoryCode>TLB1</CategoryCode>"
+        "<TaxExclusiveAmount>100.00</TaxExclusiveAmount><TaxTotal>20.00</TaxTotal><TransactionsCount>1</TransactionsCount>"
+        "<TaxSubtotal><TaxPercent>20</TaxPercent><TaxableAmount>100.00</TaxableAmount><TaxTotal>20.00</TaxTotal></TaxSubtotal></Transactions>"
+    )
+    body = "".join(line.format(date=f"202507{n % 31 + 1:02d}") for n in range(lines))
+    return (head + body + "</TransactionsReport></Report>").encode("utf-8")
+
+
+# kind -> (generator, format, flow, profile)
+KINDS: Dict[str, Tuple[Callable[[int, str], bytes], str, Optional[str], Optional[str]]] = {
+    "ubl": (ubl_invoice, "ubl", "f1", "base"),
+    "ubl-full": (ubl_invoice, "ubl", "f1", "full"),
+    "cii": (cii_invoice, "cii", "f1", "base"),
+    "cii-full": (cii_invoice, "cii", "f1", "full"),
+    "cdv": (cdv_message, "cdv", "f6", None),
+    "ereporting": (ereporting_report, "ereporting", "f10", None),
+}
+
+
+def generate(kind: str, lines: int) -> Tuple[bytes, str, Optional[str], Optional[str]]:
+    """(document, format, flow, profile) for a KINDS entry."""
+    if not 1 <= lines <= MAX_LINES:
+        raise ValueError(f"lines must be between 1 and {MAX_LINES}")
+    fn, fmt, flow, profile = KINDS[kind]
+    return fn(lines, profile or "base"), fmt, flow, profile
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--kind", choices=sorted(KINDS), required=True)
+    parser.add_argument("--lines", type=int, default=1)
+    parser.add_argument("--out", type=Path, help="Output file (stdout when omitted)")
+    args = parser.parse_args()
+    data = generate(args.kind, args.lines)[0]
+    if args.out:
+        args.out.write_bytes(data)
+    else:
+        sys.stdout.buffer.write(data)
+
+
+if __name__ == "__main__":
+    main()
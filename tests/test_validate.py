@@ -2,7 +2,81 @@ import unittest
 from pathlib import Path
 from MCP.app.routers.validate import validate_message
 from MCP.app.routers.audit import audit_capabilities
-from MCP.app.models.schemas import ValidateMessageRequest, AuditCapabilitiesRequest
+from MCP.app.routers import reference, validate as validate_router
+import asyncio
+import hashlib
+import io
+import json
+import os
+import tempfile
+import time
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+import httpx
+from lxml import etree
+from MCP.app.models.schemas import ValidateMessageRequest, AuditCapabilitiesRequest, BatchDocument, ValidateIdentifiersRequest
+from MCP.app import main
+from MCP.app.services import annex_store, annuaire, batch, codelists, detect, duplicates, events, identifiers, lifecycle, metrics, pipeline, result_cache, rules_engine, schematron, snapshot, streaming, warmup
+from MCP.app.services.facturx import extract_facturx_xml, extract_facturx_xml_from_file
+from MCP.app.services.executor import ToolExecutor, ToolTimeout
+from MCP.app.services import xsd_validator
+from MCP.app.services.xml_parser import parse_xml
+from MCP.app.services.xsd_validator import XSDValidator, get_registry
+from MCP.app.services.rulebook import Rulebook
+from MCP.app.services.pipeline import IncrementalDocument, PipelineResult, ValidationPipeline
+from MCP.app.services.syntax import SyntaxEntry
+
+
+async def _aiter(items):
+    for item in items:
+        yield item
+
+
+def build_facturx_pdf(xml: bytes, xref_stream: bool = False) -> bytes:
+    """Minimal PDF/A-3 with a FlateDecode factur-x.xml attachment (classic xref or xref stream + object stream)."""
+    data = zlib.compress(xml)
+    objects = {
+        1: b"<< /Type /Catalog /Pages 2 0 R /Names << /EmbeddedFiles 3 0 R >> /AF [4 0 R] >>",
+        2: b"<< /Type /Pages /Kids [] /Count 0 >>",
+        3: b"<< /Names [(factur-x.xml) 4 0 R] >>",
+        4: b"<< /Type /Filespec /F (factur-x.xml) /UF (factur-x.xml) /AFRelationship /Data /EF << /F 5 0 R >> >>",
+    }
+    out = bytearray(b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n")
+    offsets = {}
+    if xref_stream:
+        body, header_parts = b"", []
+        for num in (1, 2, 3, 4):
+            header_parts.append(b"%d %d" % (num, len(body)))
+            body += objects[num] + b"\n"
+        header = b" ".join(header_parts) + b"\n"
+        packed = zlib.compress(header + body)
+        offsets[6] = len(out)
+        out += b"6 0 obj\n<< /Type /ObjStm /N 4 /First %d /Filter /FlateDecode /Length %d >>\nstream\n" % (len(header), len(packed))
+        out += packed + b"\nendstream\nendobj\n"
+    else:
+        for num in (1, 2, 3, 4):
+            offsets[num] = len(out)
+            out += b"%d 0 obj\n" % num + objects[num] + b"\nendobj\n"
+    offsets[5] = len(out)
+    out += b"5 0 obj\n<< /Type /EmbeddedFile /Subtype /text#2Fxml /Filter /FlateDecode /Length %d >>\nstream\n" % len(data)
+    out += data + b"\nendstream\nendobj\n"
+    xref_pos = len(out)
+    if xref_stream:
+        rows = b"\x00\x00\x00\x00"
+        rows += b"".join(b"\x02" + (6).to_bytes(2, "big") + bytes([i]) for i in range(4))
+        rows += b"\x01" + offsets[5].to_bytes(2, "big") + b"\x00"
+        rows += b"\x01" + offsets[6].to_bytes(2, "big") + b"\x00"
+        rows += b"\x01" + xref_pos.to_bytes(2, "big") + b"\x00"
+        out += b"7 0 obj\n<< /Type /XRef /Size 8 /W [1 2 1] /Root 1 0 R /Length %d >>\nstream\n" % len(rows)
+        out += rows + b"\nendstream\nendobj\n"
+    else:
+        out += b"xref\n0 6\n0000000000 65535 f \n"
+        out += b"".join(b"%010d 00000 n \n" % offsets[num] for num in range(1, 6))
+        out += b"trailer\n<< /Size 6 /Root 1 0 R >>\n"
+    out += b"startxref\n%d\n%%%%EOF\n" % xref_pos
+    return bytes(out)
 
 
 class MCPValidateTests(unittest.TestCase):
@@ -45,6 +119,600 @@ class MCPValidateTests(unittest.TestCase):
         # Should raise a G1.09 error for date format
         self.assertTrue(any(issue.ruleId == "G1.09" for issue in report.rules))
 
+    def test_schema_registry_shared_between_validators(self):
+        payload = b"<Report><ReportingDate>20250101</ReportingDate></Report>"
+        XSDValidator().validate(payload, "ereporting", "f10")
+        before = get_registry().stats()
+        XSDValidator().validate(payload, "ereporting", "f10")
+        after = get_registry().stats()
+        self.assertEqual(before["compiled"], after["compiled"])
+        self.assertEqual(after["hits"], before["hits"] + 1)
+        # Concurrent validations borrow separate instances, at most FE_XSD_INSTANCES per schema
+        with mock.patch.dict(os.environ, {"FE_XSD_INSTANCES": "2"}):
+            registry = xsd_validator.SchemaRegistry(xsd_validator.XSD_DIR)
+        validator = XSDValidator(registry=registry)
+        bad = parse_xml(b"<Report><Unknown/></Report>")
+        expected = validator.validate_tree(bad, "ereporting", "f10")
+        with ThreadPoolExecutor(8) as pool:
+            results = list(pool.map(lambda _: validator.validate_tree(bad, "ereporting", "f10"), range(32)))
+        self.assertEqual(results, [expected] * 32)
+        stats = registry.stats()["schemas"]["3- XSD_v3.1/1 - E-reporting/ereporting.xsd"]
+        self.assertEqual(stats["hits"], 32)
+        self.assertLessEqual(stats["instances"], 2)
+
+    def test_pipeline_records_stage_timings(self):
+        payload = b"<Report><ReportingDate>202501-01</ReportingDate></Report>"
+        result = ValidationPipeline().run(payload, "ereporting", "f10")
+        self.assertEqual(set(result.timings), {"parse", "xsd", "rules"})
+        self.assertTrue(result.syntax)
+        self.assertTrue(any(issue.ruleId == "G1.09" for issue in result.rules))
+
+    def test_pipeline_parser_does_not_expand_entities(self):
+        payload = b'<?xml version="1.0"?><!DOCTYPE r [<!ENTITY x SYSTEM "file:///etc/passwd">]><Report><ReportingDate>&x;</ReportingDate></Report>'
+        result = ValidationPipeline().run(payload, "ereporting", "f10")
+        self.assertFalse(any("root:" in issue.message for issue in result.rules))
+
+    def test_pipeline_reports_parser_errors(self):
+        result = ValidationPipeline().run(b"<Report>", "ereporting", "f10")
+        self.assertEqual(len(result.syntax), 1)
+        self.assertEqual(result.rules[0].ruleId, "PARSER")
+
+    def test_incremental_document_matches_single_parse(self):
+        payload = b"\n  <Report><ReportingDate>202501-01</ReportingDate></Report>"
+        document = IncrementalDocument()
+        for i in range(0, len(payload), 7):
+            document.feed(payload[i:i + 7])
+        streamed = ValidationPipeline().run_document(document, "ereporting", "f10")
+        whole = ValidationPipeline().run(payload.strip(), "ereporting", "f10")
+        self.assertEqual(streamed.to_report(), whole.to_report())
+        broken = IncrementalDocument()
+        broken.feed(b"<Report><a></b>")
+        self.assertEqual(ValidationPipeline().run_document(broken, "ereporting", "f10").rules[0].ruleId, "PARSER")
+
+    def test_rulebook_compiles_declarative_rules(self):
+        spec = {"rules": [
+            {"id": "T-1", "flows": ["f1"], "bindings": {"cii": "/Doc/Line"},
+             "check": {"type": "cardinality", "min": 1, "max": 2, "message": "{count} lignes"}},
+            {"id": "T-2", "flows": ["f1"], "bindings": {"cii": {"lines": "/Doc/Line/Amount", "total": "/Doc/Total"}},
+             "check": {"type": "arithmetic", "left": ["lines"], "right": ["total"], "tolerance": 0.01, "message": "{left} != {right}"}},
+            {"id": "T-3", "flows": ["f1"], "bindings": {"cii": "/Doc/Note"}, "required": "Note manquante",
+             "check": {"type": "cardinality", "min": 1, "message": "{count} notes"}},
+        ]}
+        with tempfile.TemporaryDirectory() as tmp:
+            (Path(tmp) / "test.json").write_text(json.dumps(spec), encoding="utf-8")
+            book = Rulebook(Path(tmp))
+        root = etree.fromstring(b"<Doc><Line><Amount>1.5</Amount></Line><Line><Amount>2</Amount></Line><Line><Amount>1</Amount></Line><Total>4</Total></Doc>")
+        issues, codelist_issues = book.evaluate(root, "cii", "f1")
+        self.assertEqual([(i.ruleId, i.message) for i in issues], [("T-1", "3 lignes"), ("T-2", "4.5 != 4"), ("T-3", "Note manquante")])
+        self.assertEqual(book.evaluate(root, "ubl", "f1"), ([], []))
+        # Within bounds: no issue; below the minimum with nodes present: the check message
+        self.assertEqual(book.evaluate(etree.fromstring(b"<Doc><Line/><Note>n</Note></Doc>"), "cii", "f1")[0], [])
+        with tempfile.TemporaryDirectory() as tmp:
+            spec["rules"][2]["check"]["min"] = 2
+            (Path(tmp) / "test.json").write_text(json.dumps(spec), encoding="utf-8")
+            self.assertEqual([i.message for i in Rulebook(Path(tmp)).evaluate(etree.fromstring(b"<Doc><Line/><Note>n</Note></Doc>"), "cii", "f1")[0]],
+                             ["1 notes"])
+
+    def test_rules_use_header_fields_only(self):
+        # The line ID must not stand in for a missing invoice ID (BT-1)
+        ubl = (b'<Invoice xmlns="urn:oasis:names:specification:ubl:schema:xsd:Invoice-2"'
+               b' xmlns:cac="urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2"'
+               b' xmlns:cbc="urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2">'
+               b'<cbc:IssueDate>2025-01-01</cbc:IssueDate><cbc:InvoiceTypeCode>380</cbc:InvoiceTypeCode>'
+               b'<cac:InvoiceLine><cbc:ID>1</cbc:ID><cbc:LineExtensionAmount>10</cbc:LineExtensionAmount></cac:InvoiceLine>'
+               b'<cac:InvoiceLine><cbc:ID>2</cbc:ID><cbc:LineExtensionAmount>5</cbc:LineExtensionAmount></cac:InvoiceLine>'
+               b'<cac:LegalMonetaryTotal><cbc:LineExtensionAmount>15</cbc:LineExtensionAmount></cac:LegalMonetaryTotal></Invoice>')
+        root = etree.fromstring(ubl)
+        issues, codelist_issues = rules_engine.evaluate_tree(root, "ubl", "f1")
+        self.assertEqual([(i.ruleId, i.message) for i in issues], [("G1.05", "Identifiant de facture manquant")])
+        self.assertEqual(codelist_issues, [])
+        group = Rulebook()._groups[("ubl", "f1")]
+        fields = group.extract(root)
+        ns = {"cac": "urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2",
+              "cbc": "urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2"}
+        for expr, nodes in fields.items():
+            self.assertEqual(nodes, root.xpath(expr, namespaces=ns), expr)
+
+    def test_schematron_stage_uses_cached_xslt(self):
+        cii = (b'<rsm:CrossIndustryInvoice xmlns:rsm="urn:un:unece:uncefact:data:standard:CrossIndustryInvoice:100"'
+               b' xmlns:ram="urn:un:unece:uncefact:data:standard:ReusableAggregateBusinessInformationEntity:100">'
+               b'<rsm:ExchangedDocument><ram:ID>F1</ram:ID></rsm:ExchangedDocument></rsm:CrossIndustryInvoice>')
+        with tempfile.TemporaryDirectory() as tmp, mock.patch.dict(os.environ, {schematron.CACHE_DIR_ENV: tmp}):
+            result = ValidationPipeline().run(cii, "cii", "f1", "base", schematron=["en16931-cii"])
+            self.assertIn("schematron", result.timings)
+            failed = {i.ruleId for i in result.rules}
+            self.assertIn("BR-01", failed)
+            self.assertNotIn("BR-02", failed)
+            self.assertEqual(len(list(Path(tmp).glob("en16931-cii.*.xsl"))), 1)
+            reloaded = schematron.SchematronRegistry().entry("en16931-cii")
+            self.assertTrue(reloaded.from_disk)
+        with self.assertRaises(schematron.UnknownRuleSet):
+            schematron.check_rule_sets(["missing"])
+
+    def test_result_cache_serves_repeated_payloads(self):
+        payload = b"<Report><ReportingDate>2025-01-01</ReportingDate></Report>"
+        with tempfile.TemporaryDirectory() as tmp:
+            db = str(Path(tmp) / "results.sqlite")
+            cache = result_cache.ResultCache(max_entries=8, ttl=60, db_path=db)
+            with mock.patch.object(result_cache, "_cache", cache):
+                first = pipeline.validate_bytes(payload, "ereporting", "f10")
+                second = pipeline.validate_bytes(payload, "ereporting", "f10")
+                pipeline.validate_bytes(payload, "ereporting", "f10", "full")
+            self.assertEqual(first, second)
+            self.assertEqual((cache.hits["memory"], cache.misses), (1, 2))
+            # Uploaded Factur-X files are hashed and cached the same way, on the snapshot taken at the start
+            cii = (b'<rsm:CrossIndustryInvoice xmlns:rsm="urn:un:unece:uncefact:data:standard:CrossIndustryInvoice:100"'
+                   b' xmlns:ram="urn:un:unece:uncefact:data:standard:ReusableAggregateBusinessInformationEntity:100">'
+                   b'<rsm:ExchangedDocument><ram:ID>F1</ram:ID></rsm:ExchangedDocument></rsm:CrossIndustryInvoice>')
+            pdf = build_facturx_pdf(cii)
+            with mock.patch.object(result_cache, "_cache", cache):
+                uploaded = pipeline.validate_facturx_file(io.BytesIO(pdf), "f1", "base")
+                self.assertEqual(pipeline.validate_facturx_file(io.BytesIO(pdf), "f1", "base"), uploaded)
+            self.assertEqual((cache.hits["memory"], cache.misses), (2, 3))
+            self.assertEqual(uploaded.snapshotVersion, snapshot.current().version)
+            # A second process-level cache on the same file starts with the disk tier
+            other = result_cache.ResultCache(db_path=db)
+            key = result_cache.cache_key(hashlib.sha256(payload).hexdigest(), "ereporting", "f10", None)
+            self.assertEqual(other.get(key), first)
+            self.assertEqual(other.hits["disk"], 1)
+            self.assertNotEqual(result_cache.cache_key(hashlib.sha256(payload).hexdigest(), "ereporting", "f10", None,
+                                                       version="changed"), key)
+
+    def test_metrics_record_requests_and_stages(self):
+        fresh = {
+            "REQUESTS": metrics.Counter("fe_validation_requests_total", "t", metrics.REQUEST_LABELS),
+            "STAGE_SECONDS": metrics.Histogram("fe_stage_duration_seconds", "t", ("stage",)),
+            "PAYLOAD_BYTES": metrics.Histogram("fe_payload_bytes", "t", ("format",), metrics.SIZE_BUCKETS),
+        }
+        payload = "<Report><ReportingDate>2025-01-01</ReportingDate></Report>"
+        with mock.patch.multiple(metrics, **fresh), mock.patch.dict(os.environ, {result_cache.ENABLED_ENV: "0"}):
+            pipeline.validate_payload(payload, "ereporting", "f10")
+            with mock.patch.object(metrics, "ENABLED", False):
+                pipeline.validate_payload(payload, "ereporting", "f10")
+            text = metrics.render()
+        self.assertIn('fe_validation_requests_total{format="ereporting",flow="f10",profile="",result="invalid"} 1', text)
+        for stage in ("decode", "parse", "xsd", "rules"):
+            self.assertIn(f'fe_stage_duration_seconds_count{{stage="{stage}"}} 1', text)
+        self.assertIn('fe_payload_bytes_bucket{format="ereporting",le="1024"} 1', text)
+        self.assertIn("fe_schema_cache_hit_ratio", text)
+
+    def test_ereporting_stream_reports_issues_per_record(self):
+        records = "".join(f"<Invoice><IssueDate>{'2025-07-01' if i % 2 else '20250701'}</IssueDate></Invoice>" for i in range(50))
+        payload = f"<Report><ReportingDate>2025-07-31</ReportingDate>{records}</Report>".encode()
+        stream = streaming.EReportingStream("f10")
+        found = []
+        for i in range(0, len(payload), 100):
+            found += stream.feed(payload[i:i + 100])
+        found += stream.close()
+        kind, summary = found[-1]
+        self.assertEqual(kind, "summary")
+        self.assertEqual(summary["records"], 50)
+        self.assertFalse(summary["valid"])
+        self.assertEqual(sum(1 for k, v in found if k == "rules" and v.ruleId == "G1.09"), 26)
+        report = events.to_report(found)
+        self.assertEqual(len(report.rules), summary["rules"])
+
+        # Over HTTP the whole body is parsed in one threadpool call, whatever the number of chunks
+        calls = []
+        run = validate_router.run_in_threadpool
+
+        async def tracked(fn, *args):
+            calls.append(fn)
+            return await run(fn, *args)
+
+        async def post(output):
+            chunks = _aiter(payload[i:i + 100] for i in range(0, len(payload), 100))
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test") as client:
+                return await client.post("/validate_message/stream", params={"output": output}, content=chunks,
+                                         headers={"X-FE-Flow": "f10"})
+        with mock.patch.object(validate_router, "run_in_threadpool", tracked):
+            streamed = asyncio.run(post("ndjson"))
+            self.assertEqual(json.loads(streamed.text.splitlines()[-1])["records"], 50)
+            self.assertEqual(len(asyncio.run(post("report")).json()["rules"]), summary["rules"])
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(json.loads(events.ndjson_lines(found[-1:]))["kind"], "summary")
+
+    def test_stream_payload_stops_at_max_errors(self):
+        payload = "<Report>" + "<Bad/>" * 20 + "<ReportingDate>2025-01-01</ReportingDate></Report>"
+        with mock.patch.dict(os.environ, {result_cache.ENABLED_ENV: "0"}):
+            found = list(pipeline.stream_payload(payload, "ereporting", "f10", max_errors=1))
+            full = list(pipeline.stream_payload(payload, "ereporting", "f10"))
+        self.assertEqual([kind for kind, _ in found], ["syntax", "summary"])
+        self.assertTrue(found[-1][1]["truncated"])
+        self.assertEqual(events.to_report(full), pipeline.validate_payload(payload, "ereporting", "f10"))
+        self.assertFalse(full[-1][1]["truncated"])
+        self.assertTrue(events.sse_lines(found[-1:]).startswith(b"event: summary\ndata: "))
+
+    def test_structured_syntax_groups_repeated_errors(self):
+        entries = [SyntaxEntry(i, 0, "SCHEMASV", "SCHEMAV_ELEMENT_CONTENT", f"/Report/Transactions[{i}]/Oops", "Element 'Oops': This element is not expected.", "ERROR", "<string>")
+                   for i in range(1, 4)]
+        result = PipelineResult(syntax=entries + [SyntaxEntry(9, 0, "", "", None, "other")])
+        text = result.to_report()
+        self.assertEqual(text.syntax[0], "<string>:1:0:ERROR:SCHEMASV:SCHEMAV_ELEMENT_CONTENT: Element 'Oops': This element is not expected.")
+        self.assertEqual(len(text.syntax), 4)
+        self.assertIsNone(text.syntaxIssues)
+        structured = result.to_report(structured=True)
+        self.assertEqual([i.count for i in structured.syntaxIssues], [3, 1])
+        self.assertEqual(structured.syntaxIssues[0].path, "/Report/Transactions[1]/Oops")
+        self.assertEqual(len(structured.syntax), 2)
+        report = pipeline.validate_payload("<Report><Bad/></Report>", "ereporting", "f10", structured=True)
+        self.assertEqual(report.syntaxIssues[0].domain, "SCHEMASV")
+
+    def test_validate_batch_reports_each_document(self):
+        docs = [
+            BatchDocument(name="ok", format="ereporting", flow="f10", payload="<Report><ReportingDate>20250101</ReportingDate></Report>"),
+            BatchDocument(name="bad-date", format="ereporting", flow="f10", payload="<Report><ReportingDate>2025-01-01</ReportingDate></Report>"),
+            BatchDocument(name="bad-pdf", format="facturx", payload="not base64 !"),
+        ]
+        with mock.patch.dict(os.environ, {batch.WORKERS_ENV: "1"}):
+            response = batch.run_batch(batch.items_from_requests(docs))
+        self.assertEqual(response.summary.total, 3)
+        self.assertEqual(response.summary.failed, 1)
+        self.assertEqual([r.index for r in response.results], [0, 1, 2])
+        self.assertIsNotNone(response.results[2].error)
+        self.assertTrue(any(i.ruleId == "G1.09" for i in response.results[1].report.rules))
+
+    def test_validate_batch_process_pool(self):
+        docs = [BatchDocument(name=str(i), format="ereporting", flow="f10", payload="<Report><ReportingDate>2025-01-01</ReportingDate></Report>") for i in range(6)]
+        with mock.patch.dict(os.environ, {batch.WORKERS_ENV: "2"}):
+            try:
+                response = batch.run_batch(batch.items_from_requests(docs))
+            finally:
+                batch.shutdown()
+        self.assertEqual(response.summary.invalid, 6)
+        self.assertEqual([r.name for r in response.results], [str(i) for i in range(6)])
+
+    def test_snapshot_reload_recycles_batch_workers(self):
+        docs = [BatchDocument(name=str(i), format="ereporting", flow="f10", payload="<Report><ReportingDate>20250101</ReportingDate></Report>") for i in range(4)]
+        marker = snapshot.SCHEMATRON_DIR / ".reload-test"  # changes the tree state, not the rule sets
+        with mock.patch.dict(os.environ, {batch.WORKERS_ENV: "2", result_cache.ENABLED_ENV: "0"}), \
+                mock.patch.object(snapshot, "_current", None), mock.patch.dict(snapshot._state):
+            try:
+                before = {r.report.snapshotVersion for r in batch.run_batch(batch.items_from_requests(docs)).results}
+                self.assertEqual(before, {snapshot.current().version})
+                marker.write_text("reload")
+                self.assertTrue(snapshot.reload()["reloaded"])
+                after = {r.report.snapshotVersion for r in batch.run_batch(batch.items_from_requests(docs)).results}
+                self.assertEqual(after, {snapshot.current().version})
+                self.assertNotEqual(after, before)
+            finally:
+                marker.unlink(missing_ok=True)
+                batch.shutdown()
+
+    def test_read_zip_documents(self):
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, "w") as archive:
+            archive.writestr("a.xml", "<Report/>")
+            archive.writestr("dir/b.pdf", b"%PDF-1.7")
+        entries = batch.read_zip_documents(buf.getvalue())
+        self.assertEqual([name for name, _ in entries], ["a.xml", "dir/b.pdf"])
+        self.assertEqual(batch.format_for_entry("dir/b.pdf", "cii"), "facturx")
+
+    def test_tool_executor_limits_concurrency_and_times_out(self):
+        executor = ToolExecutor(workers=4, concurrency=1, timeout=0.2)
+
+        async def scenario():
+            first = asyncio.ensure_future(executor.run("slow", time.sleep, 0.1))
+            second = asyncio.ensure_future(executor.run("slow", time.sleep, 0.1))
+            await asyncio.sleep(0.02)
+            depth = executor.queue_depth()
+            await asyncio.gather(first, second)
+            with self.assertRaises(ToolTimeout):
+                await executor.run("slow", time.sleep, 0.5)
+            return depth
+
+        try:
+            self.assertEqual(asyncio.run(scenario()), 1)
+        finally:
+            executor.shutdown()
+        self.assertEqual(executor.stats()["timeouts"], 1)
+        self.assertEqual(executor.queue_depth(), 0)
+
+    def test_annex_store_tracks_source_changes(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            base = Path(tmp)
+            annex7 = {"Tableau des motifs de refus": [["CODE MOTIF", "LIBELLE"], ["DOUBLE_FACT", "Doublon"]]}
+            (base / annex_store.ANNEX7).write_text(json.dumps(annex7), encoding="utf-8")
+            annex_store.write_store(annex_store.build_store(base), base / annex_store.STORE_NAME)
+            store = annex_store.read_store(base / annex_store.STORE_NAME)
+            self.assertTrue(annex_store.is_current(store, base))
+            self.assertEqual(annex_store.load_reference(base)["codelists"]["CDV_REFUS"], [{"code": "DOUBLE_FACT", "label": "Doublon"}])
+            annex7["Tableau des motifs de refus"].append(["DEST_ERR", "Erreur"])
+            (base / annex_store.ANNEX7).write_text(json.dumps(annex7), encoding="utf-8")
+            self.assertFalse(annex_store.is_current(store, base))
+            self.assertEqual(len(annex_store.load_reference(base)["codelists"]["CDV_REFUS"]), 2)
+
+    def test_codelists_compiled_from_xsd_enumerations(self):
+        lists = annex_store.xsd_codelists()
+        self.assertIn("EUR", lists["ISO_ISO3AlphaCurrencyCode"])
+        self.assertIn("58", lists["UNECE_PaymentMeansCode"])
+        index = snapshot.current().codelist_index
+        self.assertEqual(index.codes("ISO4217"), frozenset(lists["ISO_ISO3AlphaCurrencyCode"]))
+        self.assertEqual(index.get("UNTDID1001").label("380"), "Facture")  # annex list kept
+        # Identifier lists too; the XSD code set replaces the annex scrape, whose labels are kept
+        self.assertEqual(index.codes("ISO3166"), frozenset(lists["ISO_ISOTwo-letterCountryCode"]))
+        self.assertEqual(index.get("ISO3166").label("FR"), "France (la)")
+        self.assertEqual(index.get("ISO4217").label("EUR"), "Euro")
+        root = etree.fromstring(
+            b'<Invoice xmlns="urn:oasis:names:specification:ubl:schema:xsd:Invoice-2" xmlns:cbc="urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2"'
+            b' xmlns:cac="urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2"><cbc:DocumentCurrencyCode>EUX</cbc:DocumentCurrencyCode>'
+            b'<cac:TaxTotal><cac:TaxSubtotal><cac:TaxCategory><cbc:ID>S</cbc:ID></cac:TaxCategory></cac:TaxSubtotal>'
+            b'<cac:TaxSubtotal><cac:TaxCategory><cbc:ID>Q</cbc:ID></cac:TaxCategory></cac:TaxSubtotal></cac:TaxTotal></Invoice>')
+        _, codelist_issues = rules_engine.evaluate_tree(root, "ubl", "f1")
+        self.assertEqual(sorted(i.ruleId for i in codelist_issues), ["BR-CL-17", "G1.10"])
+
+    def test_facturx_extracts_compressed_attachment(self):
+        xml = b'<?xml version="1.0"?><rsm:CrossIndustryInvoice xmlns:rsm="urn:x"></rsm:CrossIndustryInvoice>'
+        for xref_stream in (False, True):
+            pdf = build_facturx_pdf(xml, xref_stream=xref_stream)
+            self.assertEqual(extract_facturx_xml(pdf), xml)
+            self.assertEqual(extract_facturx_xml(memoryview(pdf)), xml)
+            with tempfile.TemporaryFile() as fh:
+                fh.write(pdf)
+                fh.seek(0)
+                self.assertEqual(extract_facturx_xml_from_file(fh), xml)
+        legacy = b"%PDF-1.4\ngarbage " + xml + b" trailing"
+        self.assertEqual(extract_facturx_xml(legacy), xml)
+
+    def test_detect_format_flow_and_profile(self):
+        cbc = "urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2"
+        credit_note = (f'<?xml version="1.0"?>\n<CreditNote xmlns="urn:oasis:names:specification:ubl:schema:xsd:CreditNote-2" '
+                       f'xmlns:cbc="{cbc}"><cbc:CustomizationID>urn:cen.eu:en16931:2017</cbc:CustomizationID>'
+                       f'<cbc:ID>AV-1</cbc:ID></CreditNote>').encode()
+        self.assertEqual(detect.detect(credit_note)[:3], ("creditnote-ubl", "f1", "base"))
+        self.assertEqual(detect.detect(credit_note, "lots/Full_AV-1.xml").profile, "full")
+        cii = (b'<rsm:CrossIndustryInvoice xmlns:rsm="urn:un:unece:uncefact:data:standard:CrossIndustryInvoice:100" '
+               b'xmlns:ram="urn:un:unece:uncefact:data:standard:ReusableAggregateBusinessInformationEntity:100">'
+               b'<rsm:ExchangedDocumentContext><ram:GuidelineSpecifiedDocumentContextParameter>'
+               b'<ram:ID>urn:cen.eu:en16931:2017#conformant#urn:factur-x.eu:1p0:extended</ram:ID>'
+               b'</ram:GuidelineSpecifiedDocumentContextParameter></rsm:ExchangedDocumentContext>')
+        self.assertEqual(detect.detect(cii)[:3], ("cii", "f1", "full"))
+        self.assertEqual(detect.detect(b"  <Report><Invoice>")[:2], ("ereporting", "f10"))
+        self.assertEqual(detect.detect(build_facturx_pdf(cii))[:2], ("facturx", "f1"))
+        with self.assertRaises(detect.UnknownFormat):
+            detect.detect(b"<Other/>")
+        # Resolved before the parse: the credit note schema and its own rule bindings are used
+        with mock.patch.dict(os.environ, {result_cache.ENABLED_ENV: "0"}):
+            report = pipeline.validate_bytes(credit_note, "auto")
+            with self.assertRaises(pipeline.PayloadError):
+                pipeline.validate_bytes(b"not xml", "auto")
+        self.assertFalse(any("No schema found" in s for s in report.syntax))
+        self.assertIn("G1.09", [r.ruleId for r in report.rules])
+
+    def test_credit_note_rule_bindings(self):
+        credit_note = (b'<CreditNote xmlns="urn:oasis:names:specification:ubl:schema:xsd:CreditNote-2"'
+                       b' xmlns:cac="urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2"'
+                       b' xmlns:cbc="urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2">'
+                       b'<cbc:ID>AV-1</cbc:ID><cbc:IssueDate>2025-01-01</cbc:IssueDate>'
+                       b'<cbc:CreditNoteTypeCode>381</cbc:CreditNoteTypeCode>'
+                       b'<cac:LegalMonetaryTotal><cbc:LineExtensionAmount>15</cbc:LineExtensionAmount></cac:LegalMonetaryTotal>'
+                       b'<cac:CreditNoteLine><cbc:ID>1</cbc:ID><cbc:LineExtensionAmount>10</cbc:LineExtensionAmount></cac:CreditNoteLine>'
+                       b'<cac:CreditNoteLine><cbc:ID>2</cbc:ID><cbc:LineExtensionAmount>4</cbc:LineExtensionAmount></cac:CreditNoteLine>'
+                       b'</CreditNote>')
+        issues, codelist_issues = rules_engine.evaluate_tree(etree.fromstring(credit_note), "creditnote-ubl", "f1")
+        # The type code is read from CreditNoteTypeCode and the line sum from CreditNoteLine
+        self.assertEqual([i.ruleId for i in issues], ["BR-CO-10"])
+        self.assertIn("(14", issues[0].message)
+        self.assertEqual(codelist_issues, [])
+        self.assertTrue({"creditnote-ubl"} <= duplicates.FORMATS & annuaire.FORMATS)
+
+    def test_codelist_index_lookups_and_etag(self):
+        index = codelists.CodelistIndex({"L": [{"code": "380", "label": "Facture"}, {"code": "381", "label": "Avoir"},
+                                               {"code": "FA", "label": "Autre"}], "C": ["B1", "S1"]})
+        listing = index.get("L")
+        self.assertIn("381", listing)
+        self.assertNotIn("999", listing)
+        self.assertEqual(listing.label("380"), "Facture")
+        self.assertEqual([e["code"] for e in listing.search("38")], ["380", "381"])
+        self.assertEqual([e["code"] for e in listing.search("a")], ["FA", "381"])
+        self.assertEqual(index.codes("C"), frozenset({"B1", "S1"}))
+        self.assertEqual(json.loads(listing.body)[2]["code"], "FA")
+        self.assertTrue(codelists.etag_matches(f'W/"x", {listing.etag}', listing.etag))
+        self.assertFalse(codelists.etag_matches('"x"', listing.etag))
+        request = mock.Mock(headers={"if-none-match": snapshot.current().codelist_index.get("UNTDID1001").etag})
+        self.assertEqual(reference.get_codelist("UNTDID1001", request, None, 50).status_code, 304)
+        self.assertTrue(reference.check_code("UNTDID1001", "380")["valid"])
+
+    def test_ready_after_warm_up(self):
+        warmup.reset()
+        self.assertEqual(main.ready().status_code, 503)
+        # Fresh snapshot so test_schematron_stage_uses_cached_xslt still sees a cold Schematron registry
+        with mock.patch.object(snapshot, "_current", None):
+            steps = warmup.run()
+        self.assertEqual(set(steps), {"reference", "xsd", "schematron", "rulebook", "ereporting", "duplicates", "annuaire"})
+        response = main.ready()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.body)["warmedInPid"], os.getpid())
+        self.assertTrue(get_registry().stats()["compiled"])
+
+    def test_admin_endpoints_fail_closed(self):
+        env = {reference.ADMIN_TOKEN_ENV: "", reference.ADMIN_OPEN_ENV: ""}
+        with mock.patch.dict(os.environ, env):
+            with self.assertRaises(reference.HTTPException) as raised:
+                reference._check_admin("anything")
+            self.assertEqual(raised.exception.status_code, 503)
+            os.environ[reference.ADMIN_OPEN_ENV] = "1"
+            reference._check_admin(None)
+            os.environ[reference.ADMIN_TOKEN_ENV] = "s3cret"
+            for wrong in (None, "", "s3cre", "s3cret2"):
+                with self.assertRaises(reference.HTTPException) as raised:
+                    reference._check_admin(wrong)
+                self.assertEqual(raised.exception.status_code, 403)
+            reference._check_admin("s3cret")
+
+    def test_snapshot_reload_keeps_running_validations_on_old_version(self):
+        payload = b"<Report><ReportingDate>2025-01-01</ReportingDate></Report>"
+        changed = {**annex_store.load_reference(), "contentHash": "changed"}
+        with mock.patch.object(snapshot, "_current", None), mock.patch.dict(snapshot._state), \
+                mock.patch.dict(os.environ, {result_cache.ENABLED_ENV: "0"}):
+            old = snapshot.current()
+            self.assertEqual(pipeline.validate_bytes(payload, "ereporting", "f10").snapshotVersion, old.version)
+            self.assertFalse(snapshot.reload()["reloaded"])  # sources unchanged
+            stream = streaming.EReportingStream("f10")
+            with mock.patch.object(annex_store, "load_reference", return_value=changed):
+                info = snapshot.reload()
+            new = snapshot.current()
+            self.assertEqual((info["reloaded"], info["previous"], info["version"]), (True, old.version, new.version))
+            self.assertNotEqual(new.version, old.version)
+            self.assertTrue(new.schemas.stats()["compiled"])  # compiled before being published
+            summary = (stream.feed(payload) + stream.close())[-1][1]
+            self.assertEqual(summary["snapshotVersion"], old.version)
+            self.assertEqual(pipeline.validate_bytes(payload, "ereporting", "f10").snapshotVersion, new.version)
+
+    def test_duplicate_index_reports_double_fact(self):
+        invoice = etree.fromstring(
+            b'<Invoice xmlns="urn:oasis:names:specification:ubl:schema:xsd:Invoice-2" '
+            b'xmlns:cac="urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2" '
+            b'xmlns:cbc="urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2">'
+            b'<cbc:ID>F2025-001</cbc:ID><cbc:IssueDate>2025-07-01</cbc:IssueDate><cac:AccountingSupplierParty><cac:Party>'
+            b'<cac:PartyLegalEntity><cbc:CompanyID>100 000 009</cbc:CompanyID></cac:PartyLegalEntity>'
+            b'</cac:Party></cac:AccountingSupplierParty></Invoice>')
+        index = duplicates.DuplicateIndex(capacity=1000, refresh=0)
+        with mock.patch.object(duplicates, "_index", index), mock.patch.dict(os.environ, {duplicates.CHECK_ENV: "1"}):
+            self.assertNotIn("DOUBLE_FACT", [i.ruleId for i in rules_engine.evaluate_tree(invoice, "ubl", "f1")[0]])
+            self.assertEqual(index.queries, 0)  # unknown key answered by the Bloom filter
+            token = duplicates.cache_token()
+            keys = [duplicates.DuplicateKey.of("100000009", f"F2025-{n:03d}", "20250701") for n in range(1, 100)]
+            self.assertEqual(index.add_many(keys), 99)
+            self.assertEqual(index.add_many(keys[:1]), 0)
+            self.assertNotEqual(duplicates.cache_token(), token)
+            issues = rules_engine.evaluate_tree(invoice, "ubl", "f1")[0]
+            self.assertIn("DOUBLE_FACT", [i.ruleId for i in issues])
+            self.assertNotIn(duplicates.DuplicateKey.of("100000009", "F2025-001", "2024"), index)
+        self.assertEqual(rules_engine.evaluate_tree(invoice, "ubl", "f1")[0], [i for i in issues if i.ruleId != "DOUBLE_FACT"])
+        # Several workers: a WAL file in the shared state directory, seen by every process
+        with tempfile.TemporaryDirectory() as tmp, mock.patch.dict(os.environ, {"FE_WORKERS": "4", "FE_STATE_DIR": tmp}):
+            os.environ.pop(duplicates.DB_ENV, None)
+            first, second = duplicates.DuplicateIndex.from_env(), duplicates.DuplicateIndex.from_env()
+            self.assertEqual(first.db_path, str(Path(tmp) / "duplicates.sqlite3"))
+            self.assertEqual(first._db().execute("PRAGMA journal_mode").fetchone()[0], "wal")
+            first.add_many(keys[:3])
+            second.pull()
+            self.assertIn(keys[0], second)
+
+    def test_next_status_keeps_published_map(self):
+        self.assertEqual(reference.next_status({})["allowed"], ["CDV-200"])
+        self.assertEqual(reference.next_status({"current": "CDV-200"})["allowed"], ["CDV-202"])
+        self.assertEqual(reference.next_status({"current": "CDV-202"})["allowed"], ["CDV-203", "CDV-213"])
+        self.assertEqual(reference.next_status({"current": "CDV-212"})["allowed"], [])
+        self.assertEqual(reference.next_status({"current": "CDV-200"})["transitions"], lifecycle.TRANSITIONS["CDV-200"])
+
+    def test_cdv_lifecycle_ingest_and_transition_check(self):
+        def message(invoice, status):
+            return (f"<CPPStatut><CPPFactureStatuts><CPPFactureStatutUnitaire><Fournisseur><TypeIdentifiant>1</TypeIdentifiant>"
+                    f"<Identifiant>100 000 009 00011</Identifiant><RaisonSociale>V</RaisonSociale></Fournisseur><Debiteur/>"
+                    f"<DonneesStatut><IdStatut>01</IdStatut><ComplementStatut>{status}</ComplementStatut>"
+                    f"<Horodatage>2025-07-01T10:00:00</Horodatage><IdFacture>{invoice}</IdFacture></DonneesStatut>"
+                    f"</CPPFactureStatutUnitaire></CPPFactureStatuts></CPPStatut>").encode()
+
+        store = lifecycle.LifecycleStore()
+        events = [e for status in ("CDV-200", "CDV-202", "CDV-212", "CDV-202", "CDV-203")
+                  for e in lifecycle.events_from_tree(etree.fromstring(message("F1", status)))]
+        self.assertEqual(events[0].invoice, "10000000900011/F1")
+        with mock.patch.object(lifecycle, "BATCH_SIZE", 2):
+            results = [o.result for o in store.ingest(events)]
+        self.assertEqual(results, ["accepted", "accepted", "rejected", "duplicate", "accepted"])
+        self.assertEqual(store.current("10000000900011/F1"), "CDV-203")
+        self.assertEqual(len(store.history("10000000900011/F1")), 3)
+        with mock.patch.object(lifecycle, "_store", store), mock.patch.dict(os.environ, {lifecycle.CHECK_ENV: "1"}):
+            self.assertEqual(reference.next_status({"invoice": "10000000900011/F1"}),
+                             {"allowed": ["CDV-205", "CDV-207"], "transitions": lifecycle.TRANSITIONS["CDV-203"]})
+            issues = rules_engine.evaluate(message("F1", "CDV-200"), "cdv", "f6")[0]
+            self.assertIn("CDV-TRANSITION", [i.ruleId for i in issues])
+            self.assertNotIn("CDV-TRANSITION", [i.ruleId for i in rules_engine.evaluate(message("F1", "CDV-205"), "cdv", "f6")[0]])
+        self.assertEqual(store.current("10000000900011/F1"), "CDV-203")
+        # Several workers: a WAL file in the shared state directory, read by every process
+        with tempfile.TemporaryDirectory() as tmp, mock.patch.dict(os.environ, {"FE_WORKERS": "2", "FE_STATE_DIR": tmp}):
+            os.environ.pop(lifecycle.DB_ENV, None)
+            first, second = lifecycle.LifecycleStore.from_env(), lifecycle.LifecycleStore.from_env()
+            self.assertEqual(first._db().execute("PRAGMA journal_mode").fetchone()[0], "wal")
+            first.ingest(lifecycle.events_from_tree(etree.fromstring(message("F2", "CDV-200"))))
+            self.assertEqual((second.current("10000000900011/F2"), second.generation), ("CDV-200", first.generation))
+
+    def test_annuaire_index_resolves_recipients(self):
+        def line(nature, start, siren_ids, platform, end=""):
+            return (f"<LigneAnnuaire><Nature>{nature}</Nature><DateEffet><DateDebut>{start}</DateDebut>"
+                    f"{f'<DateFin>{end}</DateFin>' if end else ''}</DateEffet><InfoAdressage><Identifiant>"
+                    f"<IdLinSIREN qualifiant='0002'>100000009</IdLinSIREN>{siren_ids}</Identifiant></InfoAdressage>"
+                    f"<IdPlateforme>{platform}</IdPlateforme></LigneAnnuaire>")
+
+        siret = "<IdLinSIRET qualifiant='0009'>10000000900011</IdLinSIRET>"
+        f13 = ("<AnnuaireActualisation><BlocCodesRoutage><CodeRoutage><Statut>I</Statut>"
+               "<IdSIRET qualifiant='0009'>10000000900011</IdSIRET><IdRoutage qualifiant='0224'>SERV1</IdRoutage>"
+               "<Nom>S</Nom></CodeRoutage></BlocCodesRoutage><BlocLignesAnnuaire>"
+               + line("D", "20250101", "", "0001")
+               + line("D", "20250101", siret, "0002", end="20260101")
+               + line("D", "20250101", siret + "<IdLinRoutage qualifiant='0224'>SERV1</IdLinRoutage>", "0003")
+               + line("D", "20250101", "<Suffixe>FACT</Suffixe>", "0004")
+               + line("M", "20250901", "<Suffixe>FACT</Suffixe>", "0004")
+               + "</BlocLignesAnnuaire></AnnuaireActualisation>").encode()
+        index = annuaire.AnnuaireIndex().merged(*annuaire.parse_file(f13))
+        self.assertEqual(len(index), 5)
+        resolve = lambda ident, date: annuaire.resolve(ident, date, index)
+        self.assertEqual(resolve("100000009_10000000900011", "2025-06-01").line.platform, "0002")
+        self.assertEqual(resolve("100000009_10000000900011", "2026-06-01").line.platform, "0001")  # SIRET line ended
+        self.assertEqual(resolve("100000009_10000000900011_SERV1", "2025-06-01").reason, "code routage inactif")
+        self.assertTrue(resolve("100000009_FACT", "2025-06-01").addressable)
+        self.assertFalse(resolve("100000009_FACT", "2025-10-01").addressable)
+        self.assertFalse(resolve("200000008", "2025-06-01").addressable)
+        updated = index.merged([annuaire.Line(100000009, -1, None, None, 20250101, 0, "0007", False)])
+        self.assertEqual((len(updated), resolve("100000009", "2025-06-01").line.platform), (5, "0001"))
+        self.assertEqual(annuaire.resolve("100000009", "2025-06-01", updated).line.platform, "0007")
+        with self.assertRaises(annuaire.AnnuaireError):
+            annuaire.parse_file(b"<AnnuaireActualisation><Inconnu/></AnnuaireActualisation>")
+
+        # Loads go through a spool shared by the workers, merged in sequence order by each of them
+        update = ("<AnnuaireActualisation><BlocLignesAnnuaire>" + line("D", "20250101", "", "0009")
+                  + "</BlocLignesAnnuaire></AnnuaireActualisation>").encode()
+        with tempfile.TemporaryDirectory() as tmp, \
+                mock.patch.dict(os.environ, {annuaire.SPOOL_ENV: tmp, annuaire.REFRESH_ENV: "0", annuaire.FILES_ENV: ""}), \
+                mock.patch.multiple(annuaire, _index=None, _applied=0, _synced=0.0):
+            annuaire.load(f13)
+            first_worker = annuaire._index, annuaire._applied
+            annuaire._index, annuaire._applied = None, 0
+            self.assertEqual(len(annuaire.get_index()), 5)
+            annuaire.load(update)
+            self.assertEqual(sorted(os.listdir(tmp)), ["000000000001.xml", "000000000002.xml"])
+            annuaire._index, annuaire._applied = first_worker
+            self.assertEqual(annuaire.resolve("100000009", "2025-06-01").line.platform, "0009")
+            self.assertEqual(annuaire._applied, 2)
+
+        invoice = etree.fromstring(
+            b'<Invoice xmlns="urn:oasis:names:specification:ubl:schema:xsd:Invoice-2" '
+            b'xmlns:cac="urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2" '
+            b'xmlns:cbc="urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2">'
+            b'<cbc:ID>F1</cbc:ID><cbc:IssueDate>2025-10-01</cbc:IssueDate><cac:AccountingCustomerParty><cac:Party>'
+            b'<cbc:EndpointID schemeID="0225">100000009_FACT</cbc:EndpointID></cac:Party></cac:AccountingCustomerParty></Invoice>')
+        with mock.patch.object(annuaire, "_index", index), mock.patch.dict(os.environ, {annuaire.CHECK_ENV: "1"}):
+            self.assertIn("ANN-ADRESSAGE", [i.ruleId for i in rules_engine.evaluate_tree(invoice, "ubl", "f1")[0]])
+
+    def test_identifiers_bulk_and_document_checks(self):
+        values = ["732829320", "732829321", "73282932000074", "35600000000048", "35600000000015",
+                  "fr 40 303 265 045", "FR41303265045", "FR40303265046", "73282932A", ""]
+        self.assertEqual(identifiers.validate_many(values, vectorised=False), "0202003211")
+        self.assertEqual(identifiers.validate_many(values, "siren", vectorised=False), "0211111111")
+        if identifiers.np is not None:
+            for kind in identifiers.KINDS:
+                self.assertEqual(identifiers.validate_many(values * 20, kind, vectorised=True),
+                                 identifiers.validate_many(values * 20, kind, vectorised=False))
+        report = reference.validate_identifiers(ValidateIdentifiersRequest(identifiers=values))
+        self.assertEqual((report["total"], report["valid"], report["codes"]), (10, 4, "0202003211"))
+        with mock.patch.dict(os.environ, {identifiers.MAX_ENV: "5"}), self.assertRaises(reference.HTTPException):
+            reference.validate_identifiers(ValidateIdentifiersRequest(identifiers=values))
+
+        invoice = (b'<Invoice xmlns="urn:oasis:names:specification:ubl:schema:xsd:Invoice-2" '
+                   b'xmlns:cac="urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2" '
+                   b'xmlns:cbc="urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2">'
+                   b'<cbc:ID>F1</cbc:ID><cac:AccountingSupplierParty><cac:Party><cac:PartyTaxScheme>'
+                   b'<cbc:CompanyID>FR41303265045</cbc:CompanyID></cac:PartyTaxScheme><cac:PartyLegalEntity>'
+                   b'<cbc:CompanyID schemeID="0002">732829321</cbc:CompanyID></cac:PartyLegalEntity></cac:Party>'
+                   b'</cac:AccountingSupplierParty><cac:AccountingCustomerParty><cac:Party><cac:PartyTaxScheme>'
+                   b'<cbc:CompanyID>DE123456789</cbc:CompanyID></cac:PartyTaxScheme></cac:Party></cac:AccountingCustomerParty></Invoice>')
+        issues = rules_engine.evaluate(invoice, "ubl", "f1")[0]
+        self.assertEqual(sorted(i.ruleId for i in issues if i.ruleId.startswith("ID-")), ["ID-SIREN", "ID-TVA"])
+        annuaire_doc = b"<AnnuaireActualisation><IdSIREN qualifiant='0002'>732829321</IdSIREN></AnnuaireActualisation>"
+        self.assertIn("ANN-SIREN", [i.ruleId for i in rules_engine.evaluate(annuaire_doc, "annuaire", "f13")[0]])
+
     def test_audit_capabilities(self):
         req = AuditCapabilitiesRequest(formats=["ubl"], profiles=["base"], cdv_statuses=["CDV-200"], cadres=["B1"], annuaire=True, facturx=False)
         gaps = audit_capabilities(req)